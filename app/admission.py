@@ -0,0 +1,97 @@
+"""
+Admission control for the analyses run in the web process.
+
+At most max_running analyses run at once; the next ones wait their turn, first come first
+served, and once max_waiting are waiting further uploads are turned away (POST /upload
+answers 429 with Retry-After). Under a burst, throughput stays that of max_running
+analyses instead of every pipeline slowing down until all of them hit STEP_TIMEOUT.
+
+Waits are estimated from the moving average of recent analysis durations.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+
+
+class AdmissionControl:
+    def __init__(self, max_running: int, max_waiting: int, estimate_seconds: float = 30.0, clock=time.monotonic):
+        self.max_running = max_running  # 0 = no limit: everything runs at once
+        self.max_waiting = max_waiting  # 0 = no limit on the queue
+        self.average_seconds = estimate_seconds  # until analyses have been timed
+        self._clock = clock
+        self.running = {}  # key -> clock() when it started
+        self.waiting = OrderedDict()  # key -> asyncio.Future set when it may start
+        self.counters = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    def full(self) -> bool:
+        """
+        True if a new analysis would neither start nor find room in the queue.
+        """
+        if not self.max_running or len(self.running) < self.max_running:
+            return False
+        return bool(self.max_waiting) and len(self.waiting) >= self.max_waiting
+
+    def enqueue(self, key: str) -> bool:
+        """
+        Takes a place for analysis key: a running slot if one is free (returns True), else the
+        end of the queue (returns False; await admit(key) to wait for the slot). Call
+        release(key) once the analysis is done or abandoned.
+        """
+        if not self.max_running or (len(self.running) < self.max_running and not self.waiting):
+            self.running[key] = self._clock()
+            self.counters["admitted"] += 1
+            return True
+        self.waiting[key] = asyncio.get_running_loop().create_future()
+        self.counters["queued"] += 1
+        return False
+
+    async def admit(self, key: str):
+        """
+        Waits until analysis key may start.
+        """
+        admitted = self.waiting.get(key)
+        if admitted is not None:
+            # shield: a cancelled wait leaves the future to release()
+            await asyncio.shield(admitted)
+
+    def release(self, key: str, completed: bool = True):
+        """
+        Frees the place of analysis key (waiting or running) and starts the next ones. The
+        duration of a completed run feeds the wait estimate.
+        """
+        started = self.running.pop(key, None)
+        if started is None:
+            self.waiting.pop(key, None)
+        elif completed:
+            self.average_seconds = 0.8 * self.average_seconds + 0.2 * (self._clock() - started)
+        while self.waiting and len(self.running) < self.max_running:
+            key, admitted = self.waiting.popitem(last=False)
+            self.running[key] = self._clock()
+            self.counters["admitted"] += 1
+            if not admitted.done():
+                admitted.set_result(None)
+
+    def estimated_wait(self, position: int) -> float:
+        """
+        Seconds until the analysis at position in the queue can be expected to start: the
+        slots free up about once per average duration each.
+        """
+        return round(self.average_seconds * math.ceil(position / max(1, self.max_running)), 1)
+
+    def retry_after(self) -> int:
+        """
+        Seconds a turned away upload should wait before trying again: a place in the queue
+        frees up when the first waiting analysis starts.
+        """
+        return max(1, math.ceil(self.estimated_wait(1)))
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self.running),
+            "waiting": len(self.waiting),
+            "max_running": self.max_running,
+            "max_waiting": self.max_waiting,
+            "average_seconds": round(self.average_seconds, 3),
+            **self.counters,
+        }
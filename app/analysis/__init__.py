@@ -2,6 +2,64 @@ from .analysis import analyze_image as analyze_image
 from .analysis import prepare_image as prepare_image
 from .analysis import compute_fractal_stats as compute_fractal_stats
 from .analysis import extract_metadata as extract_metadata
+from .analysis import extract_metadata_from_bytes as extract_metadata_from_bytes
 from .aiclassifiers import detect_ai as detect_ai
 from .artmedium import analyze_art_medium as analyze_art_medium
 from .object_detection import detect_objects as detect_objects
+from .pyramid import ImagePyramid as ImagePyramid
+from .phash import perceptual_hash as perceptual_hash
+from .phash import HammingIndex as HammingIndex
+from .summarizer import SUMMARY_FAILED
+
+import hashlib
+
+# Bump when any analyzer's output changes, so cached results from older code aren't reused
+ANALYZER_VERSION = "1"
+# Bump a step's version when its output changes: only that step (and the steps fed by it)
+# is recomputed for cached uploads and by the backfill (python -m app.backfill)
+STEP_VERSIONS = {
+    "Metadata Analysis": "2",  # 2: always read from the upload bytes
+    "Color Intensity Distribution": "2",  # 2: counts scaled to the original's pixels
+    "AI Classifier": "1",
+    "Fractal Dimension": "1",
+    "Art Medium Analysis": "1",
+    "Object Detection": "1",
+    "Insight Summary": "1",
+}
+# Steps whose input is other steps' output
+STEP_INPUTS = {
+    "Insight Summary": ("Metadata Analysis", "AI Classifier", "Fractal Dimension",
+                        "Art Medium Analysis", "Object Detection"),
+}
+
+def step_version(step: str) -> str:
+    """
+    Cache key for one step's code plus the settings and upstream steps that change its result.
+    """
+    from .analysis import ANALYSIS_MAX_SIDE
+    from .artmedium import TEXTURE_MODE
+    version = STEP_VERSIONS[step]
+    if step != "Metadata Analysis":
+        # Everything but the metadata reads the decoded pixels
+        version += f";max_side={ANALYSIS_MAX_SIDE}"
+    if step == "Art Medium Analysis":
+        version += f";texture={TEXTURE_MODE}"
+    if step in STEP_INPUTS:
+        inputs = ",".join(step_version(name) for name in STEP_INPUTS[step])
+        version += f";inputs={hashlib.sha1(inputs.encode()).hexdigest()[:12]}"
+    return version
+
+def step_failed(step: str, result) -> bool:
+    """
+    True if a step's output is the placeholder it returns after an error: None for the model
+    steps, SUMMARY_FAILED for the summary. Such output is neither cached nor stored as the
+    step's current version.
+    """
+    return result is None or (step == "Insight Summary" and result == SUMMARY_FAILED)
+
+def analyzer_version() -> str:
+    """
+    Cache key for the analysis code plus the settings that change its results.
+    """
+    steps = ",".join(f"{step}={step_version(step)}" for step in STEP_VERSIONS)
+    return f"{ANALYZER_VERSION};steps={hashlib.sha1(steps.encode()).hexdigest()[:12]}"
@@ -1,37 +1,52 @@
 from transformers import pipeline
 from PIL import Image
 
-from threading import Lock
+from .batching import MicroBatcher
+from .cancellation import AnalysisCancelled, check_cancelled
+from .pyramid import at_resolution
+from .registry import model_registry
+
+# Short side requested from the image pyramid; the model's processor resizes from there
+INPUT_SHORT_SIDE = 384
+
+def _load_ai_classifier():
+    # Use a high-quality AI image detector
+    # This might download >500MB on first run
+    return pipeline("image-classification", model="Ateeqq/ai-vs-human-image-detector")
 
 # Lazy loading of AI classifier
-_ai_classifier = None
-_lock = Lock()
+model_registry.register("ai_classifier", _load_ai_classifier)
 
 def get_ai_classifier():
-    global _ai_classifier
-    with _lock:
-        if _ai_classifier is None:
-            # Use a high-quality AI image detector
-            # This might download >500MB on first run
-            _ai_classifier = pipeline("image-classification", model="Ateeqq/ai-vs-human-image-detector")
-    return _ai_classifier
+    return model_registry.get("ai_classifier")
+
+def _classify_batch(images, cancel_tokens):
+    with model_registry.in_use("ai_classifier"):
+        classifier = get_ai_classifier()
+        # A list input yields one result list per image
+        return classifier(images, batch_size=len(images))
+
+_batcher = MicroBatcher("ai_classifier", _classify_batch)
 
 def warmup_classifier():
-    get_ai_classifier()
+    # A dummy inference, so the first real request doesn't pay for lazy kernel setup
+    _classify_batch([Image.new("RGB", (224, 224))], [None])
 
-def detect_ai(image: Image.Image):
+def detect_ai(image: Image.Image, cancel_token=None):
     """
     Detects if an image is AI-generated.
     Returns the probability of being AI-generated (0.0 to 1.0).
     """
     try:
-        classifier = get_ai_classifier()
-        results = classifier(image)
+        check_cancelled(cancel_token)
+        results = _batcher.infer(at_resolution(image, INPUT_SHORT_SIDE), cancel_token)
         # Find the 'AI' label score
         for res in results:
             if res['label'].upper() == 'AI':
                 return float(res['score'])
         return 0.0
+    except AnalysisCancelled:
+        raise
     except Exception as e:
         print(f"AI classifier error: {e}")
         return None
@@ -2,21 +2,30 @@ import cv2
 from PIL import Image
 import numpy as np
 import io
+import os
 from PIL import ExifTags
 
 from .aiclassifiers import detect_ai
-from .fractaldim import fractal_dimension
+from .fractaldim import fractal_profile
+from .cancellation import check_cancelled
 
-def compute_fractal_stats(np_image):
+# Uploads are decoded to at most this long side (0 = native resolution). JPEGs get there
+# through reduced DCT decoding, so a 40 MP scan is never materialized at full size.
+ANALYSIS_MAX_SIDE = int(os.environ.get("ANALYSIS_MAX_SIDE", "2048"))
+# Fractal dimension input size (square)
+FRACTAL_SIZE = 256
+
+def compute_fractal_stats(np_image, cancel_token=None):
     """
     Computes fractal dimensions for the image at different scales:
     - Default: Full range (2 to M//2)
-    - (commented out) Small: Fine details (2 to M//8)
-    - (commented out) Large: Coarse structure (M//8 to M//2)
+    - Small: Fine details (2 to M//8)
+    - Large: Coarse structure (M//8 to M//2)
+    All three come from a single box-counting pass (see fractal_profile).
     """
     # Resize to a smaller standard size for performance (Fractal Dim calculation is expensive)
     # Resizing to 256x256 ensures reasonable execution time while maintaining statistical validity.
-    resized_img = cv2.resize(np_image, (256, 256), interpolation=cv2.INTER_AREA)
+    resized_img = cv2.resize(np_image, (FRACTAL_SIZE, FRACTAL_SIZE), interpolation=cv2.INTER_AREA)
 
     # Use grayscale image for FD calculation
     if resized_img.ndim == 3:
@@ -32,29 +41,36 @@ def compute_fractal_stats(np_image):
             gray_img = gray_img.astype(np.uint8)
         
     
-    # Default (Full Range)
-    fd_default = fractal_dimension(gray_img)
-    
-    # Small / Fine Details
-    # fd_small = fractal_dimension(gray_img, min_box=2, max_box=limit_small)
-    
-    # Large / Coarse Structure
-    # fd_large = fractal_dimension(gray_img, min_box=limit_small, max_box=M//2)
+    # Default (Full Range), Small / Fine Details and Large / Coarse Structure
+    profile = fractal_profile(gray_img, cancel_token=cancel_token)
     
     return {
-        "fd_default": fd_default,
-        # "fd_small": fd_small,
-        # "fd_large": fd_large
+        "fd_default": profile["fd_default"],
+        "fd_small": profile["fd_small"],
+        "fd_large": profile["fd_large"]
     }
 
-def prepare_image(file_bytes: bytes):
+def prepare_image(file_bytes: bytes, cancel_token=None, max_side: int | None = None):
     """
     Opens image, converts to RGB, and extracts basic metadata.
+
+    Images larger than max_side (default ANALYSIS_MAX_SIDE) are decoded at reduced size:
+    JPEGs via draft mode (the decoder skips DCT detail), other formats are reduced right
+    after decoding. width and height are always those of the original upload.
     """
+    max_side = ANALYSIS_MAX_SIDE if max_side is None else max_side
     image = Image.open(io.BytesIO(file_bytes))
+    width, height = image.size
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        # Picks the largest JPEG scale (1/2, 1/4, 1/8) that stays at least this size; no-op otherwise
+        image.draft("RGB", (max(1, round(width * scale)), max(1, round(height * scale))))
+    check_cancelled(cancel_token)
     image = image.convert('RGB')
+    if max_side and max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.BICUBIC)
+    check_cancelled(cancel_token)
     np_image = np.array(image)
-    width, height = image.size
     mean_color = np.mean(np_image, axis=(0, 1))
     return image, np_image, width, height, mean_color
 
@@ -124,6 +140,14 @@ def extract_metadata(image: Image.Image):
         "is_suspicious": is_suspicious
     }
 
+def extract_metadata_from_bytes(file_bytes):
+    """
+    Same as extract_metadata, but opens the upload itself, so a worker process needs nothing
+    but the raw bytes. The metadata step always runs this. Most formats are read from the
+    header alone; a PNG is decoded to reach text chunks stored after the pixels.
+    """
+    return extract_metadata(Image.open(io.BytesIO(file_bytes)))
+
 def analyze_image(file_bytes: bytes):
     """
     Wrapper for backward compatibility.
@@ -1,42 +1,65 @@
-from .extraction import extract_patches
-from .classifiers import classify_global_medium, get_patch_embeddings
+import os
+from .extraction import extract_patches, pool_token_regions
+from .classifiers import classify_global_medium, get_patch_embeddings, get_token_grid
 from .search import analyze_texture_consistency
 from PIL import Image
 import numpy as np
+from ..cancellation import check_cancelled
+from ..pyramid import at_resolution
 
-def analyze_art_medium(img: Image.Image):
+# "patches": embed up to MAX_TEXTURE_PATCHES overlapping crops, one forward pass each batch.
+# "grid": one forward pass over the resized image, token grid pooled into regions.
+TEXTURE_MODES = ("patches", "grid")
+TEXTURE_MODE = os.environ.get("TEXTURE_MODE", "patches")
+MAX_TEXTURE_PATCHES = 16
+
+def texture_embeddings(img: Image.Image, mode: str | None = None, cancel_token=None):
     """
-    Performs a multi-stage analysis to identify the artistic medium.
-    1. Global CLIP classification.
-    2. Local DINOv2 patch embedding and consistency check.
+    Returns the regional DINOv2 embeddings that analyze_texture_consistency scores.
     """
-    # 1. High-level classification
-    global_result = classify_global_medium(img)
+    mode = mode or TEXTURE_MODE
+    if mode not in TEXTURE_MODES:
+        raise ValueError(f"Unknown texture mode {mode!r}; expected one of {TEXTURE_MODES}")
+    
+    if mode == "grid":
+        regions_per_side = int(np.sqrt(MAX_TEXTURE_PATCHES))
+        return pool_token_regions(get_token_grid(img, cancel_token=cancel_token), regions_per_side)
     
-    # 2. Local texture analysis
     patches = extract_patches(img)
     # Since DINOv2 is heavy, we might want to limit the number of patches
     # if there are too many for a quick analysis.
-    max_patches = 16
-    if len(patches) > max_patches:
+    if len(patches) > MAX_TEXTURE_PATCHES:
         # Sample patches (e.g. from the middle or spread out)
-        indices = np.linspace(0, len(patches)-1, max_patches, dtype=int)
+        indices = np.linspace(0, len(patches)-1, MAX_TEXTURE_PATCHES, dtype=int)
         patches = [patches[i] for i in indices]
         
-    patch_embeddings = get_patch_embeddings(patches)
-    consistency_score = analyze_texture_consistency(patch_embeddings)
-    
-    # Interpret consistency
+    return get_patch_embeddings(patches, cancel_token=cancel_token)
+
+def describe_consistency(consistency_score: float) -> str:
     # High consistency (> 0.8) often means digital or flat color
     # Low consistency (< 0.5) often means complex traditional textures
+    if consistency_score > 0.8:
+        return "Texture is highly consistent, suggesting digital media or uniform washes."
+    if consistency_score < 0.5:
+        return "Texture is highly varied, suggesting complex physical brushwork or impasto."
+    return "Texture shows moderate variation consistent with standard artistic techniques."
+
+def analyze_art_medium(img, cancel_token=None, texture_mode: str | None = None):
+    """
+    Performs a multi-stage analysis to identify the artistic medium.
+    1. Global CLIP classification.
+    2. Local DINOv2 patch embedding and consistency check (texture_mode, default TEXTURE_MODE).
+    """
+    # 1. High-level classification
+    global_result = classify_global_medium(img, cancel_token=cancel_token)
+    
+    # 2. Local texture analysis, on the full working resolution (patches are native-scale crops)
+    check_cancelled(cancel_token)
+    patch_embeddings = texture_embeddings(at_resolution(img), mode=texture_mode, cancel_token=cancel_token)
+    consistency_score = analyze_texture_consistency(patch_embeddings)
     
     description = f"Likely {global_result['label']} (Confidence: {global_result['confidence']:.2f}). "
-    if consistency_score > 0.8:
-        description += "Texture is highly consistent, suggesting digital media or uniform washes."
-    elif consistency_score < 0.5:
-        description += "Texture is highly varied, suggesting complex physical brushwork or impasto."
-    else:
-        description += "Texture shows moderate variation consistent with standard artistic techniques."
+    description += describe_consistency(consistency_score)
         
     return {
         "medium": global_result["label"],
@@ -0,0 +1,110 @@
+"""
+Benchmark and agreement report for the texture modes of analyze_art_medium.
+
+    python -m app.analysis.artmedium.benchmark path/to/paintings/*.jpg [--repeats 3] [--json]
+
+Each image is scored in both modes ("patches": up to 16 crops, "grid": one full-image pass).
+The report gives the latency of each mode and how closely the grid score tracks the crop-based
+score, including how often both land in the same description band, so TEXTURE_MODE can be
+chosen per deployment.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+from . import TEXTURE_MODES, describe_consistency, texture_embeddings
+from .search import analyze_texture_consistency
+
+
+def _rank(values: np.ndarray) -> np.ndarray:
+    ranks = np.empty(len(values))
+    ranks[np.argsort(values, kind="stable")] = np.arange(len(values))
+    return ranks
+
+def _correlation(a: np.ndarray, b: np.ndarray):
+    if len(a) < 2 or np.std(a) == 0 or np.std(b) == 0:
+        return None
+    return float(np.corrcoef(a, b)[0, 1])
+
+def score_texture_modes(img: Image.Image, repeats: int = 1) -> dict:
+    """
+    Scores one image in every texture mode.
+
+    Returns:
+        dict: mode -> {"score", "seconds"}, seconds being the best of `repeats` runs.
+    """
+    results = {}
+    for mode in TEXTURE_MODES:
+        timings = []
+        for _ in range(max(1, repeats)):
+            started = time.perf_counter()
+            score = analyze_texture_consistency(texture_embeddings(img, mode=mode))
+            timings.append(time.perf_counter() - started)
+        results[mode] = {"score": score, "seconds": min(timings)}
+    return results
+
+def summarize_agreement(rows: list) -> dict:
+    """
+    Aggregates per-image results from score_texture_modes into the agreement report.
+    """
+    patches = np.array([row["patches"]["score"] for row in rows])
+    grid = np.array([row["grid"]["score"] for row in rows])
+    patches_seconds = float(np.mean([row["patches"]["seconds"] for row in rows]))
+    grid_seconds = float(np.mean([row["grid"]["seconds"] for row in rows]))
+    diff = np.abs(grid - patches)
+    same_band = [describe_consistency(p) == describe_consistency(g) for p, g in zip(patches, grid)]
+    return {
+        "images": len(rows),
+        "patches_mean_seconds": patches_seconds,
+        "grid_mean_seconds": grid_seconds,
+        "speedup": patches_seconds / grid_seconds if grid_seconds > 0 else None,
+        "mean_abs_diff": float(np.mean(diff)),
+        "max_abs_diff": float(np.max(diff)),
+        "pearson": _correlation(patches, grid),
+        "spearman": _correlation(_rank(patches), _rank(grid)),
+        "band_agreement": float(np.mean(same_band)),
+    }
+
+def compare_texture_modes(images: list, repeats: int = 1) -> dict:
+    """
+    Runs the benchmark over (name, PIL image) pairs.
+
+    The first image is run once in every mode beforehand so model loading is not timed.
+    """
+    if not images:
+        raise ValueError("No images to benchmark")
+    score_texture_modes(images[0][1])
+    rows = []
+    for name, img in images:
+        rows.append({"image": name, **score_texture_modes(img, repeats)})
+    return {"images": rows, "summary": summarize_agreement(rows)}
+
+def _print_report(report: dict):
+    print(f"{'image':40} {'patches':>8} {'grid':>8} {'diff':>7} {'patches s':>10} {'grid s':>8}")
+    for row in report["images"]:
+        p, g = row["patches"], row["grid"]
+        print(f"{row['image'][-40:]:40} {p['score']:8.3f} {g['score']:8.3f} {abs(g['score'] - p['score']):7.3f} "
+              f"{p['seconds']:10.3f} {g['seconds']:8.3f}")
+    print()
+    for key, value in report["summary"].items():
+        print(f"{key:22} {value if value is None or isinstance(value, int) else round(value, 4)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the patches and grid texture modes.")
+    parser.add_argument("images", nargs="+", help="Image files to score")
+    parser.add_argument("--repeats", type=int, default=1, help="Timed runs per image and mode (best is kept)")
+    parser.add_argument("--json", action="store_true", help="Print the raw report as JSON")
+    args = parser.parse_args(argv)
+
+    images = [(path, Image.open(path).convert("RGB")) for path in args.images]
+    report = compare_texture_modes(images, repeats=args.repeats)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+if __name__ == "__main__":
+    main()
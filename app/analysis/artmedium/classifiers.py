@@ -1,12 +1,29 @@
+import hashlib
+import os
+import threading
 import torch
-from transformers import pipeline, AutoProcessor, AutoModel
+from transformers import AutoProcessor, AutoModel
 from PIL import Image
 import numpy as np
 
-# Cache for models and processors
-_clip_pipeline = None
-_dinov2_processor = None
-_dinov2_model = None
+from ..batching import MicroBatcher
+from ..cancellation import check_cancelled
+from ..pyramid import at_resolution
+from ..registry import model_registry
+
+# Cache for the encoded label prompts (the models live in the registry)
+_medium_text_embeddings = None
+_medium_text_lock = threading.Lock()
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Patches per DINOv2 forward pass
+DINOV2_BATCH_SIZE = int(os.environ.get("DINOV2_BATCH_SIZE", "8"))
+# DINOv2 ViT patch size in pixels
+DINOV2_PATCH_SIZE = 14
+# Short side requested from the image pyramid for CLIP (its processor works at 224px)
+CLIP_INPUT_SHORT_SIDE = 224
+# Long side of the resized image in the single-pass texture mode (448px -> 32x32 tokens)
+TEXTURE_GRID_SIDE = int(os.environ.get("TEXTURE_GRID_SIDE", "448"))
 
 MEDIUM_LABELS = {
     "Acrylic": ["Acrylic paint"],
@@ -23,28 +40,126 @@ MEDIUM_LABELS = {
     "Watercolor": ["Auraelle", "Transparent watercolor"]
 }
 
-def get_clip_pipeline():
-    global _clip_pipeline
-    if _clip_pipeline is None:
-        # Using SigLIP or standard CLIP. Standard CLIP is more common for zero-shot.
-        _clip_pipeline = pipeline("zero-shot-image-classification", model="openai/clip-vit-base-patch32")
-    return _clip_pipeline
+CLIP_MODEL = "openai/clip-vit-base-patch32"
+# Every label and synonym is put through each template; the label's text embedding is the
+# normalized mean of all of them (prompt ensemble)
+MEDIUM_PROMPT_TEMPLATES = (
+    "This is a photo of {}.",
+    "a painting made with {}.",
+    "an artwork in {}.",
+)
+# Where encoded label prompts are kept between restarts, keyed by model revision
+CLIP_TEXT_CACHE_DIR = os.environ.get("CLIP_TEXT_CACHE_DIR", "cache/clip_text")
+
+def _load_clip():
+    # Using SigLIP or standard CLIP. Standard CLIP is more common for zero-shot.
+    processor = AutoProcessor.from_pretrained(CLIP_MODEL)
+    model = AutoModel.from_pretrained(CLIP_MODEL).to(DEVICE).eval()
+    return processor, model
+
+def _load_dinov2():
+    processor = AutoProcessor.from_pretrained("facebook/dinov2-base")
+    # Placed on the device once here rather than on every request
+    model = AutoModel.from_pretrained("facebook/dinov2-base").to(DEVICE).eval()
+    return processor, model
+
+model_registry.register("clip", _load_clip)
+model_registry.register("dinov2", _load_dinov2)
+
+def get_clip():
+    return model_registry.get("clip")
+
+def medium_prompts() -> dict:
+    """
+    Returns label -> list of prompts built from the label, its synonyms and the templates.
+    """
+    return {
+        label: [template.format(name) for name in (label, *synonyms) for template in MEDIUM_PROMPT_TEMPLATES]
+        for label, synonyms in MEDIUM_LABELS.items()
+    }
+
+def _features(output):
+    # get_*_features returns a tensor in older transformers, a model output in newer ones
+    features = output if torch.is_tensor(output) else output.pooler_output
+    return features / features.norm(dim=-1, keepdim=True)
+
+def _text_cache_path(model) -> str:
+    revision = getattr(model.config, "_commit_hash", None) or "local"
+    prompts = repr(sorted(medium_prompts().items())).encode()
+    key = hashlib.sha256(prompts).hexdigest()[:16]
+    name = CLIP_MODEL.replace("/", "--")
+    return os.path.join(CLIP_TEXT_CACHE_DIR, f"{name}-{revision}-{key}.npy")
+
+def _encode_medium_prompts(processor, model) -> np.ndarray:
+    prompts = medium_prompts()
+    flat = [prompt for label_prompts in prompts.values() for prompt in label_prompts]
+    inputs = processor(text=flat, padding=True, return_tensors="pt").to(DEVICE)
+    with torch.no_grad():
+        text_features = _features(model.get_text_features(**inputs))
+    
+    embeddings = []
+    start = 0
+    for label_prompts in prompts.values():
+        mean = text_features[start:start + len(label_prompts)].mean(dim=0)
+        embeddings.append(mean / mean.norm())
+        start += len(label_prompts)
+    return torch.stack(embeddings).cpu().numpy().astype(np.float32)
+
+def get_medium_text_embeddings() -> np.ndarray:
+    """
+    Returns the (labels, dim) normalized text embeddings for MEDIUM_LABELS, in label order.
+
+    They are encoded once per process, or loaded from CLIP_TEXT_CACHE_DIR when an earlier run
+    already encoded the same prompts with the same model revision.
+    """
+    global _medium_text_embeddings
+    if _medium_text_embeddings is not None:
+        return _medium_text_embeddings
+    with _medium_text_lock:
+        if _medium_text_embeddings is None:
+            processor, model = get_clip()
+            path = _text_cache_path(model)
+            if os.path.exists(path):
+                embeddings = np.load(path)
+            else:
+                embeddings = _encode_medium_prompts(processor, model)
+                try:
+                    os.makedirs(CLIP_TEXT_CACHE_DIR, exist_ok=True)
+                    np.save(path, embeddings)
+                except OSError as e:
+                    # The cache only saves start-up time; carry on without it
+                    print(f"Could not write CLIP text cache {path}: {e}")
+            _medium_text_embeddings = embeddings
+    return _medium_text_embeddings
 
 def get_dinov2():
-    global _dinov2_processor, _dinov2_model
-    if _dinov2_processor is None:
-        _dinov2_processor = AutoProcessor.from_pretrained("facebook/dinov2-base")
-        _dinov2_model = AutoModel.from_pretrained("facebook/dinov2-base")
-    return _dinov2_processor, _dinov2_model
+    return model_registry.get("dinov2")
 
-def classify_global_medium(img: Image.Image):
-    """Uses CLIP for high-level medium classification."""
-    clip = get_clip_pipeline()
+def _classify_medium_batch(images, cancel_tokens):
+    with model_registry.in_use("clip"):
+        processor, model = get_clip()
+        text_embeddings = torch.from_numpy(get_medium_text_embeddings()).to(DEVICE)
+        labels = list(MEDIUM_LABELS.keys())
     
-    # Flatten the labels for CLIP
-    candidate_labels = list(MEDIUM_LABELS.keys())
+        # Only the image tower runs per request; the label side is a cached matrix
+        inputs = processor(images=images, return_tensors="pt").to(DEVICE)
+        with torch.no_grad():
+            image_features = _features(model.get_image_features(pixel_values=inputs["pixel_values"]))
+            logits = model.logit_scale.exp() * image_features @ text_embeddings.T
+            probs = logits.softmax(dim=-1).cpu().numpy()
     
-    results = clip(img, candidate_labels=candidate_labels)
+        # One result list per image, best label first (same shape as the zero-shot pipeline)
+        return [
+            sorted(({"label": label, "score": float(score)} for label, score in zip(labels, row)),
+                   key=lambda r: r["score"], reverse=True)
+            for row in probs
+        ]
+
+_clip_batcher = MicroBatcher("clip_medium", _classify_medium_batch)
+
+def classify_global_medium(img: Image.Image, cancel_token=None):
+    """Uses CLIP for high-level medium classification."""
+    results = _clip_batcher.infer(at_resolution(img, CLIP_INPUT_SHORT_SIDE), cancel_token)
     # Sort by score and get the top one
     top_result = results[0]
     return {
@@ -53,22 +168,63 @@ def classify_global_medium(img: Image.Image):
         "all_scores": {r["label"]: r["score"] for r in results}
     }
 
-def get_patch_embeddings(patches: list):
-    """Generates DINOv2 embeddings for a list of patches."""
-    processor, model = get_dinov2()
+def warmup_clip():
+    # Encodes (or loads) the label prompts and runs the image tower once
+    _classify_medium_batch([Image.new("RGB", (224, 224))], [None])
+
+def get_patch_embeddings(patches: list, cancel_token=None, batch_size: int | None = None):
+    """
+    Generates DINOv2 embeddings for a list of patches.
+
+    All patches are preprocessed into one tensor, then embedded batch_size patches
+    (default DINOV2_BATCH_SIZE) per forward pass.
+    """
+    with model_registry.in_use("dinov2"):
+        processor, model = get_dinov2()
+        batch_size = max(1, batch_size or DINOV2_BATCH_SIZE)
     
-    embeddings = []
-    # Process in batches if necessary, but for now simple loop
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model.to(device)
+        pixel_values = processor(images=patches, return_tensors="pt").to(DEVICE)["pixel_values"]
     
-    with torch.no_grad():
-        for patch in patches:
-            inputs = processor(images=patch, return_tensors="pt").to(device)
-            outputs = model(**inputs)
-            # Use pooler_output or take the first token (CLS)
-            # DINOv2 base has 768 dimensions
-            embedding = outputs.pooler_output.cpu().numpy().flatten()
-            embeddings.append(embedding)
+        embeddings = []
+        with torch.no_grad():
+            for start in range(0, len(pixel_values), batch_size):
+                check_cancelled(cancel_token)
+                outputs = model(pixel_values=pixel_values[start:start + batch_size])
+                # Use pooler_output or take the first token (CLS)
+                # DINOv2 base has 768 dimensions
+                embeddings.append(outputs.pooler_output.cpu().numpy())
             
-    return np.array(embeddings)
+        return np.concatenate(embeddings, axis=0)
+
+def get_token_grid(img: Image.Image, cancel_token=None, side: int | None = None):
+    """
+    Runs DINOv2 once over the whole image and returns its patch tokens.
+
+    The image is resized so its long side is about `side` pixels (default TEXTURE_GRID_SIDE)
+    and both sides are whole multiples of the ViT patch size; no center crop is applied.
+
+    Returns:
+        np.ndarray: (rows, cols, 768) token grid.
+    """
+    with model_registry.in_use("dinov2"):
+        processor, model = get_dinov2()
+        side = side or TEXTURE_GRID_SIDE
+    
+        w, h = img.size
+        scale = side / max(w, h)
+        cols = max(1, round(w * scale / DINOV2_PATCH_SIZE))
+        rows = max(1, round(h * scale / DINOV2_PATCH_SIZE))
+        resized = img.convert("RGB").resize((cols * DINOV2_PATCH_SIZE, rows * DINOV2_PATCH_SIZE), Image.BICUBIC)
+    
+        check_cancelled(cancel_token)
+        inputs = processor(images=resized, do_resize=False, do_center_crop=False, return_tensors="pt").to(DEVICE)
+        with torch.no_grad():
+            outputs = model(pixel_values=inputs["pixel_values"])
+    
+        # The patch tokens come last, after the CLS token
+        tokens = outputs.last_hidden_state[0, -rows * cols:]
+        return tokens.cpu().numpy().reshape(rows, cols, -1)
+
+def warmup_dinov2():
+    # One dummy forward pass, so the first real request doesn't pay for lazy kernel setup
+    get_patch_embeddings([Image.new("RGB", (224, 224))])
@@ -1,3 +1,4 @@
+import numpy as np
 from PIL import Image
 
 def extract_patches(img: Image.Image, size: int = 224, stride: int = 112):
@@ -32,3 +33,35 @@ def extract_patches(img: Image.Image, size: int = 224, stride: int = 112):
         patches.append(img.crop((left, top, left + size, top + size)))
         
     return patches
+
+def _region_bounds(length: int, count: int):
+    # Windows twice the stride wide, so neighbours overlap by half as in extract_patches
+    count = max(1, min(count, length))
+    stride = length / (count + 1)
+    bounds = []
+    for i in range(count):
+        start = round(i * stride)
+        end = max(start + 1, round(i * stride + 2 * stride))
+        bounds.append((start, min(end, length)))
+    return bounds
+
+def pool_token_regions(token_grid: np.ndarray, regions_per_side: int = 4):
+    """
+    Mean-pools a DINOv2 token grid into overlapping regional descriptors.
+
+    This is the single-pass counterpart of extract_patches: each region stands in for
+    one crop, but its embedding comes from the tokens of one full-image forward pass.
+    
+    Args:
+        token_grid: (rows, cols, dim) array from get_token_grid.
+        regions_per_side: Regions along each axis (fewer if the grid is smaller).
+        
+    Returns:
+        A (regions, dim) array of embeddings.
+    """
+    rows, cols, _ = token_grid.shape
+    regions = []
+    for top, bottom in _region_bounds(rows, regions_per_side):
+        for left, right in _region_bounds(cols, regions_per_side):
+            regions.append(token_grid[top:bottom, left:right].mean(axis=(0, 1)))
+    return np.stack(regions)
@@ -0,0 +1,163 @@
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+
+from .cancellation import AnalysisCancelled
+
+# Defaults for every MicroBatcher; BATCH_MAX_SIZE=1 disables batching
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", "10"))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+QUEUE_WAIT_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+class Histogram:
+    """Thread-safe histogram with fixed upper bounds (cumulative, Prometheus style)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self.buckets) + 1)
+            self._sum = 0.0
+            self._total = 0
+
+    def observe(self, value: float):
+        with self._lock:
+            idx = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    idx = i
+                    break
+            self._counts[idx] += 1
+            self._sum += value
+            self._total += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(self.buckets + ("+Inf",), self._counts):
+                cumulative += count
+                buckets.append({"le": bound, "count": cumulative})
+            return {"count": self._total, "sum": round(self._sum, 3), "buckets": buckets}
+
+class _Request:
+    __slots__ = ("cancel_token", "enqueued", "future", "item")
+
+    def __init__(self, item, cancel_token):
+        self.item = item
+        self.cancel_token = cancel_token
+        self.future = concurrent.futures.Future()
+        self.enqueued = time.monotonic()
+
+class MicroBatcher:
+    """
+    Collects concurrent single-item inference calls into one batched call.
+
+    The first queued request opens a window of window_ms; everything that arrives within it
+    (up to max_batch_size) is run as one batch by run_batch(items, cancel_tokens), which must
+    return one output per item in order. Callers block in infer() on their own future, so
+    this sits transparently behind the blocking detect_*/classify_* functions.
+    """
+
+    def __init__(self, name: str, run_batch, max_batch_size: int | None = None, window_ms: float | None = None):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size if max_batch_size is not None else BATCH_MAX_SIZE)
+        self.window = (window_ms if window_ms is not None else BATCH_WINDOW_MS) / 1000.0
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(QUEUE_WAIT_MS_BUCKETS)
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        _batchers[name] = self
+
+    def infer(self, item, cancel_token=None):
+        """
+        Runs item through the model as part of the next batch and returns its output.
+        """
+        if self.max_batch_size == 1:
+            # Batching disabled: run inline on the caller's thread
+            self.batch_sizes.observe(1)
+            self.queue_wait_ms.observe(0.0)
+            return self.run_batch([item], [cancel_token])[0]
+
+        future = self.submit(item, cancel_token)
+        while True:
+            try:
+                return future.result(timeout=0.05)
+            except concurrent.futures.TimeoutError:
+                if cancel_token is not None and cancel_token.cancelled:
+                    # Drops the request if it is still queued; a running batch carries on
+                    # for the other callers
+                    future.cancel()
+                    raise AnalysisCancelled()
+
+    def submit(self, item, cancel_token=None) -> concurrent.futures.Future:
+        self._ensure_worker()
+        request = _Request(item, cancel_token)
+        self._queue.put(request)
+        return request.future
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._loop, name=f"batcher-{self.name}", daemon=True)
+                self._worker.start()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0].enqueued + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        # Skip requests whose caller cancelled while they were queued
+        batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        started = time.monotonic()
+        for request in batch:
+            self.queue_wait_ms.observe((started - request.enqueued) * 1000.0)
+        self.batch_sizes.observe(len(batch))
+
+        try:
+            outputs = self.run_batch([r.item for r in batch], [r.cancel_token for r in batch])
+            if len(outputs) != len(batch):
+                raise RuntimeError(f"{self.name}: batch of {len(batch)} returned {len(outputs)} outputs")
+        except Exception as e:  # noqa: BLE001 - not swallowed: every caller in the batch gets it
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        for request, output in zip(batch, outputs):
+            request.future.set_result(output)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "window_ms": self.window * 1000.0,
+            "queued": self._queue.qsize(),
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
+
+# name -> MicroBatcher, for metrics export
+_batchers = {}
+
+def batching_stats() -> dict:
+    return {name: batcher.stats() for name, batcher in _batchers.items()}
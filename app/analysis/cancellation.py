@@ -0,0 +1,50 @@
+import inspect
+import threading
+
+
+class AnalysisCancelled(Exception):
+    """Raised inside an analysis step once its caller has given up on the result."""
+
+class CancellationToken:
+    """
+    Cooperative cancellation flag for long-running analysis steps.
+
+    The caller cancels the token when it stops waiting (step timeout, abandoned session);
+    the step checks it between boxes/patches/batches and bails out with AnalysisCancelled,
+    freeing its worker instead of running to completion for nobody.
+    """
+
+    def __init__(self, flag=None):
+        # flag: optional 1-element uint8 array (e.g. in shared memory) so that a token
+        # in a worker process can observe a cancel issued by the parent
+        self._event = threading.Event()
+        self._flag = flag
+
+    def cancel(self):
+        self._event.set()
+        if self._flag is not None:
+            self._flag[0] = 1
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (self._flag is not None and bool(self._flag[0]))
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise AnalysisCancelled()
+
+def check_cancelled(cancel_token):
+    """
+    Checkpoint helper for functions whose cancel_token is optional.
+    """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+def accepts_cancel_token(func) -> bool:
+    """
+    True if func declares a cancel_token parameter (mocks and wrappers usually don't).
+    """
+    try:
+        return "cancel_token" in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
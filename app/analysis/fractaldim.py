@@ -1,79 +1,188 @@
 import numpy as np
 
-def fractal_dimension(image: np.ndarray, min_box: int = 2, max_box: int = None) -> float:
+from .cancellation import check_cancelled
+
+# Box-counting engines available to fractal_dimension().
+# "vectorized" is the production path; "reference" is the original per-pixel loop,
+# kept to validate the vectorized engine against.
+FRACTAL_METHODS = ("vectorized", "reference")
+
+def _box_height(M: int, L: int, G: float) -> float:
+    # h: height of the box.
+    # "minimum box height is 1"
+    # G // (M // L)  approximates scaling height with box size
+    # Avoid division by zero if M//L is 0 (unlikely given loop range)
+    scale = M // L
+    if scale == 0:
+        return 1 # Fallback, though loop prevents this
+    return max(1.0, G / scale)
+
+def _count_boxes_reference(image: np.ndarray, L: int, h: float, g_min: float, G: float, cancel_token=None) -> float:
     """
-    Calculates the fractal dimension of an image represented by a 2D numpy array.
+    Pure-Python N(r) for a single box size L. Slow, but a literal transcription of the algorithm.
+    """
+    M = image.shape[0]
+    n_r = 0.0
 
-    The algorithm is a modified box-counting algorithm as described by Wen-Li Lee and Kai-Sheng Hsieh.
+    for i in range(0, M, L):
+        check_cancelled(cancel_token)
+        for j in range(0, M, L):
+            # Calculate number of boxes needed to cover intensity range
+            # (G + h - 1) // h is ceil(G/h)
+            num_height_levels = int((G + h - 1) // h)
+            boxes = [[] for _ in range(num_height_levels)]
+
+            # Extract the block.
+            # Use standard slicing [row_start:row_end, col_start:col_end]
+            sub_image = image[i : i + L, j : j + L]
+
+            for row in sub_image:
+                for pixel in row:
+                    height_idx = int((pixel - g_min) // h)
+                    # Safety check index
+                    if 0 <= height_idx < len(boxes):
+                        boxes[height_idx].append(pixel)
+
+            non_empty_boxes = [b for b in boxes if len(b) > 0]
+            if not non_empty_boxes:
+                continue
+
+            for box in non_empty_boxes:
+                std = np.std(box)
+                n_box_r = 2 * (std // h) + 1
+                n_r += n_box_r
+
+    return n_r
+
+def _shared_pixel_arrays(image: np.ndarray, g_min: float):
+    """
+    Per-image arrays reused by _count_boxes_vectorized at every box size: float intensities,
+    their squares, offsets from g_min and row/column indices. Computing them once is what lets
+    box_counting_curve() produce N(r) for all scales for about the cost of one scale.
+    """
+    values = image.astype(np.float64)
+    exact = np.issubdtype(image.dtype, np.integer)
+    return {
+        "values": values,
+        "sq_values": values * values if exact else None,
+        "offsets": values - g_min,
+        "rows": np.arange(image.shape[0]),
+        "cols": np.arange(image.shape[1]),
+        "exact": exact,
+    }
+
+def _count_boxes_vectorized(image: np.ndarray, L: int, h: float, g_min: float, G: float, shared: dict | None = None) -> float:
+    """
+    NumPy N(r) for a single box size L, equivalent to _count_boxes_reference.
+
+    Every pixel gets a (block, height level) group key; per-group counts, means and
+    standard deviations are then computed with bincount reductions instead of Python lists.
+    """
+    if shared is None:
+        shared = _shared_pixel_arrays(image, g_min)
+
+    M = image.shape[0]
+    # The reference walks block origins in steps of L up to M (the height, not the width),
+    # so on wide images only the columns covered by those ceil(M / L) blocks are visited.
+    col_limit = -(-M // L) * L
+    region = shared["values"][:, :col_limit]
+    rows, cols = region.shape
+    if rows == 0 or cols == 0:
+        return 0.0
+
+    num_height_levels = int((G + h - 1) // h)
+    blocks_per_row = -(-cols // L)
+
+    block_idx = (shared["rows"] // L)[:, None] * blocks_per_row + (shared["cols"][:cols] // L)[None, :]
+    # floor_divide (not floor(a / b)) matches Python's float // exactly at level boundaries
+    height_idx = np.floor_divide(shared["offsets"][:, :col_limit], h).astype(np.int64)
+
+    # Safety check index (mirrors the reference implementation)
+    valid = (height_idx >= 0) & (height_idx < num_height_levels)
+    keys = (block_idx * num_height_levels + height_idx)[valid]
+    values = region[valid]
+    if keys.size == 0:
+        return 0.0
+
+    # Dense bincount over the full key space is fastest, but the key space grows
+    # with (M/L)^2 * levels; compress to the occupied groups when it gets too sparse.
+    if keys.max() >= 8 * keys.size:
+        _, keys = np.unique(keys, return_inverse=True)
+
+    counts = np.bincount(keys)
+    occupied = counts > 0
+    n = counts[occupied].astype(np.float64)
+    sums = np.bincount(keys, weights=values)
+
+    if shared["exact"]:
+        # Integer gray levels: sum and sum of squares are exact in float64 for any
+        # realistic block, so the variance is exact and floor(std / h) never wobbles
+        # around a level boundary.
+        sq_sums = np.bincount(keys, weights=shared["sq_values"][:, :col_limit][valid])
+        variances = (n * sq_sums[occupied] - sums[occupied] ** 2) / (n * n)
+    else:
+        # Two-pass variance, like np.std, to keep float images numerically stable
+        group_means = np.zeros_like(sums)
+        group_means[occupied] = sums[occupied] / n
+        deviations = values - group_means[keys]
+        variances = np.bincount(keys, weights=deviations * deviations)[occupied] / n
+    stds = np.sqrt(np.maximum(variances, 0.0))
+
+    return float(np.sum(2 * (stds // h) + 1))
+
+def box_counting_curve(image: np.ndarray, min_box: int = 2, max_box: int | None = None, method: str = "vectorized",
+                       cancel_token=None) -> list:
+    """
+    Computes the raw box-counting curve N(r) for every box size L in [min_box, max_box].
 
     Args:
-        image: A 2D array containing a grayscale image. Format should be equivalent to cv2.imread(flags=0).
-               The size of the image has no constraints, but it typically works best on square images.
-               If the image is not square, the algorithm uses a sliding window or similar logic based on M (height).
-               This implementation assumes M is the dimension to iterate over.
+        image: A 2D grayscale array, see fractal_dimension().
         min_box: Minimum box size (L) to use. Default is 2.
         max_box: Maximum box size (L) to use. Default is M // 2.
+        method: Box-counting engine, one of FRACTAL_METHODS.
+        cancel_token: Optional CancellationToken, checked before every box size.
 
     Returns:
-        float: The fractal dimension Df.
+        list: One (r, N(r)) tuple per box size, in increasing L, with r = L / M.
     """
     if image.ndim != 2:
         raise ValueError(f"Input image must be a 2D array, got shape {image.shape}")
+    if method not in FRACTAL_METHODS:
+        raise ValueError(f"Unknown method '{method}', expected one of {FRACTAL_METHODS}")
 
     M = image.shape[0]  # image height
-    
+
     g_min = float(image.min())
     g_max = float(image.max())
     G = g_max - g_min + 1  # number of gray levels
-    
-    prev_n_r = -1.0
-    r_nr_points = []
 
     if max_box is None:
         max_box = (M // 2)
 
+    if method == "vectorized":
+        shared = _shared_pixel_arrays(image, g_min)
+        def count_boxes(L, h):
+            return _count_boxes_vectorized(image, L, h, g_min, G, shared)
+    else:
+        def count_boxes(L, h):
+            return _count_boxes_reference(image, L, h, g_min, G, cancel_token)
+
     # L ranges from min_box up to max_box (inclusive)
+    curve = []
     for L in range(min_box, max_box + 1):
-        # h: height of the box. 
-        # "minimum box height is 1"
-        # G // (M // L)  approximates scaling height with box size
-        # Avoid division by zero if M//L is 0 (unlikely given loop range)
-        scale = M // L
-        if scale == 0:
-            h = 1 # Fallback, though loop prevents this
-        else:
-            h = max(1.0, G / scale) 
-
-        n_r = 0.0
-        r = L / M
-        
-        for i in range(0, M, L):
-            for j in range(0, M, L):
-                # Calculate number of boxes needed to cover intensity range
-                # (G + h - 1) // h is ceil(G/h)
-                num_height_levels = int((G + h - 1) // h)
-                boxes = [[] for _ in range(num_height_levels)]
-                
-                # Extract the block. 
-                # Use standard slicing [row_start:row_end, col_start:col_end]
-                sub_image = image[i : i + L, j : j + L]
-                
-                for row in sub_image:
-                    for pixel in row:
-                        height_idx = int((pixel - g_min) // h)
-                        # Safety check index
-                        if 0 <= height_idx < len(boxes):
-                            boxes[height_idx].append(pixel)
-                
-                non_empty_boxes = [b for b in boxes if len(b) > 0]
-                if not non_empty_boxes:
-                    continue
-                    
-                for box in non_empty_boxes:
-                    std = np.std(box)
-                    n_box_r = 2 * (std // h) + 1
-                    n_r += n_box_r
+        check_cancelled(cancel_token)
+        h = _box_height(M, L, G)
+        curve.append((L / M, count_boxes(L, h)))
+    return curve
 
+def _fit_dimension(curve: list) -> float:
+    """
+    Fits Df as the slope of log N(r) against log(1/r), skipping repeated N(r) plateaus.
+    """
+    prev_n_r = -1.0
+    r_nr_points = []
+
+    for r, n_r in curve:
         if n_r != prev_n_r:
             r_nr_points.append((r, n_r))
             prev_n_r = n_r
@@ -84,13 +193,78 @@ def fractal_dimension(image: np.ndarray, min_box: int = 2, max_box: int = None)
     # Linear regression to find D
     # x = log(1/r) = -log(r)
     # y = log(Nr)
-    
+
     x = np.array([-np.log(p[0]) for p in r_nr_points])
     y = np.array([np.log(p[1]) for p in r_nr_points])
-    
+
     # Polyfit degree 1
     if len(x) < 2:
          return 0.0 # Not enough points for fit
-         
+
     d_val = np.polyfit(x, y, 1)[0]
     return float(d_val)
+
+def fractal_dimension(image: np.ndarray, min_box: int = 2, max_box: int | None = None, method: str = "vectorized",
+                      cancel_token=None) -> float:
+    """
+    Calculates the fractal dimension of an image represented by a 2D numpy array.
+
+    The algorithm is a modified box-counting algorithm as described by Wen-Li Lee and Kai-Sheng Hsieh.
+
+    Args:
+        image: A 2D array containing a grayscale image. Format should be equivalent to cv2.imread(flags=0).
+               The size of the image has no constraints, but it typically works best on square images.
+               If the image is not square, the algorithm uses a sliding window or similar logic based on M (height).
+               This implementation assumes M is the dimension to iterate over.
+        min_box: Minimum box size (L) to use. Default is 2.
+        max_box: Maximum box size (L) to use. Default is M // 2.
+        method: Box-counting engine, one of FRACTAL_METHODS. "vectorized" (default) uses
+                NumPy grouped reductions; "reference" is the original pure-Python loop.
+        cancel_token: Optional CancellationToken; AnalysisCancelled is raised once it is cancelled.
+
+    Returns:
+        float: The fractal dimension Df.
+    """
+    return _fit_dimension(box_counting_curve(image, min_box, max_box, method, cancel_token))
+
+def fractal_profile(image: np.ndarray, min_box: int = 2, max_box: int | None = None, split_box: int | None = None,
+                    method: str = "vectorized", cancel_token=None) -> dict:
+    """
+    Calculates the fractal dimension over the full box range and over fine/coarse bands
+    from a single box-counting pass.
+
+    N(r) for a given box size does not depend on which range it is fitted in, so the curve is
+    computed once and each band is a slice of it. The results are identical to separate
+    fractal_dimension() calls over the same ranges.
+
+    Args:
+        image: A 2D grayscale array, see fractal_dimension().
+        min_box: Minimum box size (L) to use. Default is 2.
+        max_box: Maximum box size (L) to use. Default is M // 2.
+        split_box: Box size separating the small (min_box..split_box) and
+                   large (split_box..max_box) bands. Default is M // 8.
+        method: Box-counting engine, one of FRACTAL_METHODS.
+        cancel_token: Optional CancellationToken; AnalysisCancelled is raised once it is cancelled.
+
+    Returns:
+        dict: fd_default, fd_small, fd_large and the raw curve as a list of (r, N(r)).
+    """
+    if image.ndim != 2:
+        raise ValueError(f"Input image must be a 2D array, got shape {image.shape}")
+
+    M = image.shape[0]
+    if max_box is None:
+        max_box = (M // 2)
+    if split_box is None:
+        split_box = M // 8
+    split_box = min(max(split_box, min_box), max_box)
+
+    curve = box_counting_curve(image, min_box, max_box, method, cancel_token)
+    split_idx = split_box - min_box
+
+    return {
+        "fd_default": _fit_dimension(curve),
+        "fd_small": _fit_dimension(curve[:split_idx + 1]),
+        "fd_large": _fit_dimension(curve[split_idx:]),
+        "curve": curve,
+    }
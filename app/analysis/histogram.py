@@ -1,20 +1,26 @@
 import cv2
 
-def compute_histogram(np_image):
+def compute_histogram(np_image, pixel_count: int | None = None):
     """
     Computes RGB color histogram using OpenCV.
     
     Args:
         np_image: numpy array of the image (RGB format)
+        pixel_count: pixels of the original upload, when np_image was decoded at reduced
+            size (see ANALYSIS_MAX_SIDE): the counts are scaled to it, so they add up to the
+            original's pixels as before
         
     Returns:
         dict: Contains histogram_r, histogram_g, histogram_b as lists
     """
+    scale = 1.0
+    if pixel_count:
+        scale = pixel_count / (np_image.shape[0] * np_image.shape[1])
     # Ensure image is in correct format
     if np_image.ndim == 2:
         # Grayscale image - compute single histogram
         hist = cv2.calcHist([np_image], [0], None, [256], [0, 256])
-        hist = hist.flatten().tolist()
+        hist = (hist.flatten() * scale).tolist()
         return {
             "histogram_r": hist,
             "histogram_g": hist,
@@ -30,7 +36,7 @@ def compute_histogram(np_image):
     
     # Convert to lists for JSON serialization
     return {
-        "histogram_r": hist_r.flatten().tolist(),
-        "histogram_g": hist_g.flatten().tolist(),
-        "histogram_b": hist_b.flatten().tolist()
+        "histogram_r": (hist_r.flatten() * scale).tolist(),
+        "histogram_g": (hist_g.flatten() * scale).tolist(),
+        "histogram_b": (hist_b.flatten() * scale).tolist()
     }
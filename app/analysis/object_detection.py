@@ -1,40 +1,75 @@
 from transformers import pipeline
 from PIL import Image
-from threading import Lock
+
+from .batching import MicroBatcher
+from .cancellation import AnalysisCancelled, check_cancelled
+from .pyramid import at_resolution, original_scale
+from .registry import model_registry
+
+# Short side requested from the image pyramid (YOLOS resizes to a 512px short side)
+INPUT_SHORT_SIDE = 512
+
+def _load_object_detector():
+    # Use small and efficient YOLOS-Tiny for resource-constrained environments
+    return pipeline("object-detection", model="hustvl/yolos-tiny")
 
 # Lazy loading of object detector
-_object_detector = None
-_lock = Lock()
+model_registry.register("object_detector", _load_object_detector)
 
 def get_object_detector():
-    global _object_detector
-    with _lock:
-        if _object_detector is None:
-            # Use small and efficient YOLOS-Tiny for resource-constrained environments
-            _object_detector = pipeline("object-detection", model="hustvl/yolos-tiny")
-    return _object_detector
+    return model_registry.get("object_detector")
+
+def _detect_batch(images, cancel_tokens):
+    with model_registry.in_use("object_detector"):
+        detector = get_object_detector()
+        # The pipeline stacks a batch's pixel values into one tensor, which needs equal sizes:
+        # images of the same size share a forward pass
+        by_size = {}
+        for i, image in enumerate(images):
+            by_size.setdefault(image.size, []).append(i)
+        outputs = [None] * len(images)
+        for indices in by_size.values():
+            # A list input yields one detection list per image
+            results = detector([images[i] for i in indices], batch_size=len(indices))
+            for i, result in zip(indices, results):
+                outputs[i] = result
+        return outputs
+
+_batcher = MicroBatcher("object_detector", _detect_batch)
 
 def warmup_object_detector():
-    get_object_detector()
+    # A dummy inference, so the first real request doesn't pay for lazy kernel setup
+    _detect_batch([Image.new("RGB", (224, 224))], [None])
 
-def detect_objects(image: Image.Image):
+def detect_objects(image: Image.Image, cancel_token=None):
     """
     Detects objects in an image using YOLOS-Tiny.
     Returns a list of detections with labels, scores, and boxes.
     """
     try:
-        detector = get_object_detector()
-        results = detector(image)
+        check_cancelled(cancel_token)
+        level = at_resolution(image, INPUT_SHORT_SIDE)
+        results = _batcher.infer(level, cancel_token)
+        # Boxes are reported in the coordinates of the original upload
+        sx, sy = original_scale(image, level)
         # Simplify results for the frontend/summary
         detections = []
         for res in results:
             if res['score'] > 0.5: # Threshold to filter low-confidence detections
+                box = res['box']
+                if (sx, sy) != (1.0, 1.0):
+                    box = {
+                        "xmin": round(box["xmin"] * sx), "ymin": round(box["ymin"] * sy),
+                        "xmax": round(box["xmax"] * sx), "ymax": round(box["ymax"] * sy),
+                    }
                 detections.append({
                     "label": res['label'],
                     "score": float(res['score']),
-                    "box": res['box']
+                    "box": box
                 })
         return detections
+    except AnalysisCancelled:
+        raise
     except Exception as e:
         print(f"Object detection error: {e}")
         return None
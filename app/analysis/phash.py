@@ -0,0 +1,95 @@
+import itertools
+import threading
+from collections import defaultdict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Side of the grayscale thumbnail the DCT runs on, and of the low-frequency block kept from it
+PHASH_INPUT_SIDE = 32
+PHASH_SIDE = 8
+PHASH_BITS = PHASH_SIDE * PHASH_SIDE
+
+def perceptual_hash(image: Image.Image) -> int:
+    """
+    64-bit DCT perceptual hash (pHash) of an image.
+
+    The image is reduced to a 32x32 grayscale thumbnail and each of the 8x8 lowest DCT
+    frequencies becomes one bit (above or below their median). Re-encoded, resized or
+    recompressed copies of an image land within a few bits of each other.
+    """
+    # BOX averages whole source areas; reducing_gap shrinks large images cheaply first
+    thumbnail = image.convert("RGB").resize((PHASH_INPUT_SIDE, PHASH_INPUT_SIDE), Image.BOX, reducing_gap=2.0)
+    gray = np.asarray(thumbnail.convert("L"), dtype=np.float32)
+    low = cv2.dct(gray)[:PHASH_SIDE, :PHASH_SIDE].flatten()
+    # The DC term (overall brightness) would skew the median
+    bits = low > np.median(low[1:])
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+class HammingIndex:
+    """
+    Multi-index hashing over fixed-size hashes, for Hamming-radius lookups.
+
+    Each hash is split into `chunks` equal parts, each with its own exact-match table. Two
+    hashes within distance r differ in at most r // chunks bits in at least one part, so a
+    query only probes the few values near each of its parts and checks the full distance on
+    the entries found there, instead of scanning every stored hash.
+    """
+
+    def __init__(self, bits: int = PHASH_BITS, chunks: int = 4):
+        if bits % chunks:
+            raise ValueError("bits must be a multiple of chunks")
+        self.bits = bits
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self._tables = [defaultdict(list) for _ in range(chunks)]
+        self._entries = []  # (hash, value), referenced by position from the tables
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _parts(self, value: int):
+        mask = (1 << self.chunk_bits) - 1
+        return [(value >> (i * self.chunk_bits)) & mask for i in range(self.chunks)]
+
+    def _probes(self, part: int, radius: int):
+        # Every value within `radius` bit flips of part
+        for flips in range(radius + 1):
+            for positions in itertools.combinations(range(self.chunk_bits), flips):
+                probe = part
+                for position in positions:
+                    probe ^= 1 << position
+                yield probe
+
+    def add(self, hash_value: int, value):
+        with self._lock:
+            position = len(self._entries)
+            self._entries.append((hash_value, value))
+            for table, part in zip(self._tables, self._parts(hash_value)):
+                table[part].append(position)
+
+    def search(self, hash_value: int, radius: int) -> list:
+        """
+        Returns (distance, hash, value) for every entry within radius bits, nearest first.
+        """
+        part_radius = radius // self.chunks
+        with self._lock:
+            seen = set()
+            matches = []
+            for table, part in zip(self._tables, self._parts(hash_value)):
+                for probe in self._probes(part, part_radius):
+                    for position in table.get(probe, ()):
+                        if position in seen:
+                            continue
+                        seen.add(position)
+                        stored, value = self._entries[position]
+                        distance = hamming_distance(hash_value, stored)
+                        if distance <= radius:
+                            matches.append((distance, stored, value))
+        matches.sort(key=lambda match: match[0])
+        return matches
@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+class ImagePyramid:
+    """
+    Lazily built, shared resolution levels of one decoded upload.
+
+    Each analyzer asks for the size it needs (its model's input short side) instead of resizing
+    the full image on its own. A level is made from the smallest level already built that is
+    still large enough, so e.g. the 224px level comes from the 384px one once that exists.
+    Levels are built at most once, under a lock, since the analysis steps run concurrently.
+    """
+
+    def __init__(self, base: Image.Image, base_array: np.ndarray | None = None, original_size: tuple | None = None):
+        self.base = base
+        self._base_array = base_array
+        # (width, height) of the upload before any reduced decode
+        self.original_size = original_size or base.size
+        self._levels = {}
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    def image(self, short_side: int | None = None) -> Image.Image:
+        """
+        Returns the image scaled down so its short side is short_side (aspect ratio kept).
+        The base image is returned as is if it is not larger than that, or for short_side=None.
+        """
+        if short_side is None or min(self.base.size) <= short_side:
+            return self.base
+        with self._lock:
+            level = self._levels.get(short_side)
+            if level is None:
+                level = self._build(short_side)
+                self._levels[short_side] = level
+            return level
+
+    def array(self, short_side: int | None = None) -> np.ndarray:
+        """
+        Same as image(), as an RGB uint8 array.
+        """
+        if short_side is None or min(self.base.size) <= short_side:
+            if self._base_array is None:
+                self._base_array = np.array(self.base)
+            return self._base_array
+        level = self.image(short_side)
+        with self._lock:
+            array = self._arrays.get(short_side)
+            if array is None:
+                array = np.array(level)
+                self._arrays[short_side] = array
+            return array
+
+    def _build(self, short_side: int) -> Image.Image:
+        w, h = self.base.size
+        scale = short_side / min(w, h)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        # Smallest existing level that still covers the target size
+        sources = [level for level in self._levels.values() if level.size[0] >= size[0] and level.size[1] >= size[1]]
+        source = min(sources, key=lambda level: level.size[0], default=self.base)
+        # reducing_gap shrinks by whole factors first (cheap), then resamples the remainder
+        return source.resize(size, Image.BICUBIC, reducing_gap=2.0)
+
+def at_resolution(image, short_side: int | None = None) -> Image.Image:
+    """
+    Returns the pyramid level for short_side if image is an ImagePyramid; a plain PIL image is
+    returned unchanged (its model processor resizes it as before).
+    """
+    if isinstance(image, ImagePyramid):
+        return image.image(short_side)
+    return image
+
+def original_scale(image, level: Image.Image) -> tuple:
+    """
+    (x, y) factors mapping pixel coordinates in level back to the original upload.
+    """
+    if isinstance(image, ImagePyramid):
+        return image.original_size[0] / level.size[0], image.original_size[1] / level.size[1]
+    return 1.0, 1.0
@@ -0,0 +1,205 @@
+import contextlib
+import gc
+import os
+import threading
+import time
+
+import torch
+
+# Upper bound for the summed weights of all loaded models; 0 means no limit.
+# Idle models are unloaded least-recently-used first to stay under it.
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("MODEL_MEMORY_BUDGET_MB", "0"))
+
+def _rss_bytes():
+    # Resident set size of this process (Linux only)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _tensor_bytes(module: torch.nn.Module) -> int:
+    tensors = {}
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        # Tied weights share storage; count it once
+        tensors[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+    return sum(tensors.values())
+
+def model_bytes(obj) -> int:
+    """
+    Size of the weights held by obj: a torch module, a transformers pipeline, or a tuple of them
+    (e.g. a (processor, model) pair). Anything else counts as 0.
+    """
+    if isinstance(obj, torch.nn.Module):
+        return _tensor_bytes(obj)
+    if isinstance(obj, (tuple, list)):
+        return sum(model_bytes(item) for item in obj)
+    inner = getattr(obj, "model", None)
+    if isinstance(inner, torch.nn.Module):
+        return _tensor_bytes(inner)
+    return 0
+
+class _Entry:
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.load_lock = threading.Lock()
+        self.model = None
+        self.state = "unloaded"
+        self.error = None
+        self.load_seconds = None
+        self.memory_bytes = None
+        self.rss_delta_bytes = None
+        self.loads = 0
+        self.evictions = 0
+        self.in_use = 0
+        self.last_used = 0.0
+
+class ModelRegistry:
+    """
+    Owns the lazily loaded models.
+
+    Each model loads at most once at a time under its own lock, so concurrent first requests
+    wait for one load instead of each loading a copy. Load time and weight size are recorded
+    per model. With a memory budget, loading a model first unloads idle models (least recently
+    used first) until it fits; a model is idle while no caller holds it through in_use().
+    """
+
+    def __init__(self, budget_bytes: int | None = None):
+        self.budget_bytes = int(MODEL_MEMORY_BUDGET_MB * 1024 * 1024) if budget_bytes is None else budget_bytes
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader):
+        """
+        Registers loader() as the way to build model `name`. Nothing is loaded yet.
+        """
+        with self._lock:
+            self._entries[name] = _Entry(name, loader)
+
+    def get(self, name: str):
+        """
+        Returns model `name`, loading it first if needed.
+        """
+        entry = self._entries[name]
+        model = entry.model
+        if model is None:
+            with entry.load_lock:
+                model = entry.model
+                if model is None:
+                    model = self._load(entry)
+        with self._lock:
+            entry.last_used = time.monotonic()
+        return model
+
+    @contextlib.contextmanager
+    def in_use(self, name: str):
+        """
+        Marks model `name` as busy for the duration of the block so it is not evicted mid-inference.
+        """
+        entry = self._entries[name]
+        with self._lock:
+            entry.in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def _load(self, entry: _Entry):
+        # Make room for what this model weighed last time (unknown on the first load)
+        self._enforce_budget(exclude=entry, incoming=entry.memory_bytes or 0)
+        entry.state = "loading"
+        entry.error = None
+        rss_before = _rss_bytes()
+        started = time.perf_counter()
+        try:
+            model = entry.loader()
+        except Exception as e:
+            entry.state = "failed"
+            entry.error = str(e)
+            raise
+        rss_after = _rss_bytes()
+
+        with self._lock:
+            entry.model = model
+            entry.state = "ready"
+            entry.load_seconds = time.perf_counter() - started
+            entry.memory_bytes = model_bytes(model)
+            entry.rss_delta_bytes = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+            entry.loads += 1
+            entry.last_used = time.monotonic()
+        self._enforce_budget(exclude=entry)
+        return model
+
+    def _resident_bytes(self) -> int:
+        return sum(e.memory_bytes or 0 for e in self._entries.values() if e.model is not None)
+
+    def _enforce_budget(self, exclude: _Entry = None, incoming: int = 0):
+        if self.budget_bytes <= 0:
+            return
+        while True:
+            with self._lock:
+                if self._resident_bytes() + incoming <= self.budget_bytes:
+                    return
+                idle = [e for e in self._entries.values()
+                        if e is not exclude and e.model is not None and e.in_use == 0]
+                if not idle:
+                    print(f"Model memory budget of {self.budget_bytes} bytes exceeded; no idle model to evict")
+                    return
+                victim = min(idle, key=lambda e: e.last_used)
+                self._unload(victim)
+            self._release_memory()
+
+    def _unload(self, entry: _Entry):
+        entry.model = None
+        entry.state = "unloaded"
+        entry.evictions += 1
+
+    def _release_memory(self):
+        # Called without holding the registry lock: collecting can take a while
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def evict(self, name: str) -> bool:
+        """
+        Unloads model `name` if it is loaded and idle. Returns whether it was unloaded.
+        """
+        entry = self._entries[name]
+        with entry.load_lock, self._lock:
+            if entry.model is None or entry.in_use:
+                return False
+            self._unload(entry)
+        self._release_memory()
+        return True
+
+    def state(self, name: str) -> str:
+        return self._entries[name].state
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            models = {
+                name: {
+                    "state": e.state,
+                    "load_seconds": e.load_seconds,
+                    "memory_bytes": e.memory_bytes,
+                    "rss_delta_bytes": e.rss_delta_bytes,
+                    "loads": e.loads,
+                    "evictions": e.evictions,
+                    "in_use": e.in_use,
+                    "idle_seconds": round(now - e.last_used, 3) if e.model is not None and not e.in_use else None,
+                    "error": e.error,
+                }
+                for name, e in self._entries.items()
+            }
+            return {
+                "budget_bytes": self.budget_bytes or None,
+                "resident_bytes": self._resident_bytes(),
+                "process_rss_bytes": _rss_bytes(),
+                "models": models,
+            }
+
+model_registry = ModelRegistry()
@@ -1,24 +1,67 @@
-from transformers import pipeline
-from threading import Lock
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, pipeline
+
+from .batching import MicroBatcher
+from .cancellation import AnalysisCancelled, check_cancelled
+from .registry import model_registry
 
 SUMMARIZER_TEMPERATURE = 0.75
+# Returned when generation fails, so the analysis still completes
+SUMMARY_FAILED = "Analysis completed, but summary generation failed."
+
+def _load_summarizer():
+    # lightweight (~300MB) google/flan-t5-small 
+    return pipeline("text2text-generation", model="google/flan-t5-small")
 
 # Lazy loading of summarizer model
-_summarizer = None
-_lock = Lock()
+model_registry.register("summarizer", _load_summarizer)
 
 def get_summarizer():
-    global _summarizer
-    with _lock:
-        if _summarizer is None:
-            # lightweight (~300MB) google/flan-t5-small 
-            _summarizer = pipeline("text2text-generation", model="google/flan-t5-small")
-    return _summarizer
+    return model_registry.get("summarizer")
+
+class CancellationCriteria(StoppingCriteria):
+    """
+    Stops generation between tokens for each batch row whose request has been cancelled,
+    leaving the other rows of the batch running.
+    """
+
+    def __init__(self, cancel_tokens):
+        self.cancel_tokens = cancel_tokens
+
+    def __call__(self, input_ids, scores, **kwargs):
+        flags = [token is not None and token.cancelled for token in self.cancel_tokens]
+        if len(flags) != input_ids.shape[0]:
+            # Rows don't map 1:1 to requests (e.g. beam search): only stop once all are cancelled
+            flags = [all(flags)] * input_ids.shape[0]
+        return torch.tensor(flags, dtype=torch.bool, device=input_ids.device)
+
+def _generate_batch(prompts, cancel_tokens):
+    with model_registry.in_use("summarizer"):
+        model = get_summarizer()
+        # Adjusted parameters for flan-t5-small to reduce repetition and improve variety
+        outputs = model(
+            prompts, 
+            batch_size=len(prompts),
+            max_new_tokens=120, 
+            do_sample=True, 
+            temperature=SUMMARIZER_TEMPERATURE, 
+            top_p=0.9,
+            repetition_penalty=1.5,
+            no_repeat_ngram_size=3,
+            stopping_criteria=StoppingCriteriaList([CancellationCriteria(cancel_tokens)])
+        )
+    # A list of prompts yields one dict per prompt (a list only with num_return_sequences > 1);
+    # hand each caller the result list a single prompt gets
+    return [[output] if isinstance(output, dict) else output for output in outputs]
+
+_batcher = MicroBatcher("summarizer", _generate_batch)
 
 def warmup_summarizer():
-    get_summarizer()
+    # A short dummy generation, so the first real request doesn't pay for lazy kernel setup
+    with model_registry.in_use("summarizer"):
+        get_summarizer()("Output:", max_new_tokens=4)
 
-def generate_summary(analysis_data: dict) -> str:
+def generate_summary(analysis_data: dict, cancel_token=None) -> str:
     """
     Generates a human-readable summary of the image analysis results.
     """
@@ -65,17 +108,11 @@ def generate_summary(analysis_data: dict) -> str:
             f"Output:"
         )
 
-        model = get_summarizer()
-        # Adjusted parameters for flan-t5-small to reduce repetition and improve variety
-        results = model(
-            prompt, 
-            max_new_tokens=120, 
-            do_sample=True, 
-            temperature=SUMMARIZER_TEMPERATURE, 
-            top_p=0.9,
-            repetition_penalty=1.5,
-            no_repeat_ngram_size=3
-        )
+        check_cancelled(cancel_token)
+        # Batched with concurrent requests; one result list per prompt, as for a single prompt
+        results = _batcher.infer(prompt, cancel_token)
+        # Generation stopped early by CancellationCriteria: the partial text is of no use
+        check_cancelled(cancel_token)
         
         # # Debug
         # with open("/app/debug_summarizer.log", "a") as f:
@@ -99,6 +136,8 @@ def generate_summary(analysis_data: dict) -> str:
 
         return "Analysis completed successfully. The image data is consistent with the characteristics of the detected medium."
         
+    except AnalysisCancelled:
+        raise
     except Exception as e:
         print(f"Summarization error: {e}")
-        return "Analysis completed, but summary generation failed."
+        return SUMMARY_FAILED
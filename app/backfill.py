@@ -0,0 +1,170 @@
+"""
+Re-runs the analysis steps whose version changed (see STEP_VERSIONS in app.analysis) over the
+images already stored, and updates their image_stats rows in place.
+
+    python -m app.backfill [--steps "Object Detection" ...] [--limit N] [--dry-run]
+
+A step's output is taken from the step cache when another upload of the same content was
+already recomputed; otherwise the upload is re-read from the blob store. Images stored before
+the blob store existed (no content hash) are not considered.
+"""
+import argparse
+import logging
+
+from app.analysis import (
+    STEP_INPUTS,
+    STEP_VERSIONS,
+    ImagePyramid,
+    analyze_art_medium,
+    compute_fractal_stats,
+    detect_ai,
+    detect_objects,
+    extract_metadata_from_bytes,
+    prepare_image,
+    step_failed,
+    step_version,
+)
+from app.analysis.analysis import FRACTAL_SIZE
+from app.analysis.summarizer import generate_summary
+from app.blobstore import get_blob
+from app.database import (
+    get_step_result,
+    get_stored_images,
+    init_db,
+    put_step_result,
+    update_image_stats,
+)
+
+logger = logging.getLogger(__name__)
+
+def _summary_input(row):
+    # Same shape as the analysis results the summarizer gets during an upload
+    return {
+        "width": row["width"],
+        "height": row["height"],
+        "mean_color": [row["mean_color_r"], row["mean_color_g"], row["mean_color_b"]],
+        "ai_probability": row["ai_probability"],
+        "fd_default": row["fd_default"],
+        "fd_small": row["fd_small"],
+        "fd_large": row["fd_large"],
+        "metadata_analysis": row["metadata_analysis"],
+        "art_medium_analysis": row["art_medium_analysis"],
+        "object_detection": row["object_detection"],
+    }
+
+# Step -> function(content, pyramid, row) computing its output. Histograms aren't stored in
+# image_stats.
+STEP_RUNNERS = {
+    "Metadata Analysis": lambda content, pyramid, row: extract_metadata_from_bytes(content),
+    "AI Classifier": lambda content, pyramid, row: detect_ai(pyramid),
+    "Fractal Dimension": lambda content, pyramid, row: compute_fractal_stats(pyramid.array(FRACTAL_SIZE)),
+    "Art Medium Analysis": lambda content, pyramid, row: analyze_art_medium(pyramid),
+    "Object Detection": lambda content, pyramid, row: detect_objects(pyramid),
+    "Insight Summary": lambda content, pyramid, row: generate_summary(_summary_input(row)),
+}
+
+def step_columns(step, result):
+    """
+    The image_stats columns holding a step's output.
+    """
+    if step == "Fractal Dimension":
+        return {name: result.get(name) for name in ("fd_default", "fd_small", "fd_large")}
+    column = {
+        "Metadata Analysis": "metadata_analysis",
+        "AI Classifier": "ai_probability",
+        "Art Medium Analysis": "art_medium_analysis",
+        "Object Detection": "object_detection",
+        "Insight Summary": "summary",
+    }[step]
+    return {column: result}
+
+def stale_steps(row, steps=None):
+    """
+    Steps (in run order) whose stored output for this row is from another version.
+    """
+    steps = STEP_RUNNERS if steps is None else steps
+    return [step for step in STEP_VERSIONS
+            if step in steps and step in STEP_RUNNERS
+            and row["step_versions"].get(step) != step_version(step)]
+
+def backfill_image(row, steps=None):
+    """
+    Brings one stored image up to date for the given steps (default all) and returns the
+    steps that were updated. Raises LookupError if a step has to be recomputed but the
+    upload isn't in the blob store. A step that fails keeps its old output and version, as do
+    the steps fed by it (a later run retries them).
+    """
+    stale = stale_steps(row, steps)
+    content = pyramid = None
+    values = {}
+    updated = []
+    failed = set()
+    for step in stale:
+        if failed.intersection(STEP_INPUTS.get(step, ())):
+            failed.add(step)
+            continue
+        version = step_version(step)
+        result = get_step_result(row["content_hash"], step, version)
+        if result is None:
+            if pyramid is None and step not in STEP_INPUTS:
+                content = get_blob(row["content_hash"])
+                if content is None:
+                    raise LookupError(f"upload {row['content_hash']} is not in the blob store")
+                image, np_image, width, height, _ = prepare_image(content)
+                pyramid = ImagePyramid(image, np_image, original_size=(width, height))
+            result = STEP_RUNNERS[step](content, pyramid, row)
+            if step_failed(step, result):
+                logger.warning(f"{row['id']}: {step} failed, left at its previous version")
+                failed.add(step)
+                continue
+            put_step_result(row["content_hash"], step, version, result)
+        columns = step_columns(step, result)
+        # Later steps (the summary) read the updated values
+        row.update(columns)
+        values.update(columns)
+        row["step_versions"][step] = version
+        updated.append(step)
+    if updated:
+        update_image_stats(row["id"], {**values, "step_versions": row["step_versions"]})
+    return updated
+
+def backfill(steps=None, limit=0, dry_run=False):
+    """
+    Runs backfill_image over the stored images. Returns counts of updated, skipped (missing
+    upload or failed) and already current images.
+    """
+    counts = {"updated": 0, "skipped": 0, "current": 0}
+    for row in get_stored_images(limit):
+        stale = stale_steps(row, steps)
+        if not stale:
+            counts["current"] += 1
+            continue
+        if dry_run:
+            logger.info(f"{row['id']}: would update {', '.join(stale)}")
+            counts["updated"] += 1
+            continue
+        try:
+            updated = backfill_image(row, steps)
+        except Exception as e:  # noqa: BLE001 - one bad image (or model error) skips only that row
+            logger.error(f"{row['id']}: skipped ({e})")
+            counts["skipped"] += 1
+            continue
+        logger.info(f"{row['id']}: updated {', '.join(updated) or 'nothing'}")
+        counts["updated"] += 1
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--steps", nargs="+", choices=list(STEP_RUNNERS),
+                        help="only update these steps (default: every step whose version changed)")
+    parser.add_argument("--limit", type=int, default=0, help="only look at the N oldest images")
+    parser.add_argument("--dry-run", action="store_true", help="list what would be updated")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    init_db()
+    counts = backfill(args.steps, args.limit, args.dry_run)
+    print(f"updated: {counts['updated']}, skipped: {counts['skipped']}, current: {counts['current']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Content-addressed store for the original upload bytes, so stored images can be re-analyzed
+later (see app.backfill). A blob lives at BLOB_STORE_DIR/<first two hex digits>/<sha256>.
+"""
+import hashlib
+import os
+import tempfile
+
+# Empty disables the store (uploads are then not kept, and can't be backfilled)
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", "cache/blobs")
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def blob_path(digest: str) -> str:
+    return os.path.join(BLOB_STORE_DIR, digest[:2], digest)
+
+def put_blob(content: bytes, digest: str | None = None) -> str:
+    """
+    Stores content under its hash (computed if not given) and returns the hash, or None if the
+    store is disabled. Writing the same content again is a no-op.
+    """
+    if not BLOB_STORE_DIR:
+        return None
+    digest = digest or content_hash(content)
+    path = blob_path(digest)
+    if os.path.exists(path):
+        return digest
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file and rename, so a reader never sees a partial blob
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest
+
+def get_blob(digest: str) -> bytes:
+    """
+    Returns the stored bytes for this hash, or None if they aren't in the store.
+    """
+    if not BLOB_STORE_DIR:
+        return None
+    try:
+        with open(blob_path(digest), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
@@ -1,7 +1,72 @@
 import duckdb
 import uuid
 import os
+import time
+import queue
+import threading
 import contextlib
+from concurrent.futures import Future
+
+# DuckDB lets one process at a time open the file; with the job queue's worker processes
+# (app.worker) sharing it, a connection waits up to this long for the others' to close
+DB_LOCK_TIMEOUT_SECONDS = float(os.environ.get("DB_LOCK_TIMEOUT_SECONDS", "30"))
+
+def connect_with_retry(db_path):
+  deadline = time.monotonic() + DB_LOCK_TIMEOUT_SECONDS
+  delay = 0.005
+  while True:
+    try:
+      return duckdb.connect(db_path)
+    except duckdb.IOException as e:
+      if "lock" not in str(e).lower() or time.monotonic() >= deadline:
+        raise
+    time.sleep(delay)
+    delay = min(delay * 2, 0.2)
+
+# The process keeps one connection per database file and gives each thread its own cursor
+# on it. An open connection holds DuckDB's file lock, so when several processes share the
+# file (job queue workers, `uvicorn --workers` with a shared task state) each operation opens
+# and closes its own connection instead.
+DB_KEEP_CONNECTION = os.environ.get(
+  "DB_KEEP_CONNECTION",
+  "0" if os.environ.get("JOB_QUEUE_PATH") or os.environ.get("TASK_STATE_BACKEND", "local") != "local" else "1"
+) == "1"
+# Most writes the database writer thread commits in one transaction
+WRITE_BATCH_MAX = 256
+# Time buckets of the stats rollup: "hour" or "day" (changing it rebuilds the rollup on startup)
+STATS_ROLLUP_BUCKET = os.environ.get("STATS_ROLLUP_BUCKET", "hour")
+
+class ConnectionManager:
+  """
+  Long-lived DuckDB connections (one per database file) with per-thread cursors: a
+  connection must not be used by two threads at once, its cursors can.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._connections = {}
+    self._local = threading.local()
+
+  def cursor(self, db_path):
+    cursors = self._local.__dict__.setdefault("cursors", {})
+    cursor = cursors.get(db_path)
+    if cursor is None:
+      with self._lock:
+        con = self._connections.get(db_path)
+        if con is None:
+          con = self._connections[db_path] = connect_with_retry(db_path)
+        cursor = cursors[db_path] = con.cursor()
+    return cursor
+
+  def close(self):
+    with self._lock:
+      for con in self._connections.values():
+        con.close()
+      self._connections.clear()
+      # Cursors of the closed connections are dead; threads open new ones on next use
+      self._local = threading.local()
+
+connections = ConnectionManager()
 
 @contextlib.contextmanager
 def get_db_connection():
@@ -11,13 +76,156 @@ def get_db_connection():
   db_dir = os.path.dirname(db_path)
   if db_dir and not os.path.exists(db_dir):
       os.makedirs(db_dir, exist_ok=True)
-      
-  con = duckdb.connect(db_path)
+
+  if DB_KEEP_CONNECTION:
+    yield connections.cursor(db_path)
+    return
+  con = connect_with_retry(db_path)
   try:
     yield con
   finally:
     con.close()
 
+class WriteBehind:
+  """
+  Queue of writes committed by a dedicated thread. Each write is a list of (sql, params)
+  statements; the thread commits whatever has queued up since its last commit (up to
+  WRITE_BATCH_MAX writes) in one transaction, running consecutive identical statements as
+  one executemany, so inserts per second grow with load instead of paying a commit each.
+  """
+
+  def __init__(self):
+    self._queue = queue.Queue()
+    self._thread = None
+    self._lock = threading.Lock()
+    self._outstanding = 0  # submitted, not yet committed or failed
+    self.counters = {"writes": 0, "batches": 0, "failed": 0}
+
+  def submit(self, statements) -> Future:
+    """
+    Queues one write; the returned future is done once it is committed (or failed).
+    Cancelling the future before its batch starts drops the write.
+    """
+    future = Future()
+    future.add_done_callback(self._done)
+    with self._lock:
+      self._outstanding += 1
+      if self._thread is None or not self._thread.is_alive():
+        self._thread = threading.Thread(target=self._run, name="database-writer", daemon=True)
+        self._thread.start()
+    self._queue.put((statements, future))
+    return future
+
+  def _done(self, _):
+    with self._lock:
+      self._outstanding -= 1
+
+  def flush(self):
+    """
+    Waits until everything queued so far is committed (returns at once if nothing is).
+    """
+    if self.pending():
+      self.submit([]).result()
+
+  def pending(self) -> int:
+    return self._outstanding
+
+  def _run(self):
+    while True:
+      batch = [self._queue.get()]
+      while len(batch) < WRITE_BATCH_MAX:
+        try:
+          batch.append(self._queue.get_nowait())
+        except queue.Empty:
+          break
+      self._commit([(statements, future) for statements, future in batch
+                    if future.set_running_or_notify_cancel()])
+
+  def _commit(self, batch):
+    if not batch:
+      return
+    # Consecutive runs of the same statement, as (sql, [params, ...])
+    runs = []
+    for statements, _ in batch:
+      for sql, params in statements:
+        if runs and runs[-1][0] == sql:
+          runs[-1][1].append(params)
+        else:
+          runs.append((sql, [params]))
+    try:
+      with get_db_connection() as con:
+        con.execute("BEGIN TRANSACTION")
+        try:
+          for sql, rows in runs:
+            if len(rows) == 1:
+              con.execute(sql, rows[0])
+            else:
+              con.executemany(sql, rows)
+          con.execute("COMMIT")
+        except BaseException:
+          con.execute("ROLLBACK")
+          raise
+    except Exception as e:  # noqa: BLE001 - bisected down to the failing write, whose caller gets it
+      if len(batch) > 1:
+        # One bad write must not take the others down with it: retry in halves to find it
+        half = len(batch) // 2
+        self._commit(batch[:half])
+        self._commit(batch[half:])
+        return
+      self.counters["failed"] += 1
+      batch[0][1].set_exception(e)
+      return
+    self.counters["writes"] += len(batch)
+    self.counters["batches"] += 1
+    for _, future in batch:
+      future.set_result(None)
+
+  def stats(self) -> dict:
+    return {**self.counters, "pending": self.pending()}
+
+writer = WriteBehind()
+
+# Cache entries queued for the writer by key, so lookups see them before they are committed
+# without waiting for the writer (which may be busy with other analyses' writes)
+_queued_entries = {}
+_queued_entries_lock = threading.Lock()
+
+def queue_entry(key, result, statements) -> Future:
+  with _queued_entries_lock:
+    _queued_entries[key] = result
+  saved = writer.submit(statements)
+
+  def committed(_):
+    with _queued_entries_lock:
+      # A later write of the same key replaced ours: leave it
+      if _queued_entries.get(key) is result:
+        del _queued_entries[key]
+  saved.add_done_callback(committed)
+  return saved
+
+def queued_entry(key):
+  with _queued_entries_lock:
+    return _queued_entries.get(key)
+
+# Bumped after every committed change to image_stats in this process, for caches of /stats
+_stats_version = 0
+_stats_version_lock = threading.Lock()
+
+def stats_version() -> int:
+  return _stats_version
+
+def stats_changed(*_):
+  global _stats_version
+  with _stats_version_lock:
+    _stats_version += 1
+
+def close_db():
+  """
+  Commits the queued writes and closes the kept connections.
+  """
+  writer.flush()
+  connections.close()
+
 def init_db():
     with get_db_connection() as con:
         con.execute("""
@@ -36,17 +244,210 @@ def init_db():
                 summary VARCHAR,
                 ai_probability DOUBLE,
                 fd_default DOUBLE,
-                object_detection VARCHAR
+                object_detection VARCHAR,
+                fd_small DOUBLE,
+                fd_large DOUBLE
+            )
+        """)
+        # Columns added after the initial schema; bring existing databases up to date
+        con.execute("ALTER TABLE image_stats ADD COLUMN IF NOT EXISTS fd_small DOUBLE")
+        con.execute("ALTER TABLE image_stats ADD COLUMN IF NOT EXISTS fd_large DOUBLE")
+        # Upload hash (key into the blob store) and the step versions the row's values come from
+        con.execute("ALTER TABLE image_stats ADD COLUMN IF NOT EXISTS content_hash VARCHAR")
+        con.execute("ALTER TABLE image_stats ADD COLUMN IF NOT EXISTS step_versions VARCHAR")
+        # 64-bit perceptual hash, for finding re-encoded or resized copies
+        con.execute("ALTER TABLE image_stats ADD COLUMN IF NOT EXISTS phash UBIGINT")
+        # Typed copies of JSON fields, so /stats aggregates them in SQL (see typed_columns)
+        con.execute("ALTER TABLE image_stats ADD COLUMN IF NOT EXISTS medium VARCHAR")
+        con.execute("ALTER TABLE image_stats ADD COLUMN IF NOT EXISTS medium_confidence DOUBLE")
+        con.execute("ALTER TABLE image_stats ADD COLUMN IF NOT EXISTS metadata_tags MAP(VARCHAR, VARCHAR)")
+        migrate_typed_columns(con)
+        # Running totals behind /stats, per time bucket (see rollup_sql)
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS stats_rollup (
+                bucket TIMESTAMP,
+                metric VARCHAR,
+                key VARCHAR,
+                value DOUBLE,
+                PRIMARY KEY (bucket, metric, key)
+            )
+        """)
+        con.execute("CREATE TABLE IF NOT EXISTS stats_rollup_info (bucket_unit VARCHAR)")
+        row = con.execute("SELECT bucket_unit FROM stats_rollup_info").fetchone()
+        if row is None or row[0] != STATS_ROLLUP_BUCKET:
+            rebuild_stats_rollup(con)
+        # Finished analyses by upload content, so re-uploads of the same file skip the models
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                content_hash VARCHAR,
+                analyzer_version VARCHAR,
+                result VARCHAR,
+                size_bytes INTEGER,
+                created_at TIMESTAMP,
+                last_hit TIMESTAMP,
+                hits INTEGER,
+                PRIMARY KEY (content_hash, analyzer_version)
+            )
+        """)
+        # Output of each analysis step by upload content, so a changed step can be rerun alone
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS step_cache (
+                content_hash VARCHAR,
+                step VARCHAR,
+                step_version VARCHAR,
+                result VARCHAR,
+                created_at TIMESTAMP,
+                PRIMARY KEY (content_hash, step, step_version)
+            )
+        """)
+        # Finished tasks evicted from memory, so /progress/{task_id} still answers for them
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS task_spill (
+                task_id VARCHAR PRIMARY KEY,
+                status VARCHAR,
+                state VARCHAR,
+                spilled_at TIMESTAMP
             )
         """)
 
-def save_stats(filename, url, stats):
-    with get_db_connection() as con:
-        image_id = str(uuid.uuid4())
-        import json
+def migrate_typed_columns(con):
+    """
+    Fills the typed columns of rows stored before they existed from their JSON columns.
+    """
+    columns = {row[1] for row in con.execute("PRAGMA table_info('image_stats')").fetchall()}
+    if "art_medium_analysis" in columns:
+        con.execute("""
+            UPDATE image_stats SET
+                medium = json_extract_string(art_medium_analysis, '$.medium'),
+                medium_confidence = TRY_CAST(json_extract_string(art_medium_analysis, '$.confidence') AS DOUBLE)
+            WHERE medium IS NULL AND json_valid(art_medium_analysis)
+              AND json_extract_string(art_medium_analysis, '$.medium') IS NOT NULL
+        """)
+    if "metadata_analysis" in columns:
+        # Rows without tags get an empty map, so they are migrated once
         con.execute("""
-            INSERT INTO image_stats (id, filename, upload_time, width, height, mean_color_r, mean_color_g, mean_color_b, url, metadata_analysis, art_medium_analysis, summary, ai_probability, fd_default, object_detection)
-            VALUES (?, ?, current_timestamp, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            UPDATE image_stats SET metadata_tags = coalesce(
+                TRY_CAST(json_extract(metadata_analysis, '$.tags') AS MAP(VARCHAR, VARCHAR)), MAP {})
+            WHERE metadata_tags IS NULL
+        """)
+
+# Fractal dimension histogram of /stats: FRACTAL_BINS bins over [2.0, 3.0), values outside
+# going to the end bins
+FRACTAL_BINS = 50
+# image_stats columns whose averages /stats reports
+AVERAGED_COLUMNS = ("width", "height", "mean_color_r", "mean_color_g", "mean_color_b")
+ROLLUP_SOURCE_COLUMNS = ("upload_time", "ai_probability", "fd_default", "medium", "metadata_tags") + AVERAGED_COLUMNS
+
+def rollup_sql(source, sign=1):
+    """
+    Statement adding (sign=1) or taking back (sign=-1) the contributions of the image_stats
+    rows selected by source (a subquery with their ROLLUP_SOURCE_COLUMNS) to stats_rollup.
+
+    Rows of stats_rollup are (bucket, metric, key, value): the start of the upload time bucket,
+    then ("images", "") -> row count, ("sum" | "count", column) -> sum and non-null count of
+    an AVERAGED_COLUMNS column, ("ai_tag" | "human_tag", "tag: value") -> rows with that
+    metadata tag by ai_probability >= 0.5 or not, ("medium", medium) -> rows with that art
+    medium, ("fractal_bin", bin number) -> rows in that bin of fd_default.
+    """
+    measures = ", ".join(f"CAST({column} AS DOUBLE) AS {column}" for column in AVERAGED_COLUMNS)
+    return f"""
+        INSERT INTO stats_rollup (bucket, metric, key, value)
+        WITH rows AS (
+            SELECT date_trunc('{STATS_ROLLUP_BUCKET}', coalesce(upload_time, TIMESTAMP '1970-01-01')) AS bucket, *
+            FROM {source}
+        ),
+        measures AS (
+            UNPIVOT (SELECT bucket, {measures} FROM rows)
+            ON {", ".join(AVERAGED_COLUMNS)} INTO NAME name VALUE v
+        )
+        SELECT bucket, 'images', '', {sign} * COUNT(*) FROM rows GROUP BY bucket
+        UNION ALL
+        SELECT bucket, 'sum', name, {sign} * SUM(v) FROM measures GROUP BY bucket, name
+        UNION ALL
+        SELECT bucket, 'count', name, {sign} * COUNT(v) FROM measures GROUP BY bucket, name
+        UNION ALL
+        SELECT bucket, CASE WHEN ai_probability >= 0.5 THEN 'ai_tag' ELSE 'human_tag' END, tag || ': ' || value,
+               {sign} * COUNT(*)
+        FROM (
+            SELECT bucket, ai_probability, unnest(map_keys(metadata_tags)) AS tag,
+                   unnest(map_values(metadata_tags)) AS value
+            FROM rows WHERE ai_probability IS NOT NULL
+        )
+        GROUP BY ALL
+        UNION ALL
+        SELECT bucket, 'medium', medium, {sign} * COUNT(*) FROM rows
+        WHERE medium IS NOT NULL AND medium <> '' GROUP BY ALL
+        UNION ALL
+        SELECT bucket, 'fractal_bin',
+               CAST(floor((least(greatest(fd_default, 2.0), 2.999) - 2.0) / (1.0 / {FRACTAL_BINS})) AS INTEGER)::VARCHAR,
+               {sign} * COUNT(*)
+        FROM rows WHERE fd_default IS NOT NULL GROUP BY ALL
+        ON CONFLICT (bucket, metric, key) DO UPDATE SET value = value + excluded.value
+    """
+
+def rebuild_stats_rollup(con):
+    """
+    Recomputes stats_rollup from image_stats (a database from before the rollup, or a
+    changed STATS_ROLLUP_BUCKET).
+    """
+    columns = {row[1] for row in con.execute("PRAGMA table_info('image_stats')").fetchall()}
+    if not set(ROLLUP_SOURCE_COLUMNS) <= columns:
+        # Not a table this version of the app wrote
+        return
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute("DELETE FROM stats_rollup")
+        con.execute(rollup_sql("image_stats"))
+        con.execute("DELETE FROM stats_rollup_info")
+        con.execute("INSERT INTO stats_rollup_info VALUES (?)", (STATS_ROLLUP_BUCKET,))
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    stats_changed()
+
+def typed_columns(values):
+    """
+    Typed columns derived from the JSON analysis fields in values: medium and
+    medium_confidence from art_medium_analysis, metadata_tags (tag -> value) from
+    metadata_analysis. Only the columns whose source field is in values.
+    """
+    typed = {}
+    if "art_medium_analysis" in values:
+        art = values["art_medium_analysis"] if isinstance(values["art_medium_analysis"], dict) else {}
+        typed["medium"] = art.get("medium")
+        typed["medium_confidence"] = art.get("confidence")
+    if "metadata_analysis" in values:
+        meta = values["metadata_analysis"] if isinstance(values["metadata_analysis"], dict) else {}
+        tags = meta.get("tags") if isinstance(meta.get("tags"), dict) else {}
+        typed["metadata_tags"] = {"key": [str(k) for k in tags], "value": [str(v) for v in tags.values()]}
+    return typed
+
+def save_stats(filename, url, stats, content_hash=None, step_versions=None, phash=None):
+    image_id, saved = queue_stats(filename, url, stats, content_hash, step_versions, phash)
+    saved.result()
+    return image_id
+
+def queue_stats(filename, url, stats, content_hash=None, step_versions=None, phash=None):
+    """
+    Queues the row of one analysis for the database writer. Returns (image id, future done
+    once the row is committed), for callers that must not block on the write.
+    """
+    import json
+    image_id = str(uuid.uuid4())
+    typed = typed_columns({"art_medium_analysis": stats.get("art_medium_analysis"),
+                           "metadata_analysis": stats.get("metadata_analysis")})
+    # The new row's contribution to the rollup, committed in the same transaction
+    rollup = (rollup_sql("""(
+        SELECT current_timestamp AS upload_time, CAST(? AS INTEGER) AS width, CAST(? AS INTEGER) AS height,
+               CAST(? AS DOUBLE) AS mean_color_r, CAST(? AS DOUBLE) AS mean_color_g, CAST(? AS DOUBLE) AS mean_color_b,
+               CAST(? AS DOUBLE) AS ai_probability, CAST(? AS DOUBLE) AS fd_default, CAST(? AS VARCHAR) AS medium,
+               CAST(? AS MAP(VARCHAR, VARCHAR)) AS metadata_tags
+    )"""), (stats['width'], stats['height'], stats['mean_color'][0], stats['mean_color'][1], stats['mean_color'][2],
+            stats.get('ai_probability'), stats.get('fd_default'), typed["medium"], typed["metadata_tags"]))
+    saved = writer.submit([("""
+            INSERT INTO image_stats (id, filename, upload_time, width, height, mean_color_r, mean_color_g, mean_color_b, url, metadata_analysis, art_medium_analysis, summary, ai_probability, fd_default, object_detection, fd_small, fd_large, content_hash, step_versions, phash, medium, medium_confidence, metadata_tags)
+            VALUES (?, ?, current_timestamp, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (image_id, filename, stats['width'], stats['height'], 
             stats['mean_color'][0], stats['mean_color'][1], stats['mean_color'][2], url,
             json.dumps(stats.get('metadata_analysis')),
@@ -54,98 +455,325 @@ def save_stats(filename, url, stats):
             stats.get('summary'),
             stats.get('ai_probability'),
             stats.get('fd_default'),
-            json.dumps(stats.get('object_detection'))))
-        return image_id
+            json.dumps(stats.get('object_detection')),
+            stats.get('fd_small'),
+            stats.get('fd_large'),
+            content_hash,
+            json.dumps(step_versions or {}),
+            phash,
+            typed["medium"],
+            typed["medium_confidence"],
+            typed["metadata_tags"])), rollup])
+    # Also on failure: a bump is cheaper than working out whether anything was written
+    saved.add_done_callback(stats_changed)
+    return image_id, saved
+
+def get_perceptual_hashes():
+    """
+    Returns (id, phash, content_hash, width, height) for every stored image with a perceptual hash.
+    """
+    with get_db_connection() as con:
+        return con.execute(
+            "SELECT id, phash, content_hash, width, height FROM image_stats WHERE phash IS NOT NULL"
+        ).fetchall()
+
+# Columns stored as JSON text
+JSON_COLUMNS = ("metadata_analysis", "art_medium_analysis", "object_detection", "step_versions")
+# Analysis result columns update_image_stats may write
+UPDATABLE_COLUMNS = JSON_COLUMNS + ("summary", "ai_probability", "fd_default", "fd_small", "fd_large")
 
-def get_aggregate_stats():
+def get_stored_images(limit=0):
+    """
+    Returns the stored analyses that have an upload hash, oldest first, as dicts with the
+    JSON columns decoded.
+    """
+    import json
     with get_db_connection() as con:
+        query = """
+            SELECT id, content_hash, width, height, mean_color_r, mean_color_g, mean_color_b,
+                   metadata_analysis, art_medium_analysis, summary, ai_probability, fd_default,
+                   object_detection, fd_small, fd_large, step_versions
+            FROM image_stats WHERE content_hash IS NOT NULL ORDER BY upload_time
+        """
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        cursor = con.execute(query)
+        names = [column[0] for column in cursor.description]
+        rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+    for row in rows:
+        for column in JSON_COLUMNS:
+            row[column] = json.loads(row[column]) if row[column] else None
+        row["step_versions"] = row["step_versions"] or {}
+    return rows
+
+def update_image_stats(image_id, values):
+    """
+    Overwrites the given analysis columns of one stored image.
+    """
+    import json
+    unknown = set(values) - set(UPDATABLE_COLUMNS)
+    if unknown:
+        raise ValueError(f"Not an updatable column: {', '.join(sorted(unknown))}")
+    if not values:
+        return
+    columns = list(values)
+    params = [json.dumps(values[c]) if c in JSON_COLUMNS else values[c] for c in columns]
+    # Keep the typed copies in step with the JSON they come from
+    typed = typed_columns(values)
+    columns += list(typed)
+    params += list(typed.values())
+    row = f"(SELECT {', '.join(ROLLUP_SOURCE_COLUMNS)} FROM image_stats WHERE id = ?)"
+    with get_db_connection() as con:
+        con.execute("BEGIN TRANSACTION")
         try:
-            # Basic stats
-            basic_stats = con.execute("""
-                SELECT 
-                    COUNT(*) as total_images,
-                    AVG(width) as avg_width,
-                    AVG(height) as avg_height,
-                    AVG(mean_color_r) as avg_r,
-                    AVG(mean_color_g) as avg_g,
-                    AVG(mean_color_b) as avg_b
-                FROM image_stats
-            """).fetchone()
-            
-            if not basic_stats or basic_stats[0] == 0:
-                return {"total_images": 0, "ai_metadata": [], "human_metadata": [], "art_mediums": [], "fractal_dist": []}
-
-            # Helper to get top metadata
-            def get_top_metadata(is_ai=True):
-                condition = "ai_probability >= 0.5" if is_ai else "ai_probability < 0.5"
-                rows = con.execute(f"SELECT metadata_analysis FROM image_stats WHERE {condition}").fetchall()
-                
-                import json
-                from collections import Counter
-                counter = Counter()
-                for row in rows:
-                    if row[0]:
-                        try:
-                            meta = json.loads(row[0])
-                            tags = meta.get('tags', {})
-                            if isinstance(tags, dict):
-                                for k, v in tags.items():
-                                    counter[f"{k}: {v}"] += 1
-                        except Exception:
-                            continue
-                return [{"label": k, "count": v} for k, v in counter.most_common(10)]
-
-            ai_metadata = get_top_metadata(is_ai=True)
-            human_metadata = get_top_metadata(is_ai=False)
-
-            # Art mediums
-            art_rows = con.execute("SELECT art_medium_analysis FROM image_stats").fetchall()
-            import json
-            from collections import Counter
-            art_counter = Counter()
-            for row in art_rows:
-                if row[0]:
-                    try:
-                        art = json.loads(row[0])
-                        medium = art.get('medium')
-                        if medium:
-                            art_counter[medium] += 1
-                    except Exception:
-                        continue
-            art_mediums = [{"label": k, "count": v} for k, v in art_counter.items()]
-
-            # Fractal Distribution (Binned - more granular for density plot)
-            # Fractal dimension typically ranges from 2.0 to 3.0
-            fd_rows = con.execute("SELECT fd_default FROM image_stats WHERE fd_default IS NOT NULL").fetchall()
-            fd_values = [row[0] for row in fd_rows]
-            
-            fractal_dist = []
-            if fd_values:
-                # Create 50 bins from 2.0 to 3.0
-                num_bins = 50
-                step = 1.0 / num_bins
-                bins = [2.0 + i*step for i in range(num_bins + 1)]
-                counts = [0] * num_bins
-                for v in fd_values:
-                    v_clipped = max(2.0, min(2.999, v))
-                    bin_idx = int((v_clipped - 2.0) / step)
-                    if 0 <= bin_idx < num_bins:
-                        counts[bin_idx] += 1
-                
-                for i in range(num_bins):
-                    label = f"{bins[i]:.2f}"
-                    fractal_dist.append({"label": label, "count": counts[i]})
-
-            return {
-                "total_images": basic_stats[0],
-                "avg_width": round(basic_stats[1], 2) if basic_stats[1] else 0,
-                "avg_height": round(basic_stats[2], 2) if basic_stats[2] else 0,
-                "avg_color": [round(x, 2) if x else 0 for x in basic_stats[3:6]],
-                "ai_metadata": ai_metadata,
-                "human_metadata": human_metadata,
-                "art_mediums": art_mediums,
-                "fractal_dist": fractal_dist
-            }
+            # Swap the row's contribution to the rollup along with its values
+            con.execute(rollup_sql(row, -1), (image_id,))
+            con.execute(
+                f"UPDATE image_stats SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+                params + [image_id])
+            con.execute(rollup_sql(row), (image_id,))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+    stats_changed()
+
+def get_step_result(content_hash, step, step_version):
+    """
+    Returns the cached output of one analysis step for this upload hash and step version, or None.
+    """
+    import json
+    queued = queued_entry(("step_cache", content_hash, step, step_version))
+    if queued is not None:
+        return queued
+    with get_db_connection() as con:
+        row = con.execute(
+            "SELECT result FROM step_cache WHERE content_hash = ? AND step = ? AND step_version = ?",
+            (content_hash, step, step_version)).fetchone()
+        return json.loads(row[0]) if row else None
+
+def put_step_result(content_hash, step, step_version, result, wait=True):
+    """
+    Caches one step's output; entries of older versions of that step for the upload are dropped.
+    With wait=False the write is left to the database writer (it is only a cache).
+    """
+    import json
+    payload = json.dumps(result)
+    saved = queue_entry(("step_cache", content_hash, step, step_version), result, [
+        ("DELETE FROM step_cache WHERE content_hash = ? AND step = ? AND step_version <> ?",
+         (content_hash, step, step_version)),
+        ("""
+            INSERT OR REPLACE INTO step_cache (content_hash, step, step_version, result, created_at)
+            VALUES (?, ?, ?, ?, current_timestamp)
+        """, (content_hash, step, step_version, payload)),
+    ])
+    if wait:
+        saved.result()
+
+def get_cached_result(content_hash, analyzer_version, ttl_seconds=0):
+    """
+    Returns the cached result dict for this upload hash and analyzer version, or None.
+    Entries older than ttl_seconds (0 = no expiry) count as missing.
+    """
+    import json
+    queued = queued_entry(("result_cache", content_hash, analyzer_version))
+    if queued is not None:
+        return queued
+    with get_db_connection() as con:
+        query = "SELECT result FROM result_cache WHERE content_hash = ? AND analyzer_version = ?"
+        params = [content_hash, analyzer_version]
+        if ttl_seconds:
+            query += " AND created_at > current_timestamp - to_seconds(?)"
+            params.append(ttl_seconds)
+        row = con.execute(query, params).fetchone()
+        if not row:
+            return None
+        con.execute("""
+            UPDATE result_cache SET hits = hits + 1, last_hit = current_timestamp
+            WHERE content_hash = ? AND analyzer_version = ?
+        """, (content_hash, analyzer_version))
+        return json.loads(row[0])
+
+def put_cached_result(content_hash, analyzer_version, result, wait=True):
+    import json
+    payload = json.dumps(result)
+    saved = queue_entry(("result_cache", content_hash, analyzer_version), result, [("""
+            INSERT OR REPLACE INTO result_cache (content_hash, analyzer_version, result, size_bytes, created_at, last_hit, hits)
+            VALUES (?, ?, ?, ?, current_timestamp, NULL, 0)
+        """, (content_hash, analyzer_version, payload, len(payload)))])
+    if wait:
+        saved.result()
+
+def evict_cached_results(ttl_seconds=0, max_entries=0):
+    """
+    Drops entries older than ttl_seconds, then the least recently used ones beyond max_entries
+    (0 disables either rule). Returns the number of entries removed.
+    """
+    removed = 0
+    with get_db_connection() as con:
+        if ttl_seconds:
+            removed += con.execute(
+                "DELETE FROM result_cache WHERE created_at <= current_timestamp - to_seconds(?)", [ttl_seconds]
+            ).fetchone()[0]
+        if max_entries:
+            removed += con.execute("""
+                DELETE FROM result_cache WHERE rowid IN (
+                    SELECT rowid FROM result_cache ORDER BY coalesce(last_hit, created_at) DESC OFFSET ?
+                )
+            """, [max_entries]).fetchone()[0]
+    return removed
+
+def get_result_cache_size():
+    with get_db_connection() as con:
+        entries, size_bytes = con.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM result_cache").fetchone()
+        return {"entries": entries, "size_bytes": int(size_bytes)}
+
+def spill_tasks(entries):
+    """
+    Stores evicted task states ({task_id: state dict}), replacing earlier copies.
+    """
+    import json
+    if not entries:
+        return
+    rows = [(task_id, state.get("status"), json.dumps(state, default=str)) for task_id, state in entries.items()]
+    with get_db_connection() as con:
+        con.executemany("""
+            INSERT OR REPLACE INTO task_spill (task_id, status, state, spilled_at)
+            VALUES (?, ?, ?, current_timestamp)
+        """, rows)
+
+def get_spilled_task(task_id):
+    """
+    Returns the state dict of an evicted task, or None.
+    """
+    import json
+    with get_db_connection() as con:
+        row = con.execute("SELECT state FROM task_spill WHERE task_id = ?", (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+def evict_spilled_tasks(ttl_seconds):
+    """
+    Drops spilled tasks older than ttl_seconds (0 keeps them). Returns the number removed.
+    """
+    if not ttl_seconds:
+        return 0
+    with get_db_connection() as con:
+        return con.execute(
+            "DELETE FROM task_spill WHERE spilled_at <= current_timestamp - to_seconds(?)", [ttl_seconds]
+        ).fetchone()[0]
+
+def count_spilled_tasks():
+    with get_db_connection() as con:
+        return con.execute("SELECT COUNT(*) FROM task_spill").fetchone()[0]
+
+# Columns GET /history may return; the JSON ones are large, so list views leave them out
+HISTORY_COLUMNS = ("id", "filename", "upload_time", "url", "width", "height", "mean_color_r", "mean_color_g",
+                   "mean_color_b", "summary", "ai_probability", "fd_default", "fd_small", "fd_large", "medium",
+                   "medium_confidence", "metadata_tags", "content_hash") + JSON_COLUMNS
+HISTORY_DEFAULT_COLUMNS = ("id", "filename", "upload_time", "url", "width", "height", "summary",
+                           "ai_probability", "fd_default", "medium", "medium_confidence")
+
+def get_history(limit, after=None, min_ai_probability=None, max_ai_probability=None, medium=None,
+                filename_prefix=None, columns=HISTORY_DEFAULT_COLUMNS):
+    """
+    Stored analyses, newest first by (upload_time, id), as dicts of the given columns (plus
+    id and upload_time) with the JSON columns decoded. after is the (upload_time, id) of the
+    last row of the previous page.
+
+    The bound on upload_time is a plain range filter, so DuckDB skips the row groups outside
+    it by their min/max (rows are appended in upload order) and keeps only the top limit
+    rows while scanning; a page costs about the same at any depth.
+    """
+    import json
+    unknown = set(columns) - set(HISTORY_COLUMNS)
+    if unknown:
+        raise ValueError(f"Not a history column: {', '.join(sorted(unknown))}")
+    columns = ["id", "upload_time"] + [c for c in HISTORY_COLUMNS if c in columns and c not in ("id", "upload_time")]
+    conditions, params = ["upload_time IS NOT NULL"], []
+    if after is not None:
+        # Same as (upload_time, id) < after, spelled so the scan can use the upload_time bound
+        conditions.append("upload_time <= ? AND (upload_time < ? OR id < ?)")
+        params += [after[0], after[0], after[1]]
+    if min_ai_probability is not None:
+        conditions.append("ai_probability >= ?")
+        params.append(min_ai_probability)
+    if max_ai_probability is not None:
+        conditions.append("ai_probability <= ?")
+        params.append(max_ai_probability)
+    if medium is not None:
+        conditions.append("medium = ?")
+        params.append(medium)
+    if filename_prefix:
+        conditions.append("starts_with(filename, ?)")
+        params.append(filename_prefix)
+    # Rows still queued for the writer belong on the first page
+    writer.flush()
+    with get_db_connection() as con:
+        cursor = con.execute(f"""
+            SELECT {', '.join(columns)} FROM image_stats WHERE {' AND '.join(conditions)}
+            ORDER BY upload_time DESC, id DESC LIMIT {int(limit)}
+        """, params)
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    for row in rows:
+        for column in JSON_COLUMNS:
+            if column in row:
+                row[column] = json.loads(row[column]) if row[column] else None
+    return rows
+
+EMPTY_STATS = {"total_images": 0, "ai_metadata": [], "human_metadata": [], "art_mediums": [], "fractal_dist": []}
+
+def get_aggregate_stats(start=None, end=None):
+    """
+    The /stats aggregates, summed from stats_rollup over the buckets that start in
+    [start rounded down to its bucket, end) (either bound optional), so the cost depends on
+    the number of buckets and distinct tags, not on the number of images.
+    """
+    conditions, params = [], []
+    if start is not None:
+        conditions.append(f"bucket >= date_trunc('{STATS_ROLLUP_BUCKET}', CAST(? AS TIMESTAMP))")
+        params.append(start)
+    if end is not None:
+        conditions.append("bucket < CAST(? AS TIMESTAMP)")
+        params.append(end)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with get_db_connection() as con:
+        try:
+            rows = con.execute(f"""
+                SELECT metric, key, SUM(value) FROM stats_rollup {where}
+                GROUP BY metric, key HAVING SUM(value) <> 0
+            """, params).fetchall()
         except Exception as e:
             print(f"Error in get_aggregate_stats: {e}")
-            return {"total_images": 0, "ai_metadata": [], "human_metadata": [], "art_mediums": [], "fractal_dist": []}
+            return dict(EMPTY_STATS)
+    totals = {}
+    for metric, key, value in rows:
+        totals.setdefault(metric, {})[key] = value
+    total_images = int(totals.get("images", {}).get("", 0))
+    if not total_images:
+        return dict(EMPTY_STATS)
+
+    def average(column):
+        count = totals.get("count", {}).get(column)
+        # A zero sum has no row left
+        return round(totals.get("sum", {}).get(column, 0) / count, 2) if count else 0
+
+    def counted(metric, limit=None):
+        # Most common first, ties by label
+        ranked = sorted(totals.get(metric, {}).items(), key=lambda item: (-item[1], item[0]))
+        return [{"label": label, "count": int(count)} for label, count in ranked[:limit]]
+
+    fractal_dist = []
+    bins = {int(key): int(count) for key, count in totals.get("fractal_bin", {}).items()}
+    if bins:
+        step = 1.0 / FRACTAL_BINS
+        fractal_dist = [{"label": f"{2.0 + i * step:.2f}", "count": bins.get(i, 0)} for i in range(FRACTAL_BINS)]
+    return {
+        "total_images": total_images,
+        "avg_width": average("width"),
+        "avg_height": average("height"),
+        "avg_color": [average(column) for column in AVERAGED_COLUMNS[2:]],
+        "ai_metadata": counted("ai_tag", 10),
+        "human_metadata": counted("human_tag", 10),
+        "art_mediums": counted("medium"),
+        "fractal_dist": fractal_dist
+    }
@@ -0,0 +1,179 @@
+"""
+Durable queue of analysis jobs, shared by the web app and the worker processes (app.worker).
+
+Jobs live in a SQLite file (JOB_QUEUE_PATH) in WAL mode, so any number of processes on the
+machine can enqueue, claim and update them. A claimed job is leased to one worker, which
+renews the lease with heartbeats that also carry the job's latest TaskStatus. A job whose
+lease runs out (its worker crashed or hung) goes back to the queue, up to max_attempts claims.
+
+Statuses: queued -> running -> done | failed | cancelled.
+"""
+import contextlib
+import json
+import sqlite3
+import time
+import uuid
+
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+class JobQueue:
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._connect() as con:
+            # WAL lets readers (progress polls) run while a worker writes
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    filename TEXT,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    state TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            con.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Autocommit, with explicit BEGIN IMMEDIATE where a read decides a write; the timeout
+        # waits out other processes' write locks
+        con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield con
+        finally:
+            con.close()
+
+    def enqueue(self, content_hash: str, filename: str, job_id: str | None = None) -> str:
+        """
+        Queues an analysis of the upload stored in the blob store under content_hash and
+        returns the job id (a new one unless given).
+        """
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        with self._connect() as con:
+            con.execute("""
+                INSERT INTO jobs (id, content_hash, filename, status, created_at, updated_at)
+                VALUES (?, ?, ?, 'queued', ?, ?)
+            """, (job_id, content_hash, filename, now, now))
+        return job_id
+
+    def claim(self, worker_id: str, lease_seconds: float):
+        """
+        Leases the oldest waiting job (queued, or running with an expired lease) to worker_id.
+        Returns {"id", "content_hash", "filename", "attempts"}, or None if there is none.
+        """
+        now = time.time()
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                # Cancelled before a worker got to them, or while their worker was gone
+                con.execute("""
+                    UPDATE jobs SET status = 'cancelled', lease_owner = NULL, updated_at = ?
+                    WHERE cancel_requested = 1 AND (status = 'queued' OR (status = 'running' AND lease_expires < ?))
+                """, (now, now))
+                # Claimed too often without finishing: the job itself is what kills its workers
+                con.execute("""
+                    UPDATE jobs SET status = 'failed', lease_owner = NULL, updated_at = ?,
+                        state = json_set(coalesce(state, '{}'), '$.status', 'Error', '$.error',
+                                         'Analysis did not finish after ' || attempts || ' attempts.')
+                    WHERE status = 'running' AND lease_expires < ? AND attempts >= ?
+                """, (now, now, self.max_attempts))
+                row = con.execute("""
+                    SELECT id, content_hash, filename, attempts FROM jobs
+                    WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?)
+                    ORDER BY created_at LIMIT 1
+                """, (now,)).fetchone()
+                if row is not None:
+                    con.execute("""
+                        UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?,
+                            attempts = attempts + 1, updated_at = ?
+                        WHERE id = ?
+                    """, (worker_id, now + lease_seconds, now, row[0]))
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {"id": row[0], "content_hash": row[1], "filename": row[2], "attempts": row[3] + 1}
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float, state: dict | None = None) -> bool:
+        """
+        Renews worker_id's lease on the job and records its progress. Returns False if the
+        worker should stop: the lease was lost (taken over after expiring) or the job was cancelled.
+        """
+        now = time.time()
+        payload = json.dumps(state, default=str) if state is not None else None
+        with self._connect() as con:
+            updated = con.execute("""
+                UPDATE jobs SET lease_expires = ?, state = coalesce(?, state), updated_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'running'
+            """, (now + lease_seconds, payload, now, job_id, worker_id)).rowcount
+            if not updated:
+                return False
+            cancelled = con.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        return not cancelled
+
+    def finish(self, job_id: str, worker_id: str, status: str, state: dict) -> bool:
+        """
+        Records the job's outcome (done, failed or cancelled) and final TaskStatus. Returns False
+        if worker_id no longer held the job.
+        """
+        if status not in FINISHED_STATUSES:
+            raise ValueError(f"Not a finished status: {status}")
+        now = time.time()
+        with self._connect() as con:
+            return con.execute("""
+                UPDATE jobs SET status = ?, state = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'running'
+            """, (status, json.dumps(state, default=str), now, job_id, worker_id)).rowcount > 0
+
+    def cancel(self, job_id: str):
+        """
+        Cancels a job: at once if it is still queued, else at its worker's next heartbeat.
+        """
+        now = time.time()
+        with self._connect() as con:
+            con.execute("""
+                UPDATE jobs SET cancel_requested = 1, updated_at = ?,
+                    status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END
+                WHERE id = ?
+            """, (now, job_id))
+
+    def get(self, job_id: str):
+        """
+        Returns {"status", "attempts", "state"} for a job (state: its latest TaskStatus or
+        None), or None if there is no such job.
+        """
+        with self._connect() as con:
+            row = con.execute("SELECT status, attempts, state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {"status": row[0], "attempts": row[1], "state": json.loads(row[2]) if row[2] else None}
+
+    def stats(self) -> dict:
+        """
+        Job counts by status, plus the age in seconds of the oldest queued job.
+        """
+        with self._connect() as con:
+            counts = dict(con.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = con.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        return {**{status: counts.get(status, 0) for status in ("queued", "running") + FINISHED_STATUSES},
+                "oldest_queued_seconds": round(time.time() - oldest, 3) if oldest is not None else None}
+
+    def purge(self, older_than_seconds: float) -> int:
+        """
+        Deletes finished jobs last updated more than older_than_seconds ago.
+        """
+        cutoff = time.time() - older_than_seconds
+        with self._connect() as con:
+            return con.execute(
+                f"DELETE FROM jobs WHERE status IN {FINISHED_STATUSES} AND updated_at < ?", (cutoff,)
+            ).rowcount
@@ -1,23 +1,51 @@
-from fastapi import FastAPI, Request, Response, UploadFile, File, HTTPException
+from fastapi import FastAPI, Request, Response, UploadFile, File, HTTPException, Query
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
 import uvicorn
-from app.database import init_db, save_stats, get_aggregate_stats
+from app.database import (
+    init_db, close_db, writer as db_writer, queue_stats, get_aggregate_stats, stats_version, get_history,
+    HISTORY_DEFAULT_COLUMNS,
+    get_cached_result, put_cached_result, evict_cached_results, get_result_cache_size,
+    get_step_result, put_step_result, get_perceptual_hashes, evict_spilled_tasks, count_spilled_tasks
+)
 from app.analysis import (
     prepare_image, detect_ai, 
-    compute_fractal_stats, extract_metadata, analyze_art_medium,
-    detect_objects
+    compute_fractal_stats, extract_metadata_from_bytes,
+    analyze_art_medium, detect_objects, ImagePyramid, analyzer_version, step_version, STEP_VERSIONS,
+    step_failed, perceptual_hash, HammingIndex
 )
+from app.blobstore import content_hash as hash_content, put_blob
+from app.analysis.analysis import FRACTAL_SIZE
 from app.analysis.summarizer import generate_summary, warmup_summarizer
 from app.analysis.histogram import compute_histogram
 import os
+import json
+import base64
+import hashlib
+from datetime import datetime
+from typing import Annotated
+import time
+import threading
 import uuid
 import asyncio
+import functools
+import numpy as np
 from concurrent.futures import ThreadPoolExecutor
-from app.models import UploadResponse, TaskStatus, AggregateStats
+from app.offload import create_cpu_pool, run_in_cpu_pool, await_job, job_stats
+from app.analysis.cancellation import CancellationToken, accepts_cancel_token
+from app.analysis.batching import batching_stats
+from app.analysis.registry import model_registry
+from app.models import UploadResponse, TaskStatus, AggregateStats, ProgressEvents, HistoryPage
+from app.progress import ProgressStream, TERMINAL_STATUSES, change_event, notify as wake_waiters, forget
+from app.taskstore import TaskStore
+from app.taskstate import create_task_state
+from app.admission import AdmissionControl
+from app.jobqueue import JobQueue, FINISHED_STATUSES as FINISHED_JOB_STATUSES
 from app.analysis.aiclassifiers import warmup_classifier
 from app.analysis.object_detection import warmup_object_detector
+from app.analysis.artmedium.classifiers import warmup_clip, warmup_dinov2
 
 app = FastAPI()
 
@@ -32,26 +60,165 @@ templates = Jinja2Templates(directory="app/templates")
 
 
 executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+# Separate process pool for the GIL-bound NumPy/pure-Python kernels, so they don't stall
+# the model threads. CPU_POOL_WORKERS=0 runs everything on the thread pool instead.
+CPU_POOL_WORKERS = int(os.environ.get("CPU_POOL_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# Created on startup rather than at import: worker processes may re-import this module
+cpu_executor = None
 models_ready = False
+# Model name (as registered in model_registry) -> asyncio.Task warming it up
+model_warmups = {}
+# Model name -> {"state", "warmup_seconds", "error"} for /ready_models
+warmup_status = {}
+
+def model_warmup_functions():
+    # Looked up at call time so the warmups can be patched out
+    return {
+        "ai_classifier": warmup_classifier,
+        "summarizer": warmup_summarizer,
+        "object_detector": warmup_object_detector,
+        "clip": warmup_clip,
+        "dinov2": warmup_dinov2,
+    }
+
+async def warmup_model(name: str, func, pool: ThreadPoolExecutor):
+    """
+    Loads one model and runs a dummy inference through it on the given pool.
+    """
+    loop = asyncio.get_running_loop()
+    warmup_status[name] = {"state": "warming", "warmup_seconds": None, "error": None}
+    started = time.perf_counter()
+    try:
+        await loop.run_in_executor(pool, func)
+    except Exception as e:  # noqa: BLE001 - any load error is reported as the model's state
+        uvicorn.config.logger.error(f"Warming up {name} failed: {e}")
+        warmup_status[name].update(state="failed", error=str(e))
+        return False
+    warmup_status[name].update(state="ready", warmup_seconds=time.perf_counter() - started)
+    return True
 
 async def warmup_models():
     global models_ready
-    loop = asyncio.get_event_loop()
-    # Use the executor to avoid blocking the event loop during heavy model loads
-    await loop.run_in_executor(executor, warmup_classifier)
-    await loop.run_in_executor(executor, warmup_summarizer)
-    await loop.run_in_executor(executor, warmup_object_detector)
+    functions = model_warmup_functions()
+    # One thread per model so all of them load concurrently without tying up the request
+    # executor; the registry's per-model locks keep each model to one load
+    with ThreadPoolExecutor(max_workers=len(functions), thread_name_prefix="warmup") as pool:
+        for name, func in functions.items():
+            model_warmups[name] = asyncio.create_task(warmup_model(name, func, pool))
+        warmed = await asyncio.gather(*model_warmups.values())
+    if not all(warmed):
+        # /ready_models reports "failed" with the errors per model
+        failed = [name for name, ok in zip(model_warmups, warmed) if not ok]
+        uvicorn.config.logger.error(f"Model warmup failed for: {', '.join(failed)}")
+        return
     models_ready = True
     uvicorn.config.logger.info("Deep learning models warmed up successfully.")
 
+# With a job queue file, uploads are analyzed by the worker processes of `python -m app.worker`
+# (same JOB_QUEUE_PATH) and this process only enqueues them and relays their progress
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", "")
+JOB_POLL_SECONDS = 0.25
+job_queue = None
+
+def start_analysis_runtime():
+    """
+    Starts what running analyses in this process needs: the CPU pool, model warmup and the
+    near-duplicate index. Called by the app on startup, or by each worker process in queue mode.
+    """
+    global cpu_executor
+    if cpu_executor is None:
+        cpu_executor = create_cpu_pool(CPU_POOL_WORKERS)
+    # Start warmup in background
+    asyncio.create_task(warmup_models())
+    if NEAR_DUPLICATE_DISTANCE:
+        # Load the perceptual hash index now rather than on the first upload
+        asyncio.get_running_loop().run_in_executor(executor, get_near_duplicate_index)
+
 @app.on_event("startup")
 async def on_startup():
+    global job_queue, models_ready
     init_db()
-    # Start warmup in background
-    asyncio.create_task(warmup_models())
+    if JOB_QUEUE_PATH:
+        job_queue = JobQueue(JOB_QUEUE_PATH)
+        # The models are loaded by the worker processes
+        models_ready = True
+    else:
+        start_analysis_runtime()
+    asyncio.create_task(sweep_tasks_periodically())
+    if tasks.backend.shared:
+        asyncio.create_task(watch_session_cancellations())
 
-tasks = {}
+@app.on_event("shutdown")
+async def on_shutdown():
+    global cpu_executor
+    if cpu_executor is not None:
+        cpu_executor.shutdown(wait=False, cancel_futures=True)
+        cpu_executor = None
+    close_db()
+
+# Task states live in memory while running and for TASK_TTL_SECONDS after finishing (or less
+# while over the entry/byte budget); then they move to DuckDB, kept for TASK_SPILL_TTL_SECONDS.
+# 0 disables a limit.
+TASK_STORE_MAX_ENTRIES = int(os.environ.get("TASK_STORE_MAX_ENTRIES", "1000"))
+TASK_STORE_MAX_BYTES = int(os.environ.get("TASK_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+TASK_TTL_SECONDS = int(os.environ.get("TASK_TTL_SECONDS", "600"))
+TASK_SPILL_TTL_SECONDS = int(os.environ.get("TASK_SPILL_TTL_SECONDS", str(24 * 3600)))
+TASK_SWEEP_SECONDS = 60
+# With TASK_STATE_BACKEND=sqlite the processes of `uvicorn --workers N` share task states and
+# sessions through the TASK_STATE_PATH file, so any of them can answer for any upload
+TASK_STATE_BACKEND = os.environ.get("TASK_STATE_BACKEND", "local")
+TASK_STATE_PATH = os.environ.get("TASK_STATE_PATH", "data/task_state.sqlite")
+# How often a process checks the shared state for changes made by the others
+SHARED_STATE_POLL_SECONDS = 0.25
+tasks = TaskStore(TASK_STORE_MAX_ENTRIES, TASK_STORE_MAX_BYTES, TASK_TTL_SECONDS,
+                  backend=create_task_state(TASK_STATE_BACKEND, TASK_STATE_PATH))
 active_sessions = {} # session_id -> (task_id, asyncio.Task)
+# Finished results are cached by upload hash + analyzer_version(); 0 disables either limit,
+# and RESULT_CACHE_MAX_ENTRIES=0 turns the cache off
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "10000"))
+result_cache_counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+# Each step's output is also cached by upload hash + step_version(step), so after a step's
+# version is bumped only that step (and the steps using its output) runs again
+step_cache_counters = {"hits": 0, "misses": 0, "stores": 0}
+# /stats payloads by window, reused until this process stores an analysis or, for changes made
+# by other processes (job queue workers, other web processes), for at most the TTL
+STATS_CACHE_TTL_SECONDS = float(os.environ.get("STATS_CACHE_TTL_SECONDS", "30"))
+STATS_CACHE_MAX_ENTRIES = 64
+stats_cache = {}  # (from, to) -> (stats_version(), time.monotonic(), payload, ETag)
+stats_cache_counters = {"hits": 0, "misses": 0, "not_modified": 0}
+# GET /stats runs on the threadpool: the cache and its counters are changed under this lock
+stats_cache_lock = threading.Lock()
+# Uploads whose perceptual hash is within this many bits (of 64) of a stored image's are
+# flagged as near duplicates of it (re-encoded, resized or recompressed copies); 0 disables
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get("NEAR_DUPLICATE_DISTANCE", "6"))
+# With NEAR_DUPLICATE_REUSE=1 these steps take the near duplicate's cached output instead of running
+NEAR_DUPLICATE_REUSE = os.environ.get("NEAR_DUPLICATE_REUSE", "0") == "1"
+NEAR_DUPLICATE_STEPS = ("AI Classifier", "Art Medium Analysis", "Object Detection")
+near_duplicate_index = None  # HammingIndex over the stored images, loaded on first use
+near_duplicate_lock = threading.Lock()
+near_duplicate_counters = {"lookups": 0, "hits": 0, "reused_steps": 0}
+
+class Flight:
+    """
+    One running analysis of an upload's bytes, shared by every upload of the same content
+    while it runs. process_image_task writes progress to tasks[state_id]; each upload's own
+    task entry points there ({"shared_state": state_id}) until it is abandoned.
+    """
+
+    def __init__(self, content_hash: str, state_id: str):
+        self.content_hash = content_hash
+        self.state_id = state_id
+        self.job = None  # asyncio.Task running process_image_task
+        self.subscribers = set()  # task ids of the uploads following this analysis
+
+flights = {}  # content hash -> Flight, while its analysis runs
+flight_counters = {"started": 0, "coalesced": 0}
+# At most ANALYSIS_MAX_RUNNING analyses run in this process at once; up to ANALYSIS_MAX_WAITING
+# more wait their turn (status "Queued...") and further uploads get 429. 0 disables a limit.
+ANALYSIS_MAX_RUNNING = int(os.environ.get("ANALYSIS_MAX_RUNNING", str(max(2, (os.cpu_count() or 2) // 2))))
+ANALYSIS_MAX_WAITING = int(os.environ.get("ANALYSIS_MAX_WAITING", "20"))
+admission = AdmissionControl(ANALYSIS_MAX_RUNNING, ANALYSIS_MAX_WAITING)
 STEP_TIMEOUT = 90 # seconds for each individual step
 STEPS = [
     "Preprocessing",
@@ -64,141 +231,353 @@ STEPS = [
     "Saving to Database",
     "Insight Summary"
 ]
+# Where each step runs: "cpu" steps are pure-Python/NumPy kernels and go to cpu_executor
+# (their first argument is passed through shared memory); "model" and "io" steps stay on
+# the thread pool, where torch releases the GIL.
+STEP_TYPES = {
+    "Preprocessing": "io",
+    "Metadata Analysis": "cpu",
+    "Color Intensity Distribution": "cpu",
+    "AI Classifier": "model",
+    "Fractal Dimension": "cpu",
+    "Art Medium Analysis": "model",
+    "Object Detection": "model",
+    "Saving to Database": "io",
+    "Insight Summary": "model"
+}
+
+# Models each step needs; a step waits for their warmup before its STEP_TIMEOUT starts
+STEP_MODELS = {
+    "AI Classifier": ("ai_classifier",),
+    "Art Medium Analysis": ("clip", "dinov2"),
+    "Object Detection": ("object_detector",),
+    "Insight Summary": ("summarizer",),
+}
+
+async def wait_for_models(step: str):
+    """
+    Waits until the models used by step have finished warming up (no-op once they have, or
+    if no warmup was started). Steps whose models are ready go ahead while others still load.
+    """
+    pending = [model_warmups[name] for name in STEP_MODELS.get(step, ())
+               if name in model_warmups and not model_warmups[name].done()]
+    if pending:
+        # asyncio.wait leaves the shared warmup tasks running if this task is cancelled
+        await asyncio.wait(pending)
+
+def lookup_cached_result(content_hash: str):
+    """
+    Returns the stored result for an upload with this hash, or None (also when caching is off).
+    """
+    if not RESULT_CACHE_MAX_ENTRIES:
+        return None
+    try:
+        cached = get_cached_result(content_hash, analyzer_version(), RESULT_CACHE_TTL_SECONDS)
+    except Exception as e:  # noqa: BLE001 - the cache is best effort: a failed lookup is a miss
+        uvicorn.config.logger.error(f"Result cache lookup failed: {e}")
+        cached = None
+    result_cache_counters["hits" if cached is not None else "misses"] += 1
+    return cached
+
+def store_cached_result(content_hash: str, result: dict):
+    if not RESULT_CACHE_MAX_ENTRIES:
+        return
+    try:
+        # Committed by the database writer in the background
+        put_cached_result(content_hash, analyzer_version(), result, wait=False)
+        result_cache_counters["evictions"] += evict_cached_results(RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_ENTRIES)
+    except Exception as e:  # noqa: BLE001 - best effort: the analysis is complete either way
+        uvicorn.config.logger.error(f"Result cache store failed: {e}")
+        return
+    result_cache_counters["stores"] += 1
+
+def lookup_step_result(content_hash: str, step: str):
+    """
+    Returns the cached output of step for this upload at the step's current version, or None.
+    """
+    if not content_hash:
+        return None
+    try:
+        cached = get_step_result(content_hash, step, step_version(step))
+    except Exception as e:  # noqa: BLE001 - the cache is best effort: a failed lookup is a miss
+        uvicorn.config.logger.error(f"Step cache lookup failed: {e}")
+        cached = None
+    step_cache_counters["hits" if cached is not None else "misses"] += 1
+    return cached
+
+def store_step_result(content_hash: str, step: str, result):
+    if not content_hash:
+        return
+    try:
+        put_step_result(content_hash, step, step_version(step), result, wait=False)
+    except Exception as e:  # noqa: BLE001 - best effort: the step's output is used either way
+        uvicorn.config.logger.error(f"Step cache store failed for {step}: {e}")
+        return
+    step_cache_counters["stores"] += 1
+
+def get_near_duplicate_index() -> HammingIndex:
+    global near_duplicate_index
+    with near_duplicate_lock:
+        if near_duplicate_index is None:
+            index = HammingIndex()
+            for image_id, phash, content_hash, width, height in get_perceptual_hashes():
+                index.add(phash, {"id": image_id, "content_hash": content_hash, "width": width, "height": height})
+            near_duplicate_index = index
+        return near_duplicate_index
+
+def find_near_duplicate(phash: int):
+    """
+    Returns the nearest stored image within NEAR_DUPLICATE_DISTANCE bits as
+    {"id", "content_hash", "width", "height", "distance"}, or None. Blocks while the index loads.
+    """
+    if not NEAR_DUPLICATE_DISTANCE or phash is None:
+        return None
+    try:
+        matches = get_near_duplicate_index().search(phash, NEAR_DUPLICATE_DISTANCE)
+    except Exception as e:  # noqa: BLE001 - a failed lookup only means the upload is analyzed in full
+        uvicorn.config.logger.error(f"Near-duplicate lookup failed: {e}")
+        return None
+    near_duplicate_counters["lookups"] += 1
+    if not matches:
+        return None
+    near_duplicate_counters["hits"] += 1
+    distance, _, match = matches[0]
+    return {**match, "distance": distance}
+
+def index_near_duplicate(image_id: str, phash: int, content_hash: str, width: int, height: int):
+    if not NEAR_DUPLICATE_DISTANCE or phash is None:
+        return
+    try:
+        get_near_duplicate_index().add(
+            phash, {"id": image_id, "content_hash": content_hash, "width": width, "height": height})
+    except Exception as e:  # noqa: BLE001 - the image is stored either way; it just won't be matched later
+        uvicorn.config.logger.error(f"Indexing perceptual hash failed: {e}")
 
+def reuse_near_duplicate_step(match: dict, size: tuple, step: str):
+    """
+    The near duplicate's cached output for step (boxes scaled to this upload's size), or None
+    if reuse is off, the step isn't reusable or nothing is cached for it.
+    """
+    if not (NEAR_DUPLICATE_REUSE and match and match.get("content_hash") and step in NEAR_DUPLICATE_STEPS):
+        return None
+    result = lookup_step_result(match["content_hash"], step)
+    if result is None:
+        return None
+    if step == "Object Detection" and match["width"] and match["height"]:
+        sx, sy = size[0] / match["width"], size[1] / match["height"]
+        factors = {"xmin": sx, "xmax": sx, "ymin": sy, "ymax": sy}
+        # Scaled into new dicts: the cached output may be the object the near duplicate's own
+        # result holds (its write still queued)
+        scaled = []
+        for detection in result:
+            box = detection.get("box")
+            if box:
+                box = {key: value * factors[key] if key in factors and value is not None else value
+                       for key, value in box.items()}
+                detection = {**detection, "box": box}
+            scaled.append(detection)
+        result = scaled
+    near_duplicate_counters["reused_steps"] += 1
+    return result
 
-async def process_image_task(task_id: str, session_id: str, content: bytes, filename: str):
+def uses_cpu_pool(step: str) -> bool:
+    return cpu_executor is not None and STEP_TYPES.get(step) == "cpu"
+
+async def run_step(step: str, func, *args):
+    """
+    Runs a blocking analysis call on the pool matching the step's declared type.
+
+    Functions that declare a cancel_token get one; it is cancelled when this coroutine is
+    (step timeout or abandoned session), so the job stops at its next checkpoint instead
+    of holding a worker until it finishes.
+    """
+    cancellable = accepts_cancel_token(func)
+    if uses_cpu_pool(step):
+        return await run_in_cpu_pool(cpu_executor, func, *args, cancellable=cancellable)
+    token = CancellationToken()
+    if cancellable:
+        func = functools.partial(func, cancel_token=token)
+    return await await_job(executor.submit(func, *args), token)
+
+async def run_analysis_step(step: str, content_hash: str, func, *args, fallback=None, failed_steps=None):
+    """
+    Runs one analysis step with its timeout (after its models are warm), or returns its cached
+    output for this upload, or else fallback(step) if that isn't None. Fresh output is cached
+    unless the step failed (it is then added to failed_steps); a timeout propagates and
+    caches nothing.
+    """
+    # Cache lookups are DuckDB reads: keep them off the event loop
+    loop = asyncio.get_running_loop()
+    cached = await loop.run_in_executor(executor, lookup_step_result, content_hash, step)
+    if cached is None and fallback is not None:
+        cached = await loop.run_in_executor(executor, fallback, step)
+    if cached is not None:
+        return cached
+    await wait_for_models(step)
+    result = await asyncio.wait_for(run_step(step, func, *args), timeout=STEP_TIMEOUT)
+    if step_failed(step, result):
+        uvicorn.config.logger.warning(f"{step} failed; its output is not cached")
+        if failed_steps is not None:
+            failed_steps.append(step)
+        return result
+    store_step_result(content_hash, step, result)
+    return result
+
+
+async def process_image_task(task_id: str, content: bytes, filename: str, content_hash: str | None = None):
     logger = uvicorn.config.logger
-    loop = asyncio.get_event_loop()
 
     async def _analyze():
+        nonlocal content
+        # Steps that returned their error placeholder; the result of the analysis is then
+        # not cached, so the next upload of the file runs them again
+        failed_steps = []
+        analysis_step = functools.partial(run_analysis_step, failed_steps=failed_steps)
         try:
             # Phase 1: Sequential Initialization
             tasks[task_id]["status"] = "Preprocessing..."
             tasks[task_id]["current_step"] = "Preprocessing"
             tasks[task_id]["progress"] = 5 
             tasks[task_id]["partial_results"] = {}
+            notify(task_id)
             
             # Step 1: Preprocessing
             try:
                 image, np_image, width, height, mean_color = await asyncio.wait_for(
-                    loop.run_in_executor(executor, prepare_image, content),
+                    run_step("Preprocessing", prepare_image, content),
                     timeout=STEP_TIMEOUT
                 )
-            except asyncio.TimeoutError:
+            except TimeoutError:
                 raise Exception("Preprocessing timed out")
                 
+            # Model steps take their input size from this; levels are built on first request
+            pyramid = ImagePyramid(image, np_image, original_size=(width, height))
+            loop = asyncio.get_running_loop()
+            try:
+                phash = await loop.run_in_executor(executor, perceptual_hash, image)
+            except Exception as e:  # noqa: BLE001 - no hash just turns near-duplicate reuse off for this upload
+                logger.error(f"Perceptual hash failed: {e}")
+                phash = None
+            near_duplicate = await loop.run_in_executor(executor, find_near_duplicate, phash)
+            near_duplicate_info = near_duplicate and {"id": near_duplicate["id"], "distance": near_duplicate["distance"]}
+            tasks[task_id]["partial_results"]["near_duplicate"] = near_duplicate_info
+            reuse = functools.partial(reuse_near_duplicate_step, near_duplicate, (width, height))
             tasks[task_id]["completed_steps"].append("Preprocessing")
             tasks[task_id]["progress"] = 10
 
             # Phase 2: Parallel Analysis Cluster
             tasks[task_id]["status"] = "Performing Parallel Analysis & Upload..."
             tasks[task_id]["current_step"] = "Parallel Analysis & Upload"
+            notify(task_id)
+
+            async def notifying(step):
+                # Progress streams hear about each step as soon as it finishes
+                try:
+                    return await step
+                finally:
+                    notify(task_id)
 
             async def run_histogram():
                 try:
-                    data = await asyncio.wait_for(
-                        loop.run_in_executor(executor, compute_histogram, np_image),
-                        timeout=STEP_TIMEOUT
-                    )
+                    data = await analysis_step(
+                        "Color Intensity Distribution", content_hash, compute_histogram, np_image,
+                        width * height)
                     tasks[task_id]["partial_results"].update(data)
                     tasks[task_id]["completed_steps"].append("Color Intensity Distribution")
                     return data
-                except asyncio.TimeoutError:
+                except TimeoutError:
                     logger.warning(f"Color Intensity Distribution timed out for task {task_id}")
                     tasks[task_id]["timed_out_steps"].append("Color Intensity Distribution")
                     return {"histogram_r": [], "histogram_g": [], "histogram_b": []}
 
             async def run_ai():
                 try:
-                    score = await asyncio.wait_for(
-                        loop.run_in_executor(executor, detect_ai, image),
-                        timeout=STEP_TIMEOUT
-                    )
+                    score = await analysis_step(
+                        "AI Classifier", content_hash, detect_ai, pyramid, fallback=reuse)
                     tasks[task_id]["partial_results"]["ai_probability"] = score
                     tasks[task_id]["completed_steps"].append("AI Classifier")
                     return score
-                except asyncio.TimeoutError:
+                except TimeoutError:
                     logger.warning(f"AI analysis timed out for task {task_id}")
                     tasks[task_id]["timed_out_steps"].append("AI Classifier")
                     return None
 
             async def run_fractal():
+                # Returned when the step fails so the UI doesn't hang and the DB row still saves
+                empty_stats = {"fd_default": None, "fd_small": None, "fd_large": None}
                 try:
                     # Validating fractal time with a timeout (e.g. 5s)
                     # If it hangs, we abandon this specific sub-result but keep the session alive.
-                    f_stats = await asyncio.wait_for(
-                        loop.run_in_executor(executor, compute_fractal_stats, np_image),
-                        timeout=STEP_TIMEOUT
-                    )
+                    fractal_input = await asyncio.get_running_loop().run_in_executor(
+                        executor, pyramid.array, FRACTAL_SIZE)
+                    f_stats = await analysis_step(
+                        "Fractal Dimension", content_hash, compute_fractal_stats, fractal_input)
                     logger.info(f"Fractal dimension computed: {f_stats}")
                     tasks[task_id]["partial_results"].update(f_stats)
                     tasks[task_id]["completed_steps"].append("Fractal Dimension")
                     return f_stats
-                except asyncio.TimeoutError:
+                except TimeoutError:
                     logger.warning(f"Fractal dimension timed out for task {task_id}")
                     # Mark as complete so UI doesn't hang, but return default/empty stats
-                    tasks[task_id]["partial_results"].update({"fd_default": None})
+                    tasks[task_id]["partial_results"].update(empty_stats)
                     tasks[task_id]["completed_steps"].append("Fractal Dimension")
                     tasks[task_id]["timed_out_steps"].append("Fractal Dimension")
-                    return {"fd_default": None} 
-                except Exception as e:
+                    return dict(empty_stats)
+                except Exception as e:  # noqa: BLE001 - the step falls back to empty stats, like a timeout
                     logger.error(f"Fractal dimension failed with error: {e}")
-                    tasks[task_id]["partial_results"].update({"fd_default": None})
+                    tasks[task_id]["partial_results"].update(empty_stats)
                     tasks[task_id]["completed_steps"].append("Fractal Dimension")
                     tasks[task_id]["timed_out_steps"].append("Fractal Dimension")
-                    return {"fd_default": None}
+                    return dict(empty_stats)
 
 
             async def run_metadata():
                 try:
-                    meta_analysis = await asyncio.wait_for(
-                        loop.run_in_executor(executor, extract_metadata, image),
-                        timeout=STEP_TIMEOUT
-                    )
+                    # Read from the upload bytes on either pool (workers get them rather than
+                    # a pickled PIL image), so the output doesn't depend on where it ran
+                    arg = np.frombuffer(content, dtype=np.uint8) if uses_cpu_pool("Metadata Analysis") else content
+                    meta_analysis = await analysis_step(
+                        "Metadata Analysis", content_hash, extract_metadata_from_bytes, arg)
                     tasks[task_id]["partial_results"]["metadata_analysis"] = meta_analysis
                     tasks[task_id]["completed_steps"].append("Metadata Analysis")
                     return meta_analysis
-                except asyncio.TimeoutError:
+                except TimeoutError:
                     logger.warning(f"Metadata analysis timed out for task {task_id}")
                     tasks[task_id]["timed_out_steps"].append("Metadata Analysis")
                     return {"tags": {}, "description": "Analysis timed out.", "is_suspicious": False}
 
             async def run_art_medium():
                 try:
-                    art_results = await asyncio.wait_for(
-                        loop.run_in_executor(executor, analyze_art_medium, image),
-                        timeout=STEP_TIMEOUT
-                    )
+                    art_results = await analysis_step(
+                        "Art Medium Analysis", content_hash, analyze_art_medium, pyramid, fallback=reuse)
                     tasks[task_id]["partial_results"]["art_medium"] = art_results
                     tasks[task_id]["completed_steps"].append("Art Medium Analysis")
                     return art_results
-                except asyncio.TimeoutError:
+                except TimeoutError:
                     logger.warning(f"Art medium analysis timed out for task {task_id}")
                     tasks[task_id]["timed_out_steps"].append("Art Medium Analysis")
                     return None
 
             async def run_object_detection():
                 try:
-                    detection_results = await asyncio.wait_for(
-                        loop.run_in_executor(executor, detect_objects, image),
-                        timeout=STEP_TIMEOUT
-                    )
+                    detection_results = await analysis_step(
+                        "Object Detection", content_hash, detect_objects, pyramid, fallback=reuse)
                     tasks[task_id]["partial_results"]["object_detection"] = detection_results
                     tasks[task_id]["completed_steps"].append("Object Detection")
                     return detection_results
-                except asyncio.TimeoutError:
+                except TimeoutError:
                     logger.warning(f"Object detection timed out for task {task_id}")
                     tasks[task_id]["timed_out_steps"].append("Object Detection")
                     return None
 
             # Execute parallel tasks
             results = await asyncio.gather(
-                run_histogram(),
-                run_ai(),
-                run_fractal(),
-                run_metadata(),
-                run_art_medium(),
-                run_object_detection(),
+                notifying(run_histogram()),
+                notifying(run_ai()),
+                notifying(run_fractal()),
+                notifying(run_metadata()),
+                notifying(run_art_medium()),
+                notifying(run_object_detection()),
                 return_exceptions=True
             )
             
@@ -210,6 +589,12 @@ async def process_image_task(task_id: str, session_id: str, content: bytes, file
                     logger.error(f"DEBUG: Task {i} failed with error: {result}")
                     raise result
 
+            # Last use of the upload bytes: keep them so stored results can be recomputed when
+            # a step changes, and let go of them before the summary runs
+            if content_hash:
+                await loop.run_in_executor(executor, put_blob, content, content_hash)
+            content = None
+
             ai_score = res_ai
             fractal_stats = res_frac
             url = None
@@ -224,7 +609,8 @@ async def process_image_task(task_id: str, session_id: str, content: bytes, file
                 **fractal_stats,
                 "metadata_analysis": metadata_analysis,
                 "art_medium_analysis": art_medium_analysis,
-                "object_detection": res_det
+                "object_detection": res_det,
+                "near_duplicate": near_duplicate_info
             }
             tasks[task_id]["progress"] = 85 # Adjusted from 85 to 90 in the snippet, but 85 is correct here for before summary
 
@@ -232,36 +618,54 @@ async def process_image_task(task_id: str, session_id: str, content: bytes, file
             tasks[task_id]["status"] = "Generating AI Insight..."
             tasks[task_id]["current_step"] = "Insight Summary"
             tasks[task_id]["progress"] = 90 # New progress point
+            notify(task_id)
             
-            # Run summarizer sequentially as it needs all previous results
-            summary = await asyncio.wait_for(
-                loop.run_in_executor(executor, generate_summary, analysis_results),
-                timeout=STEP_TIMEOUT
-            )
+            # Run summarizer sequentially as it needs all previous results. Its cache entry
+            # is only valid if those were complete.
+            summary = await analysis_step(
+                "Insight Summary", None if tasks[task_id]["timed_out_steps"] or failed_steps else content_hash,
+                generate_summary, analysis_results)
             analysis_results["summary"] = summary
             tasks[task_id]["partial_results"]["summary"] = summary
             tasks[task_id]["completed_steps"].append("Insight Summary")
             tasks[task_id]["progress"] = 98 # New progress point
+            notify(task_id)
 
             # Phase 4: Final Sequential Steps (DB Only)
             tasks[task_id]["status"] = "Saving to Database..."
             tasks[task_id]["current_step"] = "Saving to Database"
+            notify(task_id)
             
-            image_id = save_stats(filename, url, analysis_results)
+            # Versions of the steps whose output went into this row, for the backfill
+            step_versions = {step: step_version(step) for step in tasks[task_id]["completed_steps"]
+                             if step in STEP_VERSIONS and step not in tasks[task_id]["timed_out_steps"]
+                             and step not in failed_steps}
+            image_id, saved = queue_stats(filename, url, analysis_results, content_hash, step_versions, phash)
+            # The database writer thread commits it, batched with other analyses' rows
+            await asyncio.wrap_future(saved)
+            await loop.run_in_executor(
+                executor, index_near_duplicate, image_id, phash, content_hash, width, height)
             
 
+            result = {"id": image_id, "url": url, "stats": analysis_results}
+            # Results with timed-out or failed steps are incomplete; let the next upload retry
+            # them. Stored before the task reads Complete, so a re-upload from then on finds it.
+            if content_hash and not tasks[task_id]["timed_out_steps"] and not failed_steps:
+                # Its eviction of old entries is a DuckDB DELETE
+                await loop.run_in_executor(executor, store_cached_result, content_hash, result)
+
             tasks[task_id]["completed_steps"].append("Saving to Database")
             tasks[task_id]["progress"] = 100
             tasks[task_id]["status"] = "Complete"
             tasks[task_id]["current_step"] = None
-            tasks[task_id]["result"] = {"id": image_id, "url": url, "stats": analysis_results}
-            
+            tasks[task_id]["result"] = result
+
         except asyncio.CancelledError:
             logger.info(f"Task {task_id} was abandoned/cancelled")
             tasks[task_id]["status"] = "Abandoned"
             tasks[task_id]["error"] = "Task abandoned because a new upload was started."
             raise
-        except Exception as e:
+        except Exception as e:  # noqa: BLE001 - reported to the client as the task's error
             logger.error(f"Task failed: {e}")
             tasks[task_id]["status"] = "Error"
             tasks[task_id]["error"] = str(e)
@@ -272,14 +676,245 @@ async def process_image_task(task_id: str, session_id: str, content: bytes, file
     except asyncio.CancelledError:
         # Already handled inside _analyze, but ensuring it propagates
         raise
-    except Exception as e:
+    except Exception as e:  # noqa: BLE001 - reported to the client as the task's error
         logger.error(f"Unexpected error in task {task_id}: {e}")
         tasks[task_id]["status"] = "Error"
         tasks[task_id]["error"] = str(e)
     finally:
-        # Cleanup session tracking
-        if active_sessions.get(session_id) and active_sessions[session_id][0] == task_id:
-            active_sessions.pop(session_id, None)
+        # Final status (Complete, Error or Abandoned)
+        notify(task_id)
+        sweep_tasks()
+
+async def admitted_image_task(task_id: str, content: bytes, filename: str, content_hash: str):
+    """
+    Runs process_image_task once admission control lets the analysis start (start_flight
+    took its place); until then its state shows its place in the queue.
+    """
+    try:
+        if task_id in admission.waiting:
+            try:
+                await admission.admit(task_id)
+            except asyncio.CancelledError:
+                uvicorn.config.logger.info(f"Task {task_id} was abandoned while queued")
+                tasks[task_id]["status"] = "Abandoned"
+                tasks[task_id]["error"] = "Task abandoned because a new upload was started."
+                notify(task_id)
+                sweep_tasks()
+                raise
+            tasks[task_id].update(status="Starting...", current_step="Starting...",
+                                  queue_position=None, estimated_wait_seconds=None)
+            notify(task_id)
+        await process_image_task(task_id, content, filename, content_hash)
+    finally:
+        # Only full runs say how long an analysis takes
+        admission.release(task_id, completed=tasks.get(task_id, {}).get("status") == "Complete")
+        update_queue_positions()
+
+def update_queue_positions():
+    """
+    Writes each waiting analysis's place in the queue and estimated wait into its state.
+    """
+    for position, key in enumerate(admission.waiting, 1):
+        if not tasks.holds(key):
+            continue
+        state = tasks[key]
+        wait = admission.estimated_wait(position)
+        if state.get("queue_position") != position or state.get("estimated_wait_seconds") != wait:
+            state["queue_position"] = position
+            state["estimated_wait_seconds"] = wait
+            notify(key)
+
+async def queue_image_task(task_id: str, content: bytes, filename: str, content_hash: str):
+    """
+    Queue mode counterpart of process_image_task: hands the upload to the worker processes and
+    mirrors the job's progress into tasks[task_id] until it is finished. Cancelling this
+    coroutine cancels the job.
+    """
+    logger = uvicorn.config.logger
+    loop = asyncio.get_running_loop()
+    job_id = None
+    try:
+        # Workers read the upload from the blob store
+        if await loop.run_in_executor(executor, put_blob, content, content_hash) is None:
+            raise RuntimeError("The job queue needs the blob store (set BLOB_STORE_DIR)")
+        content = None
+        # Not awaited: a cancellation can't then fall between queueing the job and knowing its id
+        job_id = job_queue.enqueue(content_hash, filename)
+        tasks[task_id]["status"] = "Queued..."
+        tasks[task_id]["current_step"] = "Queued"
+        notify(task_id)
+        state = None
+        while True:
+            job = await loop.run_in_executor(executor, job_queue.get, job_id)
+            if job["state"] is not None and job["state"] != state:
+                state = job["state"]
+                tasks[task_id].update(state)
+                notify(task_id)
+            if job["status"] in FINISHED_JOB_STATUSES:
+                break
+            await asyncio.sleep(JOB_POLL_SECONDS)
+        if job["status"] == "cancelled" and tasks[task_id]["status"] != "Abandoned":
+            tasks[task_id]["status"] = "Abandoned"
+            tasks[task_id]["error"] = "Task abandoned because a new upload was started."
+        elif job["status"] == "failed" and tasks[task_id]["status"] != "Error":
+            tasks[task_id]["status"] = "Error"
+            tasks[task_id]["error"] = tasks[task_id].get("error") or "Analysis failed in the worker."
+    except asyncio.CancelledError:
+        logger.info(f"Task {task_id} was abandoned/cancelled")
+        if job_id is not None:
+            job_queue.cancel(job_id)
+        tasks[task_id]["status"] = "Abandoned"
+        tasks[task_id]["error"] = "Task abandoned because a new upload was started."
+        raise
+    except Exception as e:  # noqa: BLE001 - reported to the client as the task's error
+        logger.error(f"Queued task {task_id} failed: {e}")
+        tasks[task_id]["status"] = "Error"
+        tasks[task_id]["error"] = str(e)
+    finally:
+        notify(task_id)
+        sweep_tasks()
+
+sweep_pass = None  # asyncio.Task of the eviction pass under way
+sweep_again = False
+
+def sweep_tasks():
+    """
+    Starts a pass evicting finished tasks past their TTL or over the task store's budget,
+    along with their progress streams; the spill runs on the executor. Called while a pass
+    runs, it makes that pass go round once more.
+    """
+    global sweep_pass, sweep_again
+    if sweep_pass is not None and not sweep_pass.done():
+        sweep_again = True
+        return
+    sweep_pass = asyncio.get_running_loop().create_task(run_sweeps())
+
+async def run_sweeps():
+    global sweep_again
+    while True:
+        sweep_again = False
+        for task_id in await tasks.evict_async(executor):
+            progress_streams.pop(task_id, None)
+            forget(task_id)
+        if not sweep_again:
+            return
+
+async def sweep_tasks_periodically():
+    # TTL expiry for idle periods (the store is otherwise swept as tasks finish)
+    while True:
+        await asyncio.sleep(TASK_SWEEP_SECONDS)
+        sweep_tasks()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(executor, evict_spilled_tasks, TASK_SPILL_TTL_SECONDS)
+            if job_queue is not None and TASK_SPILL_TTL_SECONDS:
+                # Finished jobs are kept as long as spilled tasks
+                await loop.run_in_executor(executor, job_queue.purge, TASK_SPILL_TTL_SECONDS)
+            # States and sessions left behind by processes that exited
+            await loop.run_in_executor(executor, tasks.backend.purge, TASK_SPILL_TTL_SECONDS)
+        except Exception as e:  # noqa: BLE001 - the sweep must keep running; the next one retries
+            uvicorn.config.logger.error(f"Dropping expired spilled tasks failed: {e}")
+
+async def watch_session_cancellations():
+    """
+    Abandons the uploads of this process whose session started a new upload in another one.
+    """
+    while True:
+        await asyncio.sleep(SHARED_STATE_POLL_SECONDS)
+        running = {task_id: session_id for session_id, (task_id, _) in active_sessions.items()}
+        if not running:
+            continue
+        try:
+            requested = await asyncio.wrap_future(tasks.backend_call("take_cancellations", running))
+        except Exception as e:  # noqa: BLE001 - the watcher must keep running; the next poll retries
+            uvicorn.config.logger.error(f"Reading session cancellations failed: {e}")
+            continue
+        for task_id in requested:
+            session_id = running[task_id]
+            current = active_sessions.get(session_id)
+            if current is not None and current[0] == task_id:
+                del active_sessions[session_id]
+                cancel_upload(session_id, *current)
+
+def notify(key: str):
+    """
+    The task state stored under key changed: wakes its waiters in this process and, with a
+    shared backend, publishes it to the other processes.
+    """
+    if tasks.backend.shared and tasks.holds(key):
+        tasks.publish(key, 0 if "shared_state" in tasks[key] else progress_stream(key).version)
+    wake_waiters(key)
+
+async def follow_flight(flight: Flight):
+    # shield: cancelling one subscriber must not cancel the shared job
+    await asyncio.shield(flight.job)
+
+def leave_flight(task_id: str, session_id: str, flight: Flight, follower: asyncio.Task):
+    """
+    Done callback of an upload's follower task. A cancelled follower (the session started a
+    new upload) detaches only this upload; the analysis itself is cancelled once no other
+    upload is waiting for it. Runs even if the follower was cancelled before it started.
+    """
+    flight.subscribers.discard(task_id)
+    if follower.cancelled():
+        abandon_task(task_id)
+        if not flight.subscribers and not flight.job.done():
+            uvicorn.config.logger.info(f"No uploads left waiting for {flight.state_id}, cancelling it")
+            flight.job.cancel()
+    # Cleanup session tracking
+    if active_sessions.get(session_id) and active_sessions[session_id][0] == task_id:
+        active_sessions.pop(session_id, None)
+
+        def ended(call):
+            if call.exception() is not None:
+                uvicorn.config.logger.error(f"Ending session {session_id} failed: {call.exception()}")
+        tasks.backend_call("end_session", session_id, task_id).add_done_callback(ended)
+
+def abandon_task(task_id: str):
+    """
+    Marks an upload Abandoned. A subscriber stops following the shared state and keeps a
+    copy of the progress it had reached.
+    """
+    entry = tasks.get(task_id)
+    if entry is None:
+        return
+    state_key = entry.get("shared_state", task_id)
+    if "shared_state" in entry:
+        state = tasks.get(entry["shared_state"], {})
+        entry = {**state, "completed_steps": list(state.get("completed_steps", [])),
+                 "timed_out_steps": list(state.get("timed_out_steps", []))}
+        tasks[task_id] = entry
+        if state_key in progress_streams:
+            # Its stream goes on from the versions already sent for the shared state
+            progress_streams[task_id] = progress_streams[state_key].fork()
+    entry["status"] = "Abandoned"
+    entry["error"] = "Task abandoned because a new upload was started."
+    # Wake streams of this upload, whether they wait on the shared state or its own
+    notify(task_id)
+    if state_key != task_id:
+        notify(state_key)
+
+async def load_task(task_id: str):
+    """
+    (state, version) of task_id: from memory (version None), else as published by another
+    process or from the spill, read on the executor (see TaskStore.stored). None if unknown.
+    """
+    entry = tasks.held(task_id)
+    if entry is not None:
+        return entry, None
+    return await asyncio.get_running_loop().run_in_executor(executor, tasks.stored, task_id)
+
+async def load_task_view(task_id: str):
+    """
+    (key, state, version) of the task state an upload shows: its own, or the shared one it
+    follows (key is where that is stored). None if unknown.
+    """
+    key = task_id
+    found = await load_task(task_id)
+    if found is not None and "shared_state" in found[0]:
+        key = found[0]["shared_state"]
+        found = await load_task(key)
+    return None if found is None else (key, *found)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -298,21 +933,99 @@ async def start_upload(request: Request, response: Response, file: UploadFile =
         response.set_cookie("session_id", session_id)
         
     content = await file.read()
+    # Hashing and the cache lookup block, so they run on the executor, before the session
+    # bookkeeping below (which must not be interleaved with another upload's)
+    loop = asyncio.get_running_loop()
+    content_hash = await loop.run_in_executor(executor, hash_content, content)
+    cached = None
+    if live_flight(content_hash) is None:
+        cached = await loop.run_in_executor(executor, lookup_cached_result, content_hash)
 
     # Abandon previous task if exists for this session
     # Doing this AFTER read prevents race conditions where multiple requests
-    # pass the check before either registers the new task.
-    if session_id in active_sessions:
-        old_task_id, old_task = active_sessions[session_id]
-        if not old_task.done():
-            old_task.cancel()
-            uvicorn.config.logger.info(f"Cancelling previous task {old_task_id} for session {session_id}")
-            if old_task_id in tasks:
-                tasks[old_task_id]["status"] = "Abandoned"
-                tasks[old_task_id]["error"] = "Task abandoned because a new upload was started."
-    
+    # pass the check before either registers the new task. The new upload subscribes
+    # first, so re-uploading the file still being analyzed keeps that analysis running.
+    previous = active_sessions.pop(session_id, None)
+    try:
+        upload = register_upload(session_id, content, file.filename, content_hash, cached)
+    except HTTPException:
+        # Turned away: the previous upload carries on
+        if previous is not None:
+            active_sessions.setdefault(session_id, previous)
+            previous = None
+        raise
+    finally:
+        if previous is not None:
+            cancel_upload(session_id, *previous)
+    # The previous upload may be running in another process: ask it to abandon it there. The
+    # backend calls run in order with this process's other session updates.
+    other = await asyncio.wrap_future(tasks.backend_call("swap_session", session_id, upload["task_id"]))
+    if other is not None and not tasks.holds(other):
+        await asyncio.wrap_future(tasks.backend_call("request_cancel", other))
+    return upload
+
+def cancel_upload(session_id: str, task_id: str, follower: asyncio.Task):
+    if not follower.done():
+        follower.cancel()
+        uvicorn.config.logger.info(f"Cancelling previous task {task_id} for session {session_id}")
+        abandon_task(task_id)
+
+def live_flight(content_hash: str):
+    """
+    The analysis of these bytes that uploads can still follow, or None. A flight without
+    subscribers is already being cancelled, and a finished one may not have been removed yet
+    (its done callback is still pending).
+    """
+    flight = flights.get(content_hash)
+    if flight is not None and flight.subscribers and not flight.job.done():
+        return flight
+    return None
+
+def register_upload(session_id: str, content: bytes, filename: str, content_hash: str, cached: dict | None = None) -> dict:
+    """
+    Starts tracking an upload: it follows the running analysis of the same bytes, completes at
+    once from cached (the result cache entry for content_hash, if any), or starts an analysis.
+    """
     task_id = str(uuid.uuid4())
-    tasks[task_id] = {
+    flight = live_flight(content_hash)
+    if flight is not None:
+        # Same bytes already being analyzed for another upload: follow that run
+        flight_counters["coalesced"] += 1
+    else:
+        if cached is not None:
+            # Same file analyzed before by this analyzer version: complete immediately
+            tasks[task_id] = {
+                "status": "Complete",
+                "progress": 100,
+                "steps": STEPS,
+                "current_step": None,
+                "completed_steps": list(STEPS),
+                "timed_out_steps": [],
+                "partial_results": cached["stats"],
+                "result": cached,
+                "cached": True
+            }
+            notify(task_id)
+            sweep_tasks()
+            return {"task_id": task_id}
+        if job_queue is None and admission.full():
+            admission.counters["rejected"] += 1
+            raise HTTPException(status_code=429, detail="Too many analyses waiting, please try again later.",
+                                headers={"Retry-After": str(admission.retry_after())})
+        flight = start_flight(content_hash, content, filename)
+    flight.subscribers.add(task_id)
+    tasks[task_id] = {"shared_state": flight.state_id}
+    notify(task_id)
+    # Use loop.create_task for manual control over cancellation
+    loop = asyncio.get_running_loop()
+    task = loop.create_task(follow_flight(flight))
+    task.add_done_callback(functools.partial(leave_flight, task_id, session_id, flight))
+    active_sessions[session_id] = (task_id, task)
+    
+    return {"task_id": task_id}
+
+def new_task_state() -> dict:
+    return {
         "status": "Starting...",
         "progress": 0,
         "steps": STEPS,
@@ -321,27 +1034,273 @@ async def start_upload(request: Request, response: Response, file: UploadFile =
         "timed_out_steps": [],
         "partial_results": {}
     }
-    
-    # Use loop.create_task for manual control over cancellation
-    loop = asyncio.get_running_loop()
-    task = loop.create_task(process_image_task(task_id, session_id, content, file.filename))
-    active_sessions[session_id] = (task_id, task)
-    
-    return {"task_id": task_id}
+
+def start_flight(content_hash: str, content: bytes, filename: str) -> Flight:
+    flight = Flight(content_hash, str(uuid.uuid4()))
+    tasks[flight.state_id] = new_task_state()
+    if job_queue is None and not admission.enqueue(flight.state_id):
+        tasks[flight.state_id].update(status="Queued...", current_step="Queued")
+        update_queue_positions()
+    notify(flight.state_id)
+    run = queue_image_task if job_queue is not None else admitted_image_task
+    flight.job = asyncio.get_running_loop().create_task(run(flight.state_id, content, filename, content_hash))
+    flights[content_hash] = flight
+    flight_counters["started"] += 1
+
+    def finished(_):
+        if flights.get(content_hash) is flight:
+            flights.pop(content_hash)
+    flight.job.add_done_callback(finished)
+    return flight
 
 @app.get("/progress/{task_id}", response_model=TaskStatus)
 async def get_task_status(task_id: str):
-    if task_id not in tasks:
+    found = await load_task_view(task_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return found[1]
+
+# Longest a long-poll request is held open, and how often an idle SSE stream sends a keep-alive
+LONG_POLL_TIMEOUT = 25.0
+SSE_KEEPALIVE_SECONDS = 15.0
+progress_streams = {}  # task state key -> ProgressStream
+
+def progress_stream(key: str, state: dict | None = None) -> ProgressStream:
+    """
+    The event stream of the task state stored under key (an upload's own, or the shared state
+    it follows), brought up to date with its current status (state, if it isn't held here).
+    """
+    stream = progress_streams.get(key)
+    if stream is None:
+        stream = ProgressStream()
+        # A spilled task is finished; its stream is rebuilt on each request rather than kept
+        if tasks.holds(key):
+            progress_streams[key] = stream
+    stream.sync(state if state is not None else tasks[key])
+    return stream
+
+async def progress_events(task_id: str, since: int):
+    """
+    (version, done, events after version since) for the task now, or None if it is unknown.
+    """
+    found = await load_task_view(task_id)
+    if found is None:
+        return None
+    key, state, version = found
+    if version is not None:
+        # Run by another process: its versions, but only whole snapshots from here
+        events = [{**state, "version": version, "snapshot": True}] if since < version else []
+        return version, state.get("status") in TERMINAL_STATUSES, events
+    stream = progress_stream(key, state)
+    return stream.version, stream.done, stream.since(since)
+
+async def wait_for_progress(task_id: str, since: int, timeout: float):
+    """
+    Returns progress_events(task_id, since), waiting up to timeout seconds for an event
+    unless the task is finished.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        entry = tasks.held(task_id)
+        key = entry.get("shared_state", task_id) if entry is not None else None
+        # Taken before reading the status, so a change in between still wakes us. Changes in
+        # other processes don't, so their tasks are polled (spilled ones are finished).
+        local = key is not None and tasks.holds(key)
+        changed = change_event(key) if local else None
+        current = await progress_events(task_id, since)
+        if current is None:
+            return None
+        _, done, events = current
+        remaining = deadline - loop.time()
+        if done and local:
+            forget(key)
+        if events or done or remaining <= 0:
+            return current
+        if local:
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(min(remaining, SHARED_STATE_POLL_SECONDS))
+
+@app.get("/progress/{task_id}/events", response_model=ProgressEvents)
+async def get_task_events(task_id: str, since: int = 0, timeout: float = LONG_POLL_TIMEOUT):
+    """
+    Long-poll fallback for the progress stream: returns the events after version since as
+    soon as there are any, or an empty list after timeout seconds.
+    """
+    current = await wait_for_progress(task_id, since, max(0.0, min(timeout, LONG_POLL_TIMEOUT)))
+    if current is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    version, done, events = current
+    return {"version": version, "done": done, "events": events}
+
+@app.get("/progress/{task_id}/stream")
+async def stream_task_progress(task_id: str, request: Request, since: int = 0):
+    """
+    Server-Sent Events: one "progress" event per status delta, id = its version. Ends once
+    the task is finished; a reconnecting EventSource resumes after Last-Event-ID.
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    # The first read both finds the task and starts the stream
+    current = await progress_events(task_id, since)
+    if current is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return tasks[task_id]
+
+    async def events():
+        nonlocal current
+        version = since
+        while True:
+            latest, done, batch = current
+            for event in batch:
+                version = event["version"]
+                yield f"id: {version}\nevent: progress\ndata: {json.dumps(jsonable_encoder(event))}\n\n"
+            if done and version >= latest:
+                return
+            current = await wait_for_progress(task_id, version, SSE_KEEPALIVE_SECONDS)
+            if current is None:
+                return
+            if not current[2]:
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def cached_stats(start, end) -> tuple:
+    """
+    (AggregateStats payload, ETag) for the window, from stats_cache while it is current.
+    The ETag hashes the payload, so every process gives the same stats the same ETag.
+    """
+    key = (start, end)
+    version = stats_version()
+    with stats_cache_lock:
+        entry = stats_cache.get(key)
+        if entry is not None and entry[0] == version and time.monotonic() - entry[1] < STATS_CACHE_TTL_SECONDS:
+            stats_cache_counters["hits"] += 1
+            return entry[2], entry[3]
+        stats_cache_counters["misses"] += 1
+    # The query runs outside the lock, so hits for other windows don't wait on it
+    payload = get_aggregate_stats(start, end)
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    etag = f'"{digest[:32]}"'
+    with stats_cache_lock:
+        stats_cache.pop(key, None)
+        while len(stats_cache) >= STATS_CACHE_MAX_ENTRIES:
+            stats_cache.pop(next(iter(stats_cache)))
+        stats_cache[key] = (version, time.monotonic(), payload, etag)
+    return payload, etag
+
+def stats_cache_stats() -> dict:
+    with stats_cache_lock:
+        return {**stats_cache_counters, "entries": len(stats_cache)}
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match: "*" or a list of (possibly weak, W/"...") entity tags
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
 
 @app.get("/stats", response_model=AggregateStats)
-def get_stats():
-    return get_aggregate_stats()
+def get_stats(request: Request, response: Response,
+              start: Annotated[datetime | None, Query(alias="from")] = None,
+              end: Annotated[datetime | None, Query(alias="to")] = None):
+    """
+    Aggregates over all images, or those uploaded in [from, to) (whole rollup buckets: from
+    is rounded down to the start of its hour, or day with STATS_ROLLUP_BUCKET=day).
+    Conditional: a request whose If-None-Match has the current ETag gets 304.
+    """
+    payload, etag = cached_stats(start, end)
+    # Browsers keep the response but check back each time, which costs a 304 while unchanged
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        with stats_cache_lock:
+            stats_cache_counters["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return payload
+
+# Rows per GET /history page
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_MAX = 500
+
+def encode_history_cursor(row: dict) -> str:
+    key = json.dumps([row["upload_time"].isoformat(), row["id"]])
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> tuple:
+    try:
+        upload_time, image_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(upload_time), str(image_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/history", response_model=HistoryPage)
+def get_history_page(cursor: str | None = None, limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_MAX),
+                     min_ai_probability: float | None = None, max_ai_probability: float | None = None,
+                     medium: str | None = None, filename_prefix: str | None = None, fields: str | None = None):
+    """
+    Stored analyses, newest first, a page at a time: pass next_cursor back as cursor for the
+    next page. fields is a comma-separated list of columns (default: the scalar ones).
+    """
+    columns = [f.strip() for f in fields.split(",") if f.strip()] if fields else HISTORY_DEFAULT_COLUMNS
+    after = decode_history_cursor(cursor) if cursor else None
+    try:
+        # One extra row tells whether there is a next page
+        rows = get_history(limit + 1, after, min_ai_probability, max_ai_probability, medium, filename_prefix, columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    items = rows[:limit]
+    return {"items": items, "next_cursor": encode_history_cursor(items[-1]) if len(rows) > limit else None}
 
 @app.get("/ready_models")
 async def check_ready():
-    return {"status": "ready" if models_ready else "loading"}
+    registry_stats = model_registry.stats()["models"]
+    models = {}
+    for name, loaded in registry_stats.items():
+        warmup = warmup_status.get(name, {})
+        state = warmup.get("state", "pending")
+        if loaded["state"] in ("loading", "failed"):
+            state = loaded["state"]
+        elif state == "ready" and loaded["state"] == "unloaded":
+            # Evicted under the memory budget since; reloads on its next request
+            state = "unloaded"
+        models[name] = {
+            "state": state,
+            "load_seconds": loaded["load_seconds"],
+            "warmup_seconds": warmup.get("warmup_seconds"),
+            "error": warmup.get("error") or loaded["error"],
+        }
+    status = "ready" if models_ready else "loading"
+    if not models_ready and model_warmups and all(warmup.done() for warmup in model_warmups.values()):
+        # Warmup is over but not every model made it
+        status = "failed"
+    return {"status": status, "models": models}
+
+@app.get("/metrics")
+async def get_metrics():
+    # The database counts block: they run on the executor, the in-memory ones here
+    loop = asyncio.get_running_loop()
+    cache_size = await loop.run_in_executor(executor, get_result_cache_size)
+    spilled = await loop.run_in_executor(executor, count_spilled_tasks)
+    queued_jobs = await loop.run_in_executor(executor, job_queue.stats) if job_queue is not None else None
+    return {
+        "jobs": job_stats.snapshot(),
+        "batching": batching_stats(),
+        "models": model_registry.stats(),
+        "result_cache": {**result_cache_counters, **cache_size},
+        "flights": {**flight_counters, "in_flight": len(flights)},
+        "admission": admission.stats(),
+        "tasks": {**tasks.footprint(), "spilled": spilled},
+        "job_queue": queued_jobs,
+        "step_cache": step_cache_counters,
+        "stats_cache": stats_cache_stats(),
+        "database_writer": db_writer.stats(),
+        "near_duplicates": {**near_duplicate_counters,
+                            "indexed": len(near_duplicate_index) if near_duplicate_index is not None else None},
+    }
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8080)
@@ -44,6 +44,14 @@ class ObjectDetectionItem(BaseModel):
     box: Box | None = None
 
 
+class NearDuplicate(BaseModel):
+    id: str | None = None
+    distance: int | None = Field(
+        None,
+        description='Hamming distance between the two perceptual hashes (of 64 bits).',
+    )
+
+
 class ImageStats(BaseModel):
     summary: str | None = None
     width: int | None = None
@@ -53,6 +61,13 @@ class ImageStats(BaseModel):
     fd_default: float | None = Field(
         None, description='Fractal dimension calculated over the full box range.'
     )
+    fd_small: float | None = Field(
+        None, description='Fractal dimension over small boxes (fine detail, 2 to M/8).'
+    )
+    fd_large: float | None = Field(
+        None,
+        description='Fractal dimension over large boxes (coarse structure, M/8 to M/2).',
+    )
     metadata_analysis: MetadataAnalysis | None = Field(
         None, description='Results of the image metadata examination.'
     )
@@ -60,6 +75,10 @@ class ImageStats(BaseModel):
         None, description='Results of the DINOv2 and CLIP basis art medium analysis.'
     )
     object_detection: list[ObjectDetectionItem] | None = None
+    near_duplicate: NearDuplicate | None = Field(
+        None,
+        description='Earlier analyzed image this one is a near copy of (re-encoded, resized or recompressed).',
+    )
 
 
 class StatEntry(BaseModel):
@@ -76,11 +95,18 @@ class Result(BaseModel):
 class TaskStatus(BaseModel):
     status: str = Field(
         ...,
-        description='Current status (Starting..., Preprocessing..., Performing Parallel Analysis..., Saving to Database..., Complete, Error, Abandoned)',
+        description='Current status (Queued..., Starting..., Preprocessing..., Performing Parallel Analysis..., Saving to Database..., Complete, Error, Abandoned)',
     )
     progress: int
     steps: list[str]
     current_step: str | None = None
+    queue_position: int | None = Field(
+        None,
+        description='Place in the queue while the analysis waits for a free slot (status Queued...), 1 = next.',
+    )
+    estimated_wait_seconds: float | None = Field(
+        None, description='Estimated seconds until a queued analysis starts.'
+    )
     completed_steps: list[str]
     timed_out_steps: list[str] = Field(
         ..., description='List of steps that timed out during analysis.'
@@ -91,6 +117,36 @@ class TaskStatus(BaseModel):
         None,
         description='Error message if the task failed (e.g., due to analysis error or process timeout).',
     )
+    cached: bool | None = Field(
+        False,
+        description='True if the result was served from the result cache (same file analyzed before).',
+    )
+
+
+class ProgressEvents(BaseModel):
+    version: int = Field(
+        ...,
+        description='Version of the latest event; pass it as `since` on the next request.',
+    )
+    done: bool = Field(
+        ...,
+        description='True once the task is finished and no more events will follow.',
+    )
+    events: list[dict[str, Any]] = Field(
+        ...,
+        description='Deltas of the TaskStatus, oldest first. Each has a `version`; `completed_steps` and `timed_out_steps` hold only new entries, `partial_results` only changed keys, other fields their new value. An event with `snapshot` true is the whole TaskStatus and replaces the client\'s copy.',
+    )
+
+
+class HistoryPage(BaseModel):
+    items: list[dict[str, Any]] = Field(
+        ...,
+        description='Stored analyses, newest first, with the requested fields (always `id` and `upload_time`).',
+    )
+    next_cursor: str | None = Field(
+        None,
+        description='Pass as `cursor` to get the next page; null on the last page.',
+    )
 
 
 class AggregateStats(BaseModel):
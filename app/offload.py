@@ -0,0 +1,194 @@
+"""
+Process-pool offload for GIL-bound analysis kernels (fractal dimension, histograms, metadata).
+
+Arrays are handed to worker processes through multiprocessing.shared_memory; only a small
+(name, shape, dtype) handle is pickled, never the pixel data itself.
+"""
+import asyncio
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from app.analysis.cancellation import AnalysisCancelled, CancellationToken
+
+# Modules imported once in the fork server so every worker starts with them already loaded
+FORKSERVER_PRELOAD = ["app.analysis"]
+
+class JobStats:
+    """
+    Counts pool jobs whose caller stopped waiting (step timeout or abandoned session) and
+    what became of them: reclaimed (never started, or stopped at a cancellation checkpoint)
+    or orphaned (ran to completion anyway, holding a worker for nothing).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.submitted = 0
+            self.abandoned = 0
+            self.reclaimed = 0
+            self.orphaned = 0
+
+    def record_submitted(self):
+        with self._lock:
+            self.submitted += 1
+
+    def record_abandoned(self, cfut):
+        with self._lock:
+            self.abandoned += 1
+        if cfut.cancel():
+            # Still queued: it will never run
+            self._record_outcome(reclaimed=True)
+        else:
+            cfut.add_done_callback(self._on_abandoned_done)
+
+    def _on_abandoned_done(self, cfut):
+        reclaimed = cfut.cancelled() or isinstance(cfut.exception(), AnalysisCancelled)
+        self._record_outcome(reclaimed)
+
+    def _record_outcome(self, reclaimed: bool):
+        with self._lock:
+            if reclaimed:
+                self.reclaimed += 1
+            else:
+                self.orphaned += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "abandoned": self.abandoned,
+                "reclaimed": self.reclaimed,
+                "orphaned": self.orphaned,
+                # Abandoned jobs still occupying a worker
+                "running_abandoned": self.abandoned - self.reclaimed - self.orphaned,
+            }
+
+job_stats = JobStats()
+
+async def await_job(cfut, cancel_token: CancellationToken = None):
+    """
+    Awaits a pool future. If the awaiting task is cancelled (which is also how asyncio.wait_for
+    times out), the job's token is cancelled so it can stop at its next checkpoint.
+    """
+    job_stats.record_submitted()
+    try:
+        return await asyncio.wrap_future(cfut)
+    except asyncio.CancelledError:
+        if cancel_token is not None:
+            cancel_token.cancel()
+        job_stats.record_abandoned(cfut)
+        raise
+
+def create_cpu_pool(max_workers: int):
+    """
+    Creates the process pool for CPU kernels, or returns None when max_workers is 0 (disabled).
+
+    Workers come from a fork server where available: forking the uvicorn process directly
+    would copy the torch/OpenCV thread pools into the child in an undefined state.
+    """
+    if max_workers <= 0:
+        return None
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(FORKSERVER_PRELOAD)
+    else:
+        ctx = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx)
+
+def share_array(array: np.ndarray):
+    """
+    Copies an array into a new shared memory block.
+
+    Returns:
+        tuple: (SharedMemory, handle). The caller owns the block and must close() and unlink() it;
+               the handle is what gets sent to the worker.
+    """
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+def attach_array(handle):
+    """
+    Maps a shared array created by share_array() without copying it.
+
+    Returns:
+        tuple: (SharedMemory, np.ndarray). close() the block once the array is no longer used.
+    """
+    name, shape, dtype = handle
+    # The creating process owns the block's lifetime; keep the worker's resource
+    # tracker out of it where Python allows (3.13+).
+    kwargs = {"track": False} if sys.version_info >= (3, 13) else {}
+    shm = shared_memory.SharedMemory(name=name, **kwargs)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+def _call_attached(func, handle, args, cancel_flag, blocks):
+    try:
+        shm, array = attach_array(handle)
+        blocks.append(shm)
+        kwargs = {}
+        if cancel_flag is not None:
+            flag_shm, flag = attach_array(cancel_flag)
+            blocks.append(flag_shm)
+            kwargs["cancel_token"] = CancellationToken(flag=flag)
+    except FileNotFoundError:
+        # The parent released the blocks before this job got a worker: it was abandoned
+        raise AnalysisCancelled()
+    return func(array, *args, **kwargs)
+
+def run_on_shared_array(func, handle, *args, cancel_flag=None):
+    """
+    Worker-side entry point: calls func(array, *args) on the shared array and detaches.
+
+    With a cancel_flag handle, func also gets a cancel_token backed by that shared byte.
+    func must return plain data, not views into the array.
+    """
+    blocks = []
+    try:
+        result = _call_attached(func, handle, args, cancel_flag, blocks)
+    except BaseException as exc:
+        # The traceback's frames still reference the shared buffers; drop them so the
+        # blocks can be closed before the exception goes back to the parent
+        exc.with_traceback(None)
+        for block in blocks:
+            block.close()
+        raise
+    for block in blocks:
+        block.close()
+    return result
+
+async def run_in_cpu_pool(pool: ProcessPoolExecutor, func, array: np.ndarray, *args, cancellable: bool = False):
+    """
+    Runs func(array, *args) in the process pool, passing the array through shared memory.
+
+    func must be a module-level function so the worker can import it. With cancellable=True it
+    is also passed a cancel_token, set through a shared byte when the awaiting task is
+    cancelled. The shared blocks are released as soon as the call finishes or is abandoned;
+    a worker that is still attached keeps its own mapping until it detaches.
+    """
+    shm, handle = share_array(array)
+    blocks = [shm]
+    flag_handle = None
+    if cancellable:
+        flag_shm, flag_handle = share_array(np.zeros(1, dtype=np.uint8))
+        blocks.append(flag_shm)
+    try:
+        cfut = pool.submit(run_on_shared_array, func, handle, *args, cancel_flag=flag_handle)
+        try:
+            return await await_job(cfut)
+        except asyncio.CancelledError:
+            if cancellable:
+                flag_shm.buf[0] = 1
+            raise
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
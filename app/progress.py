@@ -0,0 +1,117 @@
+"""
+Versioned progress deltas for GET /progress/{task_id}/stream (SSE) and /events (long-poll).
+
+The analysis keeps writing the plain TaskStatus dicts in app.main.tasks and calls notify()
+after a change. A task's ProgressStream diffs its current status against the previous sync,
+so a burst of changes becomes one event and the histograms are sent only once. Uploads
+following the same analysis share its stream, and so its version numbers.
+"""
+import asyncio
+
+# Statuses after which nothing changes any more
+TERMINAL_STATUSES = ("Complete", "Error", "Abandoned")
+# Fields sent whole when they change
+SCALAR_FIELDS = ("status", "progress", "steps", "current_step", "queue_position", "estimated_wait_seconds",
+                 "error", "cached", "result")
+# Append-only lists: an event carries only the new entries
+LIST_FIELDS = ("completed_steps", "timed_out_steps")
+
+_changed = {}  # key -> asyncio.Event, replaced each time notify(key) fires
+
+def change_event(key: str) -> asyncio.Event:
+    """
+    Event set on the next notify(key). Take it before reading the state, so a change made
+    between the read and the wait isn't missed.
+    """
+    event = _changed.get(key)
+    if event is None:
+        event = _changed[key] = asyncio.Event()
+    return event
+
+def notify(key: str):
+    """
+    Wakes everyone waiting for a change of the task state stored under key.
+    """
+    event = _changed.pop(key, None)
+    if event is not None:
+        event.set()
+
+def forget(key: str):
+    _changed.pop(key, None)
+
+def diff_status(old: dict, new: dict) -> dict:
+    """
+    Delta turning TaskStatus old into new; empty if nothing changed. A change that isn't
+    expressible as a delta (a list that was not just appended to) yields the full status
+    with "snapshot": True.
+    """
+    delta = {}
+    for field in LIST_FIELDS:
+        before, after = old.get(field) or [], new.get(field) or []
+        if after[:len(before)] != before:
+            return {**new, "snapshot": True}
+        if len(after) > len(before):
+            delta[field] = after[len(before):]
+    for field in SCALAR_FIELDS:
+        if field in new and (field not in old or old[field] != new[field]):
+            delta[field] = new[field]
+    before, after = old.get("partial_results") or {}, new.get("partial_results") or {}
+    if any(key not in after for key in before):
+        return {**new, "snapshot": True}
+    changed = {key: value for key, value in after.items() if key not in before or before[key] != value}
+    if changed:
+        delta["partial_results"] = changed
+    return delta
+
+def _copy(status: dict) -> dict:
+    # Lists and partial results are mutated in place by the analysis; keep our own copy
+    copy = dict(status)
+    for field in LIST_FIELDS:
+        copy[field] = list(status.get(field) or [])
+    copy["partial_results"] = dict(status.get("partial_results") or {})
+    return copy
+
+class ProgressStream:
+    """
+    The events of one task state so far. Event n (its "version") is the delta from
+    version n - 1; version 1 is the whole status at the time of the first sync.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.events = []
+        self._last = {}
+
+    @property
+    def done(self) -> bool:
+        return self._last.get("status") in TERMINAL_STATUSES
+
+    def sync(self, status: dict):
+        """
+        Records the change since the previous sync as the next event, if there is one.
+        """
+        delta = diff_status(self._last, status)
+        if not delta:
+            return
+        self.version += 1
+        self.events.append({"version": self.version, **delta})
+        self._last = _copy(status)
+
+    def fork(self) -> "ProgressStream":
+        """
+        A copy that continues from this stream's versions independently of it.
+        """
+        stream = ProgressStream()
+        stream.version = self.version
+        stream.events = list(self.events)
+        stream._last = _copy(self._last)
+        return stream
+
+    def since(self, version: int) -> list:
+        """
+        Events after version. A version the stream doesn't know (e.g. from before a server
+        restart) gets the current status as a single snapshot event.
+        """
+        if version < 0 or version > self.version:
+            return [{**self._last, "version": self.version, "snapshot": True}]
+        return self.events[version:]
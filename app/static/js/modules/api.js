@@ -1,3 +1,32 @@
+/** Task statuses after which no more progress events follow */
+const TERMINAL_STATUSES = ['Complete', 'Error', 'Abandoned'];
+
+/** Append-only TaskStatus lists; an event carries only their new entries */
+const LIST_FIELDS = ['completed_steps', 'timed_out_steps'];
+
+/**
+ * Applies one progress event (see GET /progress/{task_id}/events) to a task status
+ * @param {Object} state - Task status built from the previous events
+ * @param {Object} event - Event: a delta, or a whole status if `snapshot` is set
+ * @returns {Object} New task status (state is left unchanged)
+ */
+export function applyProgressEvent(state, event) {
+    const { version, snapshot, ...delta } = event;
+    if (snapshot) return delta;
+
+    const next = { ...state };
+    for (const [field, value] of Object.entries(delta)) {
+        if (LIST_FIELDS.includes(field)) {
+            next[field] = [...(state[field] || []), ...value];
+        } else if (field === 'partial_results') {
+            next[field] = { ...(state[field] || {}), ...value };
+        } else {
+            next[field] = value;
+        }
+    }
+    return next;
+}
+
 /**
  * API client for backend communication
  */
@@ -44,6 +73,81 @@ export class ApiClient {
         }
     }
 
+    /**
+     * Long-polls for progress events after a version
+     * @param {string} taskId - Task ID
+     * @param {number} since - Version of the last applied event (0 for none)
+     * @returns {Promise<Object|null>} { version, done, events } or null if not found
+     */
+    async getProgressEvents(taskId, since = 0) {
+        try {
+            const response = await fetch(`${this.baseUrl}/progress/${taskId}/events?since=${since}`);
+            if (!response.ok) return null;
+            return response.json();
+        } catch (error) {
+            console.error('Failed to fetch progress events:', error);
+            return null;
+        }
+    }
+
+    /**
+     * Follows a task's progress as it happens: Server-Sent Events when available, long-polling
+     * otherwise or once the event stream fails. Stops by itself when the task is finished.
+     * @param {string} taskId - Task ID
+     * @param {Function} onStatus - Called with the full task status after every event
+     * @param {number} retryDelay - Milliseconds to wait before retrying a failed long-poll
+     * @returns {Function} Stops following the task
+     */
+    streamProgress(taskId, onStatus, retryDelay = 1000) {
+        let status = {};
+        let version = 0;
+        let stopped = false;
+        let source = null;
+
+        const stop = () => {
+            stopped = true;
+            if (source) {
+                source.close();
+                source = null;
+            }
+        };
+
+        const apply = (event) => {
+            status = applyProgressEvent(status, event);
+            version = event.version;
+            onStatus(status);
+            if (TERMINAL_STATUSES.includes(status.status)) stop();
+        };
+
+        const longPoll = async () => {
+            while (!stopped) {
+                const data = await this.getProgressEvents(taskId, version);
+                if (stopped) return;
+                if (!data) {
+                    await new Promise(resolve => setTimeout(resolve, retryDelay));
+                    continue;
+                }
+                data.events.forEach(apply);
+                if (data.done) stop();
+            }
+        };
+
+        if (typeof EventSource === 'undefined') {
+            longPoll();
+        } else {
+            source = new EventSource(`${this.baseUrl}/progress/${taskId}/stream`);
+            source.addEventListener('progress', (message) => apply(JSON.parse(message.data)));
+            source.onerror = () => {
+                // Blocked or dropped stream (e.g. a buffering proxy): carry on from the last version
+                if (stopped) return;
+                source.close();
+                source = null;
+                longPoll();
+            };
+        }
+        return stop;
+    }
+
     /**
      * Gets aggregate statistics
      * @returns {Promise<Object>} Statistics data
@@ -1,5 +1,5 @@
-import { describe, test, expect, beforeEach, jest } from '@jest/globals';
-import { ApiClient } from '../js/modules/api.js';
+import { describe, test, expect, beforeEach, afterEach, jest } from '@jest/globals';
+import { ApiClient, applyProgressEvent } from '../js/modules/api.js';
 
 describe('ApiClient', () => {
     let api;
@@ -71,6 +71,78 @@ describe('ApiClient', () => {
         });
     });
 
+    describe('streamProgress', () => {
+        const respond = (body) => ({ ok: true, json: () => Promise.resolve(body) });
+
+        afterEach(() => {
+            delete global.EventSource;
+        });
+
+        test('long-polls from the last version until the task is done', async () => {
+            global.fetch
+                .mockResolvedValueOnce(respond({
+                    version: 1, done: false,
+                    events: [{ version: 1, status: 'Starting...', progress: 0, completed_steps: [] }]
+                }))
+                .mockResolvedValueOnce(respond({
+                    version: 3, done: true,
+                    events: [
+                        { version: 2, progress: 50, completed_steps: ['Preprocessing'] },
+                        { version: 3, status: 'Complete', progress: 100 }
+                    ]
+                }));
+
+            const statuses = [];
+            await new Promise((resolve) => {
+                api.streamProgress('123', (status) => {
+                    statuses.push(status);
+                    if (status.status === 'Complete') resolve();
+                });
+            });
+
+            expect(global.fetch).toHaveBeenNthCalledWith(1, `${baseUrl}/progress/123/events?since=0`);
+            expect(global.fetch).toHaveBeenNthCalledWith(2, `${baseUrl}/progress/123/events?since=1`);
+            expect(statuses).toHaveLength(3);
+            expect(statuses[2]).toEqual({ status: 'Complete', progress: 100, completed_steps: ['Preprocessing'] });
+        });
+
+        test('falls back to long-polling when the event stream fails', async () => {
+            const sources = [];
+            global.EventSource = class {
+                constructor(url) {
+                    this.url = url;
+                    this.listeners = {};
+                    this.close = jest.fn();
+                    sources.push(this);
+                }
+                addEventListener(type, listener) {
+                    this.listeners[type] = listener;
+                }
+            };
+            global.fetch.mockResolvedValueOnce(respond({
+                version: 2, done: true, events: [{ version: 2, status: 'Complete' }]
+            }));
+
+            const statuses = [];
+            const finished = new Promise((resolve) => {
+                api.streamProgress('123', (status) => {
+                    statuses.push(status);
+                    if (status.status === 'Complete') resolve();
+                });
+            });
+
+            const [source] = sources;
+            expect(source.url).toBe(`${baseUrl}/progress/123/stream`);
+            source.listeners.progress({ data: JSON.stringify({ version: 1, status: 'Starting...', progress: 0 }) });
+            source.onerror();
+            await finished;
+
+            expect(source.close).toHaveBeenCalled();
+            expect(global.fetch).toHaveBeenCalledWith(`${baseUrl}/progress/123/events?since=1`);
+            expect(statuses[1]).toEqual({ status: 'Complete', progress: 0 });
+        });
+    });
+
     describe('getStats', () => {
         test('returns stats on success', async () => {
             const mockResponse = { total_images: 10 };
@@ -95,3 +167,33 @@ describe('ApiClient', () => {
         });
     });
 });
+
+describe('applyProgressEvent', () => {
+    test('appends list entries and merges partial results', () => {
+        const state = {
+            status: 'Performing Parallel Analysis & Upload...',
+            completed_steps: ['Preprocessing'],
+            partial_results: { width: 100 }
+        };
+        const next = applyProgressEvent(state, {
+            version: 4,
+            completed_steps: ['AI Classifier'],
+            partial_results: { ai_probability: 0.2 }
+        });
+
+        expect(next).toEqual({
+            status: 'Performing Parallel Analysis & Upload...',
+            completed_steps: ['Preprocessing', 'AI Classifier'],
+            partial_results: { width: 100, ai_probability: 0.2 }
+        });
+        expect(state.completed_steps).toEqual(['Preprocessing']);
+    });
+
+    test('replaces the status on a snapshot', () => {
+        const next = applyProgressEvent(
+            { status: 'Starting...', completed_steps: ['Preprocessing'] },
+            { version: 9, snapshot: true, status: 'Abandoned', completed_steps: [] }
+        );
+        expect(next).toEqual({ status: 'Abandoned', completed_steps: [] });
+    });
+});
@@ -0,0 +1,196 @@
+"""
+Task state shared between the processes of the web app (`uvicorn --workers N`).
+
+Each process runs its own uploads and keeps their state in its TaskStore. With a shared
+backend it also publishes every change, so a /progress request reaching another process can
+still answer, and it records which upload each session is running, so a new upload can
+abandon the session's previous one wherever it runs.
+
+TASK_STATE_BACKEND picks the backend: "local" (default, one process, nothing shared) or
+"sqlite" (a SQLite file at TASK_STATE_PATH, for the processes of one machine).
+"""
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import time
+
+
+class LocalTaskState:
+    """
+    Single process: the TaskStore and active_sessions already hold everything.
+    """
+    shared = False
+
+    def publish(self, task_id: str, state: dict, version: int = 0):
+        pass
+
+    def lookup(self, task_id: str):
+        return None
+
+    def forget(self, task_ids):
+        pass
+
+    def swap_session(self, session_id: str, task_id: str):
+        return None
+
+    def end_session(self, session_id: str, task_id: str):
+        pass
+
+    def request_cancel(self, task_id: str):
+        pass
+
+    def take_cancellations(self, task_ids) -> list:
+        return []
+
+    def purge(self, older_than_seconds: float) -> int:
+        return 0
+
+class SQLiteTaskState:
+    """
+    Task states, sessions and cancellation requests in a SQLite file (WAL mode) shared by the
+    processes of one machine.
+    """
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS task_state (
+                    task_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    owner TEXT,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    task_id TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS cancellations (
+                    task_id TEXT PRIMARY KEY,
+                    requested_at REAL NOT NULL
+                )
+            """)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        # Progress is published on every change; losing the last ones on a power cut is fine
+        con.execute("PRAGMA synchronous=NORMAL")
+        try:
+            yield con
+        finally:
+            con.close()
+
+    def publish(self, task_id: str, state: dict, version: int = 0):
+        """
+        Makes the current state of a task run by this process visible to the others, with the
+        version of its progress stream here.
+        """
+        payload = json.dumps(state, default=str)
+        with self._connect() as con:
+            con.execute("""
+                INSERT OR REPLACE INTO task_state (task_id, state, version, owner, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (task_id, payload, version, self.owner, time.time()))
+
+    def lookup(self, task_id: str):
+        """
+        Returns (state, version) as last published by the process running the task, or None.
+        """
+        with self._connect() as con:
+            row = con.execute("SELECT state, version FROM task_state WHERE task_id = ?", (task_id,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def forget(self, task_ids):
+        """
+        Drops published states (the tasks were spilled, where every process finds them).
+        """
+        task_ids = list(task_ids)
+        if not task_ids:
+            return
+        with self._connect() as con:
+            con.executemany("DELETE FROM task_state WHERE task_id = ?", [(task_id,) for task_id in task_ids])
+
+    def swap_session(self, session_id: str, task_id: str):
+        """
+        Records task_id as the session's current upload and returns the previous one, or None.
+        """
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                row = con.execute("SELECT task_id FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                con.execute("INSERT OR REPLACE INTO sessions (session_id, task_id, updated_at) VALUES (?, ?, ?)",
+                            (session_id, task_id, time.time()))
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+        return row[0] if row else None
+
+    def end_session(self, session_id: str, task_id: str):
+        """
+        Clears the session's current upload, unless it has moved on to another one.
+        """
+        with self._connect() as con:
+            con.execute("DELETE FROM sessions WHERE session_id = ? AND task_id = ?", (session_id, task_id))
+
+    def request_cancel(self, task_id: str):
+        """
+        Asks whichever process runs the upload to abandon it.
+        """
+        with self._connect() as con:
+            con.execute("INSERT OR REPLACE INTO cancellations (task_id, requested_at) VALUES (?, ?)",
+                        (task_id, time.time()))
+
+    def take_cancellations(self, task_ids) -> list:
+        """
+        Returns (and clears) the cancellation requests among task_ids.
+        """
+        task_ids = list(task_ids)
+        if not task_ids:
+            return []
+        placeholders = ", ".join("?" * len(task_ids))
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                requested = [row[0] for row in con.execute(
+                    f"SELECT task_id FROM cancellations WHERE task_id IN ({placeholders})", task_ids)]
+                con.execute(f"DELETE FROM cancellations WHERE task_id IN ({placeholders})", task_ids)
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+        return requested
+
+    def purge(self, older_than_seconds: float) -> int:
+        """
+        Deletes states, sessions and cancellation requests not updated for older_than_seconds
+        (left behind by processes that exited, or for uploads that had already finished).
+        """
+        cutoff = time.time() - older_than_seconds
+        with self._connect() as con:
+            removed = con.execute("DELETE FROM task_state WHERE updated_at < ?", (cutoff,)).rowcount
+            removed += con.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,)).rowcount
+            removed += con.execute("DELETE FROM cancellations WHERE requested_at < ?", (cutoff,)).rowcount
+        return removed
+
+def create_task_state(backend: str, path: str):
+    if backend == "local":
+        return LocalTaskState()
+    if backend == "sqlite":
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return SQLiteTaskState(path)
+    raise ValueError(f"Unknown task state backend: {backend}")
@@ -0,0 +1,285 @@
+"""
+In-memory task states with a size budget, spilling finished tasks to DuckDB.
+
+Tasks are plain TaskStatus dicts, mutated in place while their analysis runs. A finished task
+(status Complete, Error or Abandoned) is evicted once it has been finished for ttl_seconds, or
+earlier, oldest first, while the store is over max_entries or max_bytes. Evicted states are
+written to the task_spill table and read back from there on lookup, so /progress keeps
+answering for them. Running tasks are never evicted.
+
+With a shared backend (app.taskstate), lookups of tasks run by another process find the
+state that process last published.
+
+Spilling and reading back are blocking database calls. Event loop code uses evict_async()
+and runs stored() on an executor; plain item access and evict() block. Publishing and the
+other backend writes go through backend_call(), which runs them in order on one thread.
+"""
+import asyncio
+import copy
+import sys
+import threading
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import uvicorn
+
+from app.database import get_spilled_task, spill_tasks
+from app.progress import TERMINAL_STATUSES
+from app.taskstate import LocalTaskState
+
+
+def estimate_size(value, seen=None) -> int:
+    """
+    Approximate memory held by a task state: sys.getsizeof over its dicts, lists and their
+    items, counting shared objects once.
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(estimate_size(item, seen) for item in value)
+    return size
+
+class TaskStore(MutableMapping):
+    """
+    Dict of task id -> state. An entry {"shared_state": other_id} (an upload following another
+    upload's analysis) counts as finished when that state is.
+
+    Iteration and len() cover the tasks held in memory; lookups also find the ones published
+    by other processes and spilled ones, which come back as fresh copies (changing them has no
+    effect).
+    """
+
+    def __init__(self, max_entries: int = 0, max_bytes: int = 0, ttl_seconds: float = 0, clock=time.monotonic,
+                 backend=None):
+        self.max_entries = max_entries  # 0 = no limit, as for max_bytes and ttl_seconds
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend or LocalTaskState()
+        self._clock = clock
+        self._data = {}
+        self._finished_at = {}  # task id -> clock() when first seen finished
+        self._sizes = {}  # task id -> estimate_size of a finished state (they no longer change)
+        self._spilling = set()  # task ids being spilled by evict_async
+        # Backend calls run in submission order on one thread; the states waiting there to be
+        # published (task id -> (snapshot, version)) are replaced by newer ones
+        self._backend_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-state")
+        self._unpublished = {}
+        self._unpublished_lock = threading.Lock()
+        self.counters = {"evicted": 0, "spill_errors": 0, "spill_reads": 0, "shared_reads": 0}
+
+    def __getitem__(self, task_id):
+        try:
+            return self._data[task_id]
+        except KeyError:
+            pass
+        stored = self.stored(task_id)
+        if stored is None:
+            raise KeyError(task_id)
+        return stored[0]
+
+    def held(self, task_id):
+        """
+        The in-memory state of task_id, or None (it may still be published or spilled).
+        """
+        return self._data.get(task_id)
+
+    def stored(self, task_id):
+        """
+        (state, version) of a task not held in memory: as published by the process running it
+        (version of its progress stream), else from the spill (version None). None if unknown.
+        Blocks on the backend and the database.
+        """
+        published = self.published(task_id)
+        if published is not None:
+            self.counters["shared_reads"] += 1
+            return published
+        try:
+            state = get_spilled_task(task_id)
+        except Exception as e:  # noqa: BLE001 - an unreadable spill answers like an unknown task
+            uvicorn.config.logger.error(f"Reading spilled task {task_id} failed: {e}")
+            state = None
+        if state is None:
+            return None
+        self.counters["spill_reads"] += 1
+        return state, None
+
+    def __setitem__(self, task_id, state):
+        self._data[task_id] = state
+        self._finished_at.pop(task_id, None)
+        self._sizes.pop(task_id, None)
+
+    def __delitem__(self, task_id):
+        del self._data[task_id]
+        self._finished_at.pop(task_id, None)
+        self._sizes.pop(task_id, None)
+
+    def __contains__(self, task_id):
+        return task_id in self._data or self.get(task_id) is not None
+
+    def holds(self, task_id) -> bool:
+        """
+        True if the task is in memory (not spilled).
+        """
+        return task_id in self._data
+
+    def publish(self, task_id, version: int = 0):
+        """
+        Publishes the in-memory state of task_id to the other processes, as of version of its
+        progress stream. Queues a copy of the state and returns at once; a copy still queued
+        when the next one comes is never written.
+        """
+        snapshot = copy.deepcopy(self._data[task_id])
+        with self._unpublished_lock:
+            queued = task_id in self._unpublished
+            self._unpublished[task_id] = (snapshot, version)
+        if not queued:
+            self._backend_thread.submit(self._publish_queued, task_id)
+
+    def _publish_queued(self, task_id):
+        with self._unpublished_lock:
+            state, version = self._unpublished.pop(task_id)
+        try:
+            self.backend.publish(task_id, state, version)
+        except Exception as e:  # noqa: BLE001 - the next change publishes the state again
+            uvicorn.config.logger.error(f"Publishing task {task_id} failed: {e}")
+
+    def backend_call(self, name: str, *args) -> Future:
+        """
+        Runs backend.<name>(*args) on the backend thread, after the calls and publishes queued
+        before it. Returns its future.
+        """
+        return self._backend_thread.submit(getattr(self.backend, name), *args)
+
+    def flush_backend(self):
+        """
+        Waits until the backend calls and publishes queued so far are done. Blocks.
+        """
+        self._backend_thread.submit(lambda: None).result()
+
+    def published(self, task_id):
+        """
+        (state, version) of a task as published by the process running it, or None.
+        """
+        try:
+            return self.backend.lookup(task_id)
+        except Exception as e:  # noqa: BLE001 - lookup falls back to the spill
+            uvicorn.config.logger.error(f"Reading shared task {task_id} failed: {e}")
+            return None
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def _finished(self, state: dict) -> bool:
+        if "shared_state" in state:
+            target = self._data.get(state["shared_state"])
+            # A target no longer in memory was finished when it was evicted
+            return target is None or target.get("status") in TERMINAL_STATUSES
+        return state.get("status") in TERMINAL_STATUSES
+
+    def _size(self, task_id: str) -> int:
+        size = self._sizes.get(task_id)
+        if size is None:
+            size = estimate_size(self._data[task_id])
+            if task_id in self._finished_at:
+                self._sizes[task_id] = size
+        return size
+
+    def footprint(self) -> dict:
+        """
+        Current memory use: entries held (running and finished) and their estimated bytes.
+        """
+        running = sum(1 for task_id in self._data if task_id not in self._finished_at)
+        return {
+            "entries": len(self._data),
+            "running": running,
+            "finished": len(self._data) - running,
+            "bytes": sum(self._size(task_id) for task_id in self._data),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            **self.counters,
+        }
+
+    def evict(self) -> list:
+        """
+        Spills and drops the finished tasks past their TTL, then the oldest finished ones
+        while over max_entries or max_bytes. Returns the evicted task ids. If the spill
+        fails, everything stays in memory until the next call.
+        """
+        return self._drop(self._spill(self._select()))
+
+    async def evict_async(self, executor=None) -> list:
+        """
+        evict() with the spill run on executor, so the event loop isn't blocked.
+        """
+        selected = self._select()
+        if not selected:
+            return []
+        self._spilling.update(selected)
+        try:
+            spilled = await asyncio.get_running_loop().run_in_executor(executor, self._spill, selected)
+        finally:
+            self._spilling.difference_update(selected)
+        return self._drop(spilled)
+
+    def _select(self) -> dict:
+        """
+        The tasks to evict now, as {task_id: state}.
+        """
+        now = self._clock()
+        for task_id, state in self._data.items():
+            if task_id not in self._finished_at and self._finished(state):
+                self._finished_at[task_id] = now
+        finished = sorted((task_id for task_id in self._finished_at if task_id not in self._spilling),
+                          key=self._finished_at.get)
+
+        evicted = []
+        if self.ttl_seconds:
+            evicted = [task_id for task_id in finished if now - self._finished_at[task_id] >= self.ttl_seconds]
+        entries = len(self._data) - len(evicted)
+        total_bytes = (sum(self._size(task_id) for task_id in self._data) -
+                       sum(self._size(task_id) for task_id in evicted)) if self.max_bytes else 0
+        for task_id in finished[len(evicted):]:
+            if not ((self.max_entries and entries > self.max_entries) or
+                    (self.max_bytes and total_bytes > self.max_bytes)):
+                break
+            evicted.append(task_id)
+            entries -= 1
+            total_bytes -= self._size(task_id) if self.max_bytes else 0
+        return {task_id: self._data[task_id] for task_id in evicted}
+
+    def _spill(self, selected: dict) -> dict:
+        """
+        Writes the selected states to the spill; returns them, or {} if that failed.
+        """
+        if not selected:
+            return {}
+        try:
+            spill_tasks(selected)
+        except Exception as e:  # noqa: BLE001 - counted; the states stay in memory for the next try
+            uvicorn.config.logger.error(f"Spilling {len(selected)} finished tasks failed: {e}")
+            self.counters["spill_errors"] += 1
+            return {}
+        # Every process reads them from the spill now (once any publish still queued is done)
+        error = self.backend_call("forget", list(selected)).exception()
+        if error is not None:
+            uvicorn.config.logger.error(f"Dropping {len(selected)} shared task states failed: {error}")
+        return selected
+
+    def _drop(self, spilled: dict) -> list:
+        # A state replaced while it was being spilled stays
+        evicted = [task_id for task_id, state in spilled.items() if self._data.get(task_id) is state]
+        for task_id in evicted:
+            del self[task_id]
+        self.counters["evicted"] += len(evicted)
+        return evicted
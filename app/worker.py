@@ -0,0 +1,175 @@
+"""
+Worker processes that run the analyses the web app queues in job queue mode.
+
+The web app queues uploads instead of analyzing them when started with JOB_QUEUE_PATH set;
+start the workers with the same path:
+
+    JOB_QUEUE_PATH=data/jobs.sqlite python -m app.worker [--processes N] [--concurrency M]
+
+Each process loads its own models and runs up to M analyses at once, with the same steps,
+caches and database writes as the in-process mode. It renews the lease on its jobs with
+heartbeats carrying their progress; the jobs of a worker that dies are picked up by the
+others once their lease runs out, and the supervisor starts a replacement process.
+"""
+import argparse
+import asyncio
+import contextlib
+import copy
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+from app.blobstore import get_blob
+from app.jobqueue import JobQueue
+from app.progress import change_event
+
+logger = logging.getLogger(__name__)
+
+# A job whose worker hasn't renewed its lease for this long goes back to the queue. Steps can
+# run for minutes, so the lease is renewed on a timer as well as on progress.
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "30"))
+JOB_HEARTBEAT_SECONDS = JOB_LEASE_SECONDS / 3
+# How long an idle worker waits before looking for new jobs again
+JOB_IDLE_SECONDS = 0.5
+
+# Job outcome by the final TaskStatus status
+JOB_STATUSES = {"Complete": "done", "Abandoned": "cancelled"}
+
+async def run_job(queue: JobQueue, worker_id: str, job: dict):
+    """
+    Runs one claimed job through app.main.process_image_task, relaying its progress to the
+    queue; cancels the analysis when the job is cancelled or its lease is lost.
+    """
+    import app.main as app_main
+
+    loop = asyncio.get_running_loop()
+    state_id = job["id"]
+    app_main.tasks[state_id] = state = app_main.new_task_state()
+    content = await loop.run_in_executor(app_main.executor, get_blob, job["content_hash"])
+    if content is None:
+        state.update(status="Error", error="The upload is missing from the blob store.")
+        await loop.run_in_executor(app_main.executor, queue.finish, state_id, worker_id, "failed", state)
+        del app_main.tasks[state_id]
+        return
+
+    analysis = asyncio.create_task(
+        app_main.process_image_task(state_id, content, job["filename"], job["content_hash"]))
+    del content
+    changed = change_event(state_id)
+    try:
+        while True:
+            waiter = asyncio.ensure_future(changed.wait())
+            done, _ = await asyncio.wait({analysis, waiter}, timeout=JOB_HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if analysis in done:
+                break
+            # Taken before the state is read, so progress made during the heartbeat isn't missed
+            changed = change_event(state_id)
+            # A copy: the analysis keeps appending to the state while the heartbeat encodes it
+            keep = await loop.run_in_executor(
+                app_main.executor, queue.heartbeat, state_id, worker_id, JOB_LEASE_SECONDS,
+                copy.deepcopy(app_main.tasks[state_id]))
+            if not keep:
+                logger.info(f"Job {state_id} was cancelled or taken over, stopping it")
+                analysis.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await analysis
+                break
+    finally:
+        if not analysis.done():
+            # This worker is shutting down: leave the job to be claimed again
+            analysis.cancel()
+        else:
+            # A no-op if the lease was lost to another worker
+            state = app_main.tasks[state_id]
+            status = JOB_STATUSES.get(state["status"], "failed")
+            await loop.run_in_executor(app_main.executor, queue.finish, state_id, worker_id, status, state)
+        if app_main.tasks.holds(state_id):
+            del app_main.tasks[state_id]
+
+async def serve(queue: JobQueue, worker_id: str, concurrency: int):
+    """
+    Claims and runs jobs, up to concurrency at a time, until cancelled.
+    """
+    import app.main as app_main
+
+    app_main.init_db()
+    app_main.start_analysis_runtime()
+    loop = asyncio.get_running_loop()
+    running = set()
+    try:
+        while True:
+            while len(running) < concurrency:
+                job = await loop.run_in_executor(app_main.executor, queue.claim, worker_id, JOB_LEASE_SECONDS)
+                if job is None:
+                    break
+                logger.info(f"Worker {worker_id} running job {job['id']} (attempt {job['attempts']})")
+                running.add(asyncio.create_task(run_job(queue, worker_id, job)))
+            if running:
+                done, running = await asyncio.wait(running, timeout=JOB_IDLE_SECONDS,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is not None:
+                        logger.error(f"Worker {worker_id} job failed: {finished.exception()}")
+            else:
+                await asyncio.sleep(JOB_IDLE_SECONDS)
+    finally:
+        for task in running:
+            task.cancel()
+
+def run_worker(queue_path: str, concurrency: int, cpu_pool_workers: int):
+    import app.main as app_main
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+    # The worker processes already spread the load over the cores
+    app_main.CPU_POOL_WORKERS = cpu_pool_workers
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve(JobQueue(queue_path), worker_id, concurrency))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="worker processes to run (default: half the cores)")
+    parser.add_argument("--concurrency", type=int, default=2, help="jobs each process runs at once")
+    parser.add_argument("--cpu-pool-workers", type=int, default=0,
+                        help="CPU_POOL_WORKERS of each process (default 0: CPU steps on its threads)")
+    args = parser.parse_args(argv)
+    queue_path = os.environ.get("JOB_QUEUE_PATH", "")
+    if not queue_path:
+        parser.error("set JOB_QUEUE_PATH to the web app's job queue file")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+    # Create the queue file before the workers race to
+    JobQueue(queue_path)
+    # spawn: each worker imports the app and loads its own models (no forked torch state)
+    context = multiprocessing.get_context("spawn")
+
+    def start(index):
+        process = context.Process(target=run_worker, name=f"worker-{index}",
+                                  args=(queue_path, args.concurrency, args.cpu_pool_workers))
+        process.start()
+        return process
+
+    processes = [start(index) for index in range(args.processes)]
+    try:
+        # Supervise: replace a worker that died; its jobs are reclaimed after their lease
+        while True:
+            time.sleep(1)
+            for index, process in enumerate(processes):
+                if process.exitcode is not None:
+                    logger.warning(f"{process.name} exited with code {process.exitcode}, restarting it")
+                    processes[index] = start(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+if __name__ == "__main__":
+    main()
@@ -25,3 +25,25 @@ def test_analyze_image_valid():
     assert isinstance(stats['ai_probability'], float)
     assert stats['ai_probability'] == 0.1
 
+
+def test_prepare_image_reduces_large_uploads():
+    from app.analysis.analysis import prepare_image
+
+    large = Image.new('RGB', (4000, 3000), color=(10, 200, 30))
+    exif = Image.Exif()
+    exif[0x0131] = "Test Software"
+    buf = io.BytesIO()
+    large.save(buf, format='JPEG', exif=exif)
+
+    image, np_image, width, height, mean_color = prepare_image(buf.getvalue(), max_side=1000)
+    # Reported size is the upload's; the decoded copy fits the limit
+    assert (width, height) == (4000, 3000)
+    assert max(image.size) == 1000
+    assert np_image.shape == (750, 1000, 3)
+    assert abs(mean_color[1] - 200) < 3
+    # Metadata survives the reduced decode
+    assert image.getexif()[0x0131] == "Test Software"
+
+    # max_side=0 decodes at native resolution
+    image, _, width, height, _ = prepare_image(buf.getvalue(), max_side=0)
+    assert image.size == (width, height) == (4000, 3000)
@@ -2,7 +2,36 @@ import pytest
 from PIL import Image
 from app.analysis.artmedium import analyze_art_medium
 from app.analysis.artmedium.extraction import extract_patches
+import math
+import numpy as np
 import torch
+from app.analysis.artmedium.classifiers import MEDIUM_LABELS
+
+def _mock_clip_processor(images=None, text=None, **kwargs):
+    count = len(images) if images is not None else len(text)
+    return type('MockInputs', (), {
+        'to': lambda self, device: {'pixel_values': torch.zeros((count, 3, 224, 224)),
+                                    'input_ids': torch.zeros((count, 8), dtype=torch.long)}
+    })()
+
+class _MockClipModel:
+    """Scores every image top_label with top_score against one-hot label embeddings."""
+
+    def __init__(self, top_label="Oil", top_score=0.95, text_dim=4):
+        others = len(MEDIUM_LABELS) - 1
+        self.top_index = list(MEDIUM_LABELS).index(top_label)
+        self.logit_scale = torch.tensor(math.log(math.log(top_score * others / (1 - top_score))))
+        self.text_dim = text_dim
+        self.text_calls = 0
+
+    def get_image_features(self, pixel_values):
+        features = torch.zeros((len(pixel_values), len(MEDIUM_LABELS)))
+        features[:, self.top_index] = 1.0
+        return features
+
+    def get_text_features(self, input_ids, **kwargs):
+        self.text_calls += 1
+        return torch.rand((len(input_ids), self.text_dim)) + 0.1
 
 def test_extract_patches():
     # Create a small test image
@@ -27,11 +56,8 @@ async def test_analyze_art_medium_basic(monkeypatch):
         def to(self, device):
             return self
 
-    def mock_clip(*args, **kwargs):
-        return [{"label": "Oil", "score": 0.95}]
-
     def mock_get_clip():
-        return mock_clip
+        return _mock_clip_processor, _MockClipModel(top_label="Oil", top_score=0.95)
 
     def mock_get_dinov2():
         mock_model = type('MockModel', (), {
@@ -44,7 +70,9 @@ async def test_analyze_art_medium_basic(monkeypatch):
             })()
         return mock_processor, mock_model
 
-    monkeypatch.setattr("app.analysis.artmedium.classifiers.get_clip_pipeline", mock_get_clip)
+    monkeypatch.setattr("app.analysis.artmedium.classifiers.get_clip", mock_get_clip)
+    monkeypatch.setattr("app.analysis.artmedium.classifiers.get_medium_text_embeddings",
+                        lambda: np.eye(len(MEDIUM_LABELS), dtype=np.float32))
     monkeypatch.setattr("app.analysis.artmedium.classifiers.get_dinov2", mock_get_dinov2)
 
     img = Image.new('RGB', (300, 300), color='green')
@@ -54,4 +82,114 @@ async def test_analyze_art_medium_basic(monkeypatch):
     assert "confidence" in result
     assert "description" in result
     assert result["medium"] == "Oil"
-    assert result["confidence"] == 0.95
+    assert result["confidence"] == pytest.approx(0.95)
+
+def test_patch_embeddings_are_batched(monkeypatch):
+    from app.analysis.artmedium.classifiers import get_patch_embeddings
+
+    processor_calls = []
+    batch_sizes = []
+
+    class MockOutput:
+        def __init__(self, n):
+            self.pooler_output = torch.ones((n, 768))
+
+    class MockModel:
+        def __call__(self, pixel_values):
+            batch_sizes.append(len(pixel_values))
+            return MockOutput(len(pixel_values))
+
+    def mock_processor(images, return_tensors):
+        processor_calls.append(len(images))
+        return type('MockInputs', (), {
+            'to': lambda self, device: {'pixel_values': torch.zeros((len(images), 3, 224, 224))}
+        })()
+
+    monkeypatch.setattr("app.analysis.artmedium.classifiers.get_dinov2", lambda: (mock_processor, MockModel()))
+
+    patches = [Image.new('RGB', (224, 224)) for _ in range(5)]
+    embeddings = get_patch_embeddings(patches, batch_size=2)
+
+    assert embeddings.shape == (5, 768)
+    assert processor_calls == [5]
+    assert batch_sizes == [2, 2, 1]
+
+def test_pool_token_regions_overlapping_windows():
+    import numpy as np
+
+    from app.analysis.artmedium.extraction import pool_token_regions
+
+    grid = np.arange(10 * 10, dtype=float).reshape(10, 10, 1)
+    regions = pool_token_regions(grid, regions_per_side=4)
+    assert regions.shape == (16, 1)
+    # First window covers rows/cols 0..3 (stride 2, width 4)
+    assert regions[0, 0] == grid[0:4, 0:4].mean()
+
+    # A grid smaller than the requested layout yields one region per token
+    assert pool_token_regions(np.ones((2, 3, 5)), regions_per_side=4).shape == (6, 5)
+
+def test_grid_texture_mode_uses_one_forward_pass(monkeypatch):
+    import numpy as np
+
+    from app.analysis.artmedium import texture_embeddings
+
+    calls = []
+
+    def mock_token_grid(img, cancel_token=None):
+        calls.append(img.size)
+        return np.ones((32, 32, 768))
+
+    def fail_patch_embeddings(*args, **kwargs):
+        raise AssertionError("patch embeddings used in grid mode")
+
+    monkeypatch.setattr("app.analysis.artmedium.get_token_grid", mock_token_grid)
+    monkeypatch.setattr("app.analysis.artmedium.get_patch_embeddings", fail_patch_embeddings)
+
+    embeddings = texture_embeddings(Image.new('RGB', (800, 600)), mode="grid")
+    assert embeddings.shape == (16, 768)
+    assert calls == [(800, 600)]
+
+    with pytest.raises(ValueError):
+        texture_embeddings(Image.new('RGB', (100, 100)), mode="unknown")
+
+def test_texture_mode_agreement_summary():
+    from app.analysis.artmedium.benchmark import summarize_agreement
+
+    rows = [
+        {"patches": {"score": 0.9, "seconds": 1.6}, "grid": {"score": 0.85, "seconds": 0.2}},
+        {"patches": {"score": 0.6, "seconds": 1.6}, "grid": {"score": 0.7, "seconds": 0.2}},
+        {"patches": {"score": 0.4, "seconds": 1.6}, "grid": {"score": 0.55, "seconds": 0.2}},
+    ]
+    summary = summarize_agreement(rows)
+    assert summary["images"] == 3
+    assert summary["speedup"] == pytest.approx(8.0)
+    assert summary["max_abs_diff"] == pytest.approx(0.15)
+    assert summary["spearman"] == pytest.approx(1.0)
+    # The last image moves from the "varied" band to the "moderate" one
+    assert summary["band_agreement"] == pytest.approx(2 / 3)
+
+def test_medium_text_embeddings_cached_on_disk(monkeypatch, tmp_path):
+    from app.analysis.artmedium import classifiers
+
+    model = _MockClipModel()
+    model.config = type('Config', (), {'_commit_hash': 'abc123'})()
+    monkeypatch.setattr(classifiers, "get_clip", lambda: (_mock_clip_processor, model))
+    monkeypatch.setattr(classifiers, "CLIP_TEXT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(classifiers, "_medium_text_embeddings", None)
+
+    embeddings = classifiers.get_medium_text_embeddings()
+    # One ensembled, normalized embedding per label; all synonym prompts in one text pass
+    assert embeddings.shape == (len(MEDIUM_LABELS), model.text_dim)
+    assert np.allclose(np.linalg.norm(embeddings, axis=1), 1.0, atol=1e-5)
+    assert model.text_calls == 1
+    cached = list(tmp_path.iterdir())
+    assert len(cached) == 1 and "abc123" in cached[0].name
+
+    # A new process (fresh in-memory cache) loads the file instead of re-encoding
+    monkeypatch.setattr(classifiers, "_medium_text_embeddings", None)
+    assert np.array_equal(classifiers.get_medium_text_embeddings(), embeddings)
+    assert model.text_calls == 1
+
+    # Prompts cover every synonym under every template
+    prompts = classifiers.medium_prompts()
+    assert len(prompts["Pastels"]) == 5 * len(classifiers.MEDIUM_PROMPT_TEMPLATES)
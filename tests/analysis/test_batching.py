@@ -0,0 +1,108 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.analysis.batching import Histogram, MicroBatcher
+from app.analysis.cancellation import AnalysisCancelled, CancellationToken
+
+
+def test_concurrent_requests_share_one_batch():
+    calls = []
+
+    def run_batch(items, cancel_tokens):
+        calls.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher("test_share", run_batch, max_batch_size=8, window_ms=50)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(batcher.infer, [1, 2, 3, 4]))
+
+    assert results == [10, 20, 30, 40]
+    assert len(calls) == 1
+    assert sorted(calls[0]) == [1, 2, 3, 4]
+
+    stats = batcher.stats()
+    assert stats["batch_size"]["count"] == 1
+    assert stats["batch_size"]["sum"] == 4
+    assert stats["queue_wait_ms"]["count"] == 4
+
+def test_max_batch_size_splits_batches():
+    sizes = []
+
+    def run_batch(items, cancel_tokens):
+        sizes.append(len(items))
+        return items
+
+    batcher = MicroBatcher("test_split", run_batch, max_batch_size=2, window_ms=50)
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(batcher.infer, range(5)))
+
+    assert results == list(range(5))
+    assert max(sizes) <= 2
+    assert sum(sizes) == 5
+
+def test_batching_disabled_runs_inline():
+    caller = threading.current_thread()
+    seen = []
+
+    def run_batch(items, cancel_tokens):
+        seen.append(threading.current_thread())
+        return items
+
+    batcher = MicroBatcher("test_inline", run_batch, max_batch_size=1)
+    assert batcher.infer("x") == "x"
+    assert seen == [caller]
+
+def test_batch_error_reaches_every_caller():
+    def run_batch(items, cancel_tokens):
+        raise RuntimeError("model failed")
+
+    batcher = MicroBatcher("test_error", run_batch, max_batch_size=4, window_ms=5)
+    with pytest.raises(RuntimeError, match="model failed"):
+        batcher.infer(1)
+
+def test_cancelled_request_is_dropped_from_queue():
+    release = threading.Event()
+    batches = []
+
+    def run_batch(items, cancel_tokens):
+        batches.append(list(items))
+        release.wait(timeout=5)
+        return items
+
+    batcher = MicroBatcher("test_cancel", run_batch, max_batch_size=2, window_ms=1)
+    # Occupy the batcher so the next request has to queue
+    busy = batcher.submit("busy")
+    time.sleep(0.05)
+
+    token = CancellationToken()
+    result = {}
+
+    def caller():
+        try:
+            batcher.infer("queued", token)
+        except AnalysisCancelled:
+            result["cancelled"] = True
+
+    thread = threading.Thread(target=caller)
+    thread.start()
+    time.sleep(0.05)
+    token.cancel()
+    thread.join(timeout=1)
+    release.set()
+    busy.result(timeout=5)
+    time.sleep(0.05)
+
+    assert result.get("cancelled")
+    assert ["queued"] not in batches
+
+def test_histogram_is_cumulative():
+    hist = Histogram((1, 5))
+    for value in (0.5, 3, 3, 10):
+        hist.observe(value)
+    snap = hist.snapshot()
+    assert snap["count"] == 4
+    assert [b["count"] for b in snap["buckets"]] == [1, 3, 4]
+    assert snap["buckets"][-1]["le"] == "+Inf"
@@ -1,6 +1,6 @@
 import numpy as np
 import pytest
-from app.analysis.fractaldim import fractal_dimension
+from app.analysis.fractaldim import box_counting_curve, fractal_dimension, fractal_profile
 
 def test_fractaldim_zeros():
     # A completely empty image
@@ -70,3 +70,59 @@ def test_fractaldim_input_validation():
     img = np.zeros((100,), dtype=np.uint8)
     with pytest.raises(ValueError, match="Input image must be a 2D array"):
         fractal_dimension(img)
+
+def test_fractaldim_vectorized_matches_reference():
+    from tests.analysis.fractal_generators import (
+        generate_fbm,
+        generate_koch_curve,
+        generate_sierpinski_triangle,
+    )
+    # The reference engine is a pure-Python loop, so keep the inputs small
+    np.random.seed(7)
+    images = {
+        "fbm": generate_fbm((96, 96), H=0.5),
+        "sierpinski": generate_sierpinski_triangle((96, 96)),
+        "koch": generate_koch_curve((96, 96)),
+        "wide": np.random.randint(0, 256, (48, 70), dtype=np.uint8),
+        "tall": np.random.randint(0, 256, (70, 48), dtype=np.uint8),
+    }
+    for name, img in images.items():
+        fd_ref = fractal_dimension(img, method="reference")
+        fd_vec = fractal_dimension(img, method="vectorized")
+        print(f"{name}: reference={fd_ref} vectorized={fd_vec}")
+        assert fd_vec == pytest.approx(fd_ref, abs=1e-9), name
+
+def test_fractaldim_unknown_method():
+    img = np.zeros((10, 10), dtype=np.uint8)
+    with pytest.raises(ValueError, match="Unknown method"):
+        fractal_dimension(img, method="bogus")
+
+def test_fractal_profile_matches_separate_runs():
+    from tests.analysis.fractal_generators import generate_fbm
+    np.random.seed(3)
+    img = generate_fbm((128, 128), H=0.5)
+    profile = fractal_profile(img)
+
+    # One pass must reproduce three independent fractal_dimension() calls exactly
+    assert profile["fd_default"] == fractal_dimension(img)
+    assert profile["fd_small"] == fractal_dimension(img, min_box=2, max_box=128 // 8)
+    assert profile["fd_large"] == fractal_dimension(img, min_box=128 // 8, max_box=128 // 2)
+
+    curve = profile["curve"]
+    assert len(curve) == 128 // 2 - 2 + 1
+    assert curve[0][0] == pytest.approx(2 / 128)
+    assert all(n_r > 0 for _, n_r in curve)
+
+def test_box_counting_curve_reference_parity():
+    np.random.seed(11)
+    img = np.random.randint(0, 256, (40, 40), dtype=np.uint8)
+    assert box_counting_curve(img) == box_counting_curve(img, method="reference")
+
+def test_fractaldim_cancelled_token():
+    from app.analysis.cancellation import AnalysisCancelled, CancellationToken
+    token = CancellationToken()
+    token.cancel()
+    img = np.zeros((32, 32), dtype=np.uint8)
+    for method in ("vectorized", "reference"):
+        with pytest.raises(AnalysisCancelled):
+            fractal_dimension(img, method=method, cancel_token=token)
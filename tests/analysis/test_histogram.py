@@ -2,6 +2,8 @@ import numpy as np
 from PIL import Image
 import io
 from app.analysis import analyze_image
+# Imported at collection: conftest replaces the module attribute with a mock for the session
+from app.analysis.histogram import compute_histogram
 
 def test_analyze_image_gradient():
     # Create a 2x2 image
@@ -24,4 +26,16 @@ def test_analyze_image_gradient():
     
     assert stats['width'] == 2
     assert stats['height'] == 2
-    assert stats['mean_color'] == [127.5, 127.5, 127.5]
\ No newline at end of file
+    assert stats['mean_color'] == [127.5, 127.5, 127.5]
+
+def test_histogram_of_reduced_decode_scaled_to_original_pixels():
+    # A 100x50 upload decoded at 50x25: a quarter of the pixels
+    data = np.zeros((25, 50, 3), dtype=np.uint8)
+    data[:, :25] = [255, 0, 0]
+    hist = compute_histogram(data, pixel_count=100 * 50)
+    assert sum(hist["histogram_r"]) == 5000
+    assert hist["histogram_r"][255] == hist["histogram_r"][0] == 2500
+    assert hist["histogram_g"][0] == 5000
+
+    # Without it, plain counts of the decoded pixels
+    assert compute_histogram(data)["histogram_g"][0] == 1250
@@ -42,3 +42,38 @@ def test_detect_objects_mona_lisa():
             
             box = res['box']
             assert all(k in box for k in ['xmin', 'ymin', 'xmax', 'ymax'])
+
+def test_detect_objects_boxes_in_original_coordinates(monkeypatch):
+    from app.analysis import object_detection
+    from app.analysis.pyramid import ImagePyramid
+
+    seen = []
+
+    def mock_infer(image, cancel_token=None):
+        seen.append(image.size)
+        return [{"label": "person", "score": 0.9, "box": {"xmin": 10, "ymin": 20, "xmax": 100, "ymax": 200}}]
+
+    monkeypatch.setattr(object_detection._batcher, "infer", mock_infer)
+    pyramid = ImagePyramid(Image.new('RGB', (2048, 1024)), original_size=(8192, 4096))
+
+    results = detect_objects(pyramid)
+    # The model sees the 512px level; boxes come back scaled to the 8192x4096 upload
+    assert seen == [(1024, 512)]
+    assert results[0]["box"] == {"xmin": 80, "ymin": 160, "xmax": 800, "ymax": 1600}
+
+def test_detect_batch_groups_images_by_size(monkeypatch):
+    from app.analysis import object_detection
+
+    calls = []
+
+    def detector(images, batch_size):
+        # Like the real pipeline, which can only stack equally sized inputs
+        assert len({image.size for image in images}) == 1 and batch_size == len(images)
+        calls.append(len(images))
+        return [[{"label": f"{image.width}x{image.height}", "score": 0.9, "box": {}}] for image in images]
+
+    monkeypatch.setattr(object_detection, "get_object_detector", lambda: detector)
+    images = [Image.new('RGB', size) for size in [(512, 768), (768, 512), (512, 768)]]
+    outputs = object_detection._detect_batch(images, [None] * 3)
+    assert [output[0]["label"] for output in outputs] == ["512x768", "768x512", "512x768"]
+    assert sorted(calls) == [1, 2]
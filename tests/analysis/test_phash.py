@@ -0,0 +1,43 @@
+import io
+import random
+
+import numpy as np
+from PIL import Image
+
+from app.analysis.phash import HammingIndex, hamming_distance, perceptual_hash
+
+
+def _painting(seed):
+    # Smooth random structure, like a photographed painting rather than pixel noise
+    rng = np.random.default_rng(seed)
+    coarse = (rng.random((12, 16, 3)) * 255).astype(np.uint8)
+    return Image.fromarray(coarse).resize((640, 480), Image.BICUBIC)
+
+
+def test_perceptual_hash_survives_reencoding_and_resizing():
+    original = _painting(1)
+    buf = io.BytesIO()
+    original.resize((320, 240)).save(buf, format='JPEG', quality=50)
+    copy = Image.open(buf)
+
+    assert hamming_distance(perceptual_hash(original), perceptual_hash(copy)) <= 4
+    assert hamming_distance(perceptual_hash(original), perceptual_hash(_painting(2))) > 16
+
+
+def test_hamming_index_matches_brute_force():
+    rng = random.Random(0)
+    stored = [rng.getrandbits(64) for _ in range(2000)]
+    index = HammingIndex()
+    for position, value in enumerate(stored):
+        index.add(value, position)
+    assert len(index) == len(stored)
+
+    for radius in (0, 3, 6, 9):
+        # Queries near stored hashes, so every radius has matches
+        query = stored[radius] ^ (1 << radius) - 1
+        expected = sorted((hamming_distance(query, value), position)
+                          for position, value in enumerate(stored)
+                          if hamming_distance(query, value) <= radius)
+        found = sorted((distance, position) for distance, _, position in index.search(query, radius))
+        assert found == expected
+        assert found[0][0] == radius
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from app.analysis.pyramid import ImagePyramid, at_resolution, original_scale
+
+
+def test_levels_are_scaled_cached_and_shared():
+    pyramid = ImagePyramid(Image.new('RGB', (1600, 1200), color='blue'), original_size=(6400, 4800))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        levels = list(pool.map(pyramid.image, [384] * 4))
+    assert levels[0].size == (512, 384)
+    # Built once, handed to every concurrent caller
+    assert all(level is levels[0] for level in levels)
+
+    assert pyramid.image(224).size == (299, 224)
+    assert pyramid.array(224).shape == (224, 299, 3)
+    assert pyramid.array(224) is pyramid.array(224)
+
+    # Nothing is upscaled; None means the base
+    assert pyramid.image(2000) is pyramid.base
+    assert pyramid.image() is pyramid.base
+
+    assert original_scale(pyramid, levels[0]) == (12.5, 12.5)
+
+def test_plain_images_pass_through():
+    img = Image.new('RGB', (800, 600))
+    assert at_resolution(img, 224) is img
+    assert original_scale(img, img) == (1.0, 1.0)
+
+    base_array = np.zeros((600, 800, 3), dtype=np.uint8)
+    assert ImagePyramid(img, base_array).array() is base_array
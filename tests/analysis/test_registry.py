@@ -0,0 +1,89 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import torch
+
+from app.analysis.registry import ModelRegistry, model_bytes
+
+
+def _linear(n):
+    # n x n float32 weights plus bias
+    return torch.nn.Linear(n, n)
+
+def test_concurrent_first_requests_load_once():
+    loads = []
+
+    def loader():
+        loads.append(threading.current_thread())
+        time.sleep(0.05)
+        return _linear(4)
+
+    registry = ModelRegistry(budget_bytes=0)
+    registry.register("m", loader)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        models = list(pool.map(lambda _: registry.get("m"), range(8)))
+
+    assert len(loads) == 1
+    assert all(m is models[0] for m in models)
+    stats = registry.stats()["models"]["m"]
+    assert stats["state"] == "ready"
+    assert stats["loads"] == 1
+    assert stats["load_seconds"] >= 0.05
+    assert stats["memory_bytes"] == (4 * 4 + 4) * 4
+
+def test_budget_evicts_least_recently_used_idle_model():
+    size = model_bytes(_linear(16))
+    registry = ModelRegistry(budget_bytes=2 * size)
+    for name in ("a", "b", "c"):
+        registry.register(name, lambda: _linear(16))
+
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")  # b is now the least recently used
+    registry.get("c")
+
+    assert registry.state("a") == "ready"
+    assert registry.state("b") == "unloaded"
+    assert registry.state("c") == "ready"
+    assert registry.stats()["resident_bytes"] == 2 * size
+
+    # A model in use is never evicted, even if it is the oldest
+    with registry.in_use("a"):
+        registry.get("c")
+        registry.get("b")
+        assert registry.state("a") == "ready"
+        assert registry.state("c") == "unloaded"
+
+    # Evicted models reload on demand
+    registry.get("c")
+    assert registry.stats()["models"]["c"]["loads"] == 2
+
+def test_failed_load_is_reported_and_retried():
+    attempts = []
+
+    def loader():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("download failed")
+        return _linear(2)
+
+    registry = ModelRegistry(budget_bytes=0)
+    registry.register("m", loader)
+    with pytest.raises(RuntimeError):
+        registry.get("m")
+    assert registry.state("m") == "failed"
+    assert registry.stats()["models"]["m"]["error"] == "download failed"
+
+    registry.get("m")
+    assert registry.state("m") == "ready"
+
+def test_model_bytes_of_model_pairs_and_pipelines():
+    model = _linear(8)
+    pipeline_like = type("Pipeline", (), {"model": model})()
+    expected = (8 * 8 + 8) * 4
+    assert model_bytes(model) == expected
+    assert model_bytes(("processor", model)) == expected
+    assert model_bytes(pipeline_like) == expected
+    assert model_bytes(object()) == 0
@@ -0,0 +1,20 @@
+# generate_summary is imported before conftest swaps in its mock
+from app.analysis import summarizer
+from app.analysis.summarizer import generate_summary
+
+
+def test_summary_from_batched_pipeline_output(monkeypatch):
+    prompts = []
+
+    def text2text(inputs, **kwargs):
+        # The real text2text pipeline: a list of prompts yields a flat list of dicts
+        prompts.extend(inputs)
+        return [{"generated_text": f"Output: Summary {i}."} for i, _ in enumerate(inputs)]
+
+    monkeypatch.setattr(summarizer, "get_summarizer", lambda: text2text)
+    summary = generate_summary({"ai_probability": 0.2, "art_medium_analysis": {"medium": "Oil", "confidence": 0.9}})
+    assert summary == "Summary 0."
+    assert len(prompts) == 1 and "20.0% AI probability" in prompts[0]
+
+    outputs = summarizer._generate_batch(["a", "b"], [None, None])
+    assert outputs == [[{"generated_text": "Output: Summary 0."}], [{"generated_text": "Output: Summary 1."}]]
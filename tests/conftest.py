@@ -4,6 +4,7 @@ import os
 import pytest
 import duckdb
 import contextlib
+import threading
 from unittest.mock import MagicMock
 
 # Add project root to path so we can import modules
@@ -28,15 +29,25 @@ def run_async(coro):
         return future.result()
 
 @pytest.fixture(scope="session", autouse=True)
-def patch_app_settings():
+def patch_app_settings(tmp_path_factory):
     """
     Explicitly patch application settings for tests.
     """
+    import app.blobstore
     import app.main
     original_timeout = app.main.STEP_TIMEOUT
+    original_cpu_workers = app.main.CPU_POOL_WORKERS
+    original_blob_dir = app.blobstore.BLOB_STORE_DIR
     app.main.STEP_TIMEOUT = 2
+    # The mocked analysis functions below are closures and can't be sent to worker
+    # processes, so every step runs on the thread pool during tests.
+    app.main.CPU_POOL_WORKERS = 0
+    # Keep uploads out of the working tree
+    app.blobstore.BLOB_STORE_DIR = str(tmp_path_factory.mktemp("blobs"))
     yield
     app.main.STEP_TIMEOUT = original_timeout
+    app.main.CPU_POOL_WORKERS = original_cpu_workers
+    app.blobstore.BLOB_STORE_DIR = original_blob_dir
 
 @pytest.fixture(scope="session")
 def mock_db_connection():
@@ -57,10 +68,18 @@ def mock_db_connection():
             pass
 
     wrapper = DuckDBWrapper(con)
+    local = threading.local()
 
     @contextlib.contextmanager
     def mock_get_conn():
-        yield wrapper
+        # Like the app's kept connection: other threads (the executor, the database writer)
+        # get their own cursor on the shared database
+        if threading.current_thread() is threading.main_thread():
+            yield wrapper
+            return
+        if getattr(local, "cursor", None) is None:
+            local.cursor = DuckDBWrapper(con.cursor())
+        yield local.cursor
 
     # Manual patch BEFORE init_db()
     import app.database
@@ -82,6 +101,15 @@ def db_session(mock_db_connection):
     Cleans up the database before each test to ensure isolation.
     """
     mock_db_connection.execute("DELETE FROM image_stats")
+    mock_db_connection.execute("DELETE FROM result_cache")
+    mock_db_connection.execute("DELETE FROM step_cache")
+    mock_db_connection.execute("DELETE FROM task_spill")
+    mock_db_connection.execute("DELETE FROM stats_rollup")
+    # The perceptual hash index mirrors image_stats; reload it from the emptied table
+    import app.main
+    app.main.near_duplicate_index = None
+    # Deleting rows behind the app's back doesn't bump the stats version
+    app.main.stats_cache.clear()
     yield mock_db_connection
 
 
@@ -92,10 +120,16 @@ def mock_transformers():
     """
     import app.analysis.aiclassifiers
     mock_pipeline = MagicMock()
-    mock_pipeline.return_value = [
-        {'label': 'AI', 'score': 0.1},
-        {'label': 'Human', 'score': 0.9}
-    ]
+
+    def classify(inputs, **kwargs):
+        scores = [
+            {'label': 'AI', 'score': 0.1},
+            {'label': 'Human', 'score': 0.9}
+        ]
+        # Like the real pipeline, a list of images yields one result list per image
+        return [list(scores) for _ in inputs] if isinstance(inputs, list) else scores
+
+    mock_pipeline.side_effect = classify
     
     def mock_get_pipeline(*args, **kwargs):
         return mock_pipeline
@@ -162,7 +196,7 @@ def mock_analysis_functions():
         time.sleep(mock_control.get_delay("fractal"))
         return mock_control.get_return("fractal_stats", {"fd_default": 2.5, "fd_small": 2.1, "fd_large": 2.8})
 
-    def mock_histogram(np_img):
+    def mock_histogram(np_img, pixel_count=None):
         mock_control.trigger_error("histogram")
         time.sleep(mock_control.get_delay("histogram"))
         return {"histogram_r": [10]*256, "histogram_g": [20]*256, "histogram_b": [30]*256}
@@ -199,7 +233,7 @@ def mock_analysis_functions():
         'detect_ai': app.main.detect_ai,
         'compute_fractal_stats': app.main.compute_fractal_stats,
         'compute_histogram': app.main.compute_histogram,
-        'extract_metadata': app.main.extract_metadata,
+        'extract_metadata_from_bytes': app.main.extract_metadata_from_bytes,
         'analyze_art_medium': app.main.analyze_art_medium,
         'detect_objects': app.main.detect_objects,
         'generate_summary': app.main.generate_summary
@@ -230,7 +264,8 @@ def mock_analysis_functions():
     app.main.detect_ai = app.analysis.detect_ai = with_logging("ai", mock_detect_ai)
     app.main.compute_fractal_stats = app.analysis.compute_fractal_stats = with_logging("fractal", mock_fractal)
     app.main.compute_histogram = app.analysis.histogram.compute_histogram = with_logging("histogram", mock_histogram)
-    app.main.extract_metadata = app.analysis.extract_metadata = with_logging("metadata", mock_metadata)
+    app.main.extract_metadata_from_bytes = app.analysis.extract_metadata_from_bytes = with_logging(
+        "metadata", mock_metadata)
     app.main.analyze_art_medium = app.analysis.analyze_art_medium = with_logging("art_medium", mock_art_medium)
     app.main.detect_objects = app.analysis.detect_objects = with_logging("object_detection", mock_detect_objects)
     
@@ -243,6 +278,7 @@ def mock_analysis_functions():
     import app.analysis.object_detection
     app.main.warmup_classifier = app.analysis.aiclassifiers.warmup_classifier = lambda: None
     app.main.warmup_object_detector = app.analysis.object_detection.warmup_object_detector = lambda: None
+    app.main.warmup_clip = app.main.warmup_dinov2 = lambda: None
 
     yield
 
@@ -251,7 +287,7 @@ def mock_analysis_functions():
     app.main.detect_ai = originals['detect_ai']
     app.main.compute_fractal_stats = originals['compute_fractal_stats']
     app.main.compute_histogram = originals['compute_histogram']
-    app.main.extract_metadata = originals['extract_metadata']
+    app.main.extract_metadata_from_bytes = originals['extract_metadata_from_bytes']
     app.main.analyze_art_medium = originals['analyze_art_medium']
     app.main.detect_objects = originals['detect_objects']
 
@@ -0,0 +1,45 @@
+import asyncio
+
+from app.admission import AdmissionControl
+
+
+def test_runs_up_to_the_limit_and_queues_the_rest_in_order():
+    now = [0.0]
+    admission = AdmissionControl(max_running=2, max_waiting=2, estimate_seconds=10.0, clock=lambda: now[0])
+
+    async def run():
+        assert admission.enqueue("a") and admission.enqueue("b")
+        assert not admission.enqueue("c") and not admission.enqueue("d")
+        assert admission.full()
+        assert list(admission.waiting) == ["c", "d"]
+        assert admission.estimated_wait(1) == admission.estimated_wait(2) == 10.0
+        assert admission.estimated_wait(3) == 20.0
+
+        waiting = asyncio.create_task(admission.admit("c"))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        now[0] = 20.0
+        admission.release("a")
+        await waiting
+        assert set(admission.running) == {"b", "c"} and list(admission.waiting) == ["d"]
+        # Moving average of the completed runs
+        assert admission.average_seconds == 12.0
+
+        # Abandoned while waiting: its place goes, and the wait estimate is unchanged
+        admission.release("d", completed=False)
+        assert not admission.waiting and not admission.full()
+        admission.release("b", completed=False)
+        assert admission.average_seconds == 12.0
+        assert admission.retry_after() == 12
+
+    asyncio.run(run())
+    assert admission.stats()["admitted"] == 3 and admission.stats()["queued"] == 2
+
+
+def test_zero_disables_the_limits():
+    async def run():
+        admission = AdmissionControl(max_running=0, max_waiting=0)
+        assert all(admission.enqueue(str(i)) for i in range(50))
+        assert not admission.full()
+
+    asyncio.run(run())
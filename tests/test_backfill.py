@@ -0,0 +1,114 @@
+import io
+import json
+
+from PIL import Image
+
+import app.blobstore
+from app.analysis import STEP_VERSIONS, step_version
+from app.backfill import STEP_RUNNERS, backfill
+from app.blobstore import blob_path, content_hash, get_blob, put_blob
+from app.database import get_step_result, save_stats
+
+
+def test_blob_store_is_content_addressed(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.blobstore, "BLOB_STORE_DIR", str(tmp_path))
+
+    digest = put_blob(b"image bytes")
+    assert digest == content_hash(b"image bytes")
+    assert blob_path(digest).startswith(str(tmp_path / digest[:2]))
+    # Storing the same content again keeps the one copy
+    assert put_blob(b"image bytes", digest) == digest
+    assert get_blob(digest) == b"image bytes"
+    assert get_blob(content_hash(b"other")) is None
+
+    monkeypatch.setattr(app.blobstore, "BLOB_STORE_DIR", "")
+    assert put_blob(b"image bytes") is None
+    assert get_blob(digest) is None
+
+
+def _png(color):
+    buf = io.BytesIO()
+    Image.new('RGB', (20, 20), color=color).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def _stored_image(content, store_blob=True):
+    digest = put_blob(content) if store_blob else content_hash(content)
+    stats = {
+        "width": 20, "height": 20, "mean_color": [1.0, 2.0, 3.0],
+        "ai_probability": 0.2, "fd_default": 2.4, "fd_small": 2.2, "fd_large": 2.6,
+        "metadata_analysis": {"tags": {}}, "art_medium_analysis": {"medium": "Oil"},
+        "object_detection": [{"label": "cat"}], "summary": "Old summary",
+    }
+    versions = {step: step_version(step) for step in STEP_RUNNERS}
+    return save_stats("img.png", None, stats, digest, versions), digest
+
+
+def test_backfill_reruns_only_changed_steps(mock_db_connection, monkeypatch):
+    calls = []
+
+    def counting(name, result):
+        def func(*args):
+            calls.append(name)
+            return result
+        return func
+
+    monkeypatch.setattr("app.backfill.detect_ai", counting("ai", 0.9))
+    monkeypatch.setattr("app.backfill.detect_objects", counting("objects", [{"label": "dog"}]))
+    monkeypatch.setattr("app.backfill.generate_summary", counting("summary", "New summary"))
+
+    first_id, _ = _stored_image(_png('red'))
+    second_id, _ = _stored_image(_png('red'))
+    missing_id, _ = _stored_image(_png('blue'), store_blob=False)
+    monkeypatch.setitem(STEP_VERSIONS, "Object Detection", "2")
+
+    assert backfill(dry_run=True) == {"updated": 3, "skipped": 0, "current": 0}
+    assert calls == []
+
+    counts = backfill()
+    assert counts == {"updated": 2, "skipped": 1, "current": 0}
+    # The second upload of the same content reuses the step cache
+    assert calls == ["objects", "summary"]
+
+    rows = mock_db_connection.execute(
+        "SELECT id, object_detection, summary, ai_probability, step_versions FROM image_stats").fetchall()
+    by_id = {row[0]: row[1:] for row in rows}
+    for image_id in (first_id, second_id):
+        detection, summary, ai_probability, versions = by_id[image_id]
+        assert json.loads(detection) == [{"label": "dog"}]
+        assert summary == "New summary"
+        assert ai_probability == 0.2
+        assert json.loads(versions)["Object Detection"] == step_version("Object Detection")
+    assert by_id[missing_id][1] == "Old summary"
+
+    assert backfill() == {"updated": 0, "skipped": 1, "current": 2}
+    assert calls == ["objects", "summary"]
+
+def test_backfill_leaves_a_failed_step_at_its_old_version(mock_db_connection, monkeypatch):
+    outputs = {"objects": None}
+    calls = []
+
+    def detect(*args):
+        calls.append("objects")
+        return outputs["objects"]
+
+    monkeypatch.setattr("app.backfill.detect_objects", detect)
+    monkeypatch.setattr("app.backfill.generate_summary", lambda data: calls.append("summary") or "New summary")
+
+    image_id, digest = _stored_image(_png('green'))
+    old_version = step_version("Object Detection")
+    monkeypatch.setitem(STEP_VERSIONS, "Object Detection", "2")
+
+    backfill()
+    # Neither the failure nor the summary built on it are kept
+    assert calls == ["objects"]
+    assert get_step_result(digest, "Object Detection", step_version("Object Detection")) is None
+    detection, summary, versions = mock_db_connection.execute(
+        "SELECT object_detection, summary, step_versions FROM image_stats WHERE id = ?", (image_id,)).fetchone()
+    assert json.loads(detection) == [{"label": "cat"}] and summary == "Old summary"
+    assert json.loads(versions)["Object Detection"] == old_version
+
+    # The next run retries it
+    outputs["objects"] = [{"label": "dog"}]
+    assert backfill() == {"updated": 1, "skipped": 0, "current": 0}
+    assert calls == ["objects", "objects", "summary"]
@@ -33,3 +33,241 @@ def test_multiple_images_aggregation(mock_db_connection):
     assert agg['avg_width'] == 150
     assert agg['avg_height'] == 150
     assert agg['avg_color'] == [50.0, 50.0, 50.0]
+
+def test_result_cache_versions_ttl_and_size(mock_db_connection):
+    from app.database import (
+        evict_cached_results,
+        get_cached_result,
+        get_result_cache_size,
+        put_cached_result,
+    )
+
+    result = {"id": "abc", "url": None, "stats": {"width": 1}}
+    put_cached_result("hash1", "v1", result)
+    assert get_cached_result("hash1", "v1") == result
+    # A different analyzer version is a miss
+    assert get_cached_result("hash1", "v2") is None
+
+    # Expired entries are neither returned nor kept
+    mock_db_connection.execute(
+        "UPDATE result_cache SET created_at = current_timestamp - INTERVAL 2 HOUR WHERE content_hash = 'hash1'")
+    assert get_cached_result("hash1", "v1", ttl_seconds=3600) is None
+    assert evict_cached_results(ttl_seconds=3600) == 1
+
+    # Beyond max_entries, the least recently used go first
+    for name in ("a", "b", "c"):
+        put_cached_result(name, "v1", result)
+    mock_db_connection.execute(
+        "UPDATE result_cache SET created_at = current_timestamp - INTERVAL 1 MINUTE WHERE content_hash IN ('a', 'b')")
+    get_cached_result("a", "v1")
+    assert evict_cached_results(max_entries=2) == 1
+    assert get_cached_result("b", "v1") is None
+    assert get_result_cache_size()["entries"] == 2
+
+def test_write_behind_batches_queued_writes_and_isolates_failures(mock_db_connection, monkeypatch):
+    import contextlib
+    import threading
+
+    import app.database
+    from app.database import WriteBehind
+
+    gate = threading.Event()
+    patched = app.database.get_db_connection
+
+    @contextlib.contextmanager
+    def gated_connection():
+        # Holds the writer on its first batch while the rest queue up
+        gate.wait()
+        with patched() as con:
+            yield con
+
+    monkeypatch.setattr(app.database, "get_db_connection", gated_connection)
+    writer = WriteBehind()
+    monkeypatch.setattr(app.database, "writer", writer)
+    stats = {"width": 10, "height": 10, "mean_color": [1, 2, 3]}
+    first = app.database.queue_stats("0.png", None, stats)[1]
+    saved = [app.database.queue_stats(f"{i}.png", None, stats)[1] for i in range(1, 40)]
+    failing = writer.submit([("INSERT INTO missing_table VALUES (?)", (1,))])
+    gate.set()
+
+    first.result(timeout=10)
+    for future in saved:
+        future.result(timeout=10)
+    assert isinstance(failing.exception(timeout=10), Exception)
+    assert mock_db_connection.execute("SELECT COUNT(*) FROM image_stats").fetchone()[0] == 40
+    # Batched, with the bad write split off in halves rather than one by one
+    assert writer.stats()["writes"] == 40 and writer.stats()["failed"] == 1
+    assert writer.stats()["batches"] < 20 and writer.pending() == 0
+
+def test_cache_lookups_see_queued_entries_without_waiting_for_the_writer(mock_db_connection, monkeypatch):
+    import contextlib
+    import threading
+
+    import app.database
+    from app.database import (
+        WriteBehind,
+        get_cached_result,
+        get_step_result,
+        put_cached_result,
+        put_step_result,
+    )
+
+    gate = threading.Event()
+    patched = app.database.get_db_connection
+    writing = threading.local()
+
+    @contextlib.contextmanager
+    def gated_connection():
+        # Only the writer thread is held; lookups must not wait for it
+        if threading.current_thread().name == "database-writer" and not getattr(writing, "released", False):
+            gate.wait(timeout=10)
+            writing.released = True
+        with patched() as con:
+            yield con
+
+    monkeypatch.setattr(app.database, "get_db_connection", gated_connection)
+    monkeypatch.setattr(app.database, "writer", WriteBehind())
+    put_step_result("hash", "AI Classifier", "1", {"ai_probability": 0.3}, wait=False)
+    put_cached_result("hash", "v1", {"summary": "queued"}, wait=False)
+    assert get_step_result("hash", "AI Classifier", "1") == {"ai_probability": 0.3}
+    assert get_step_result("hash", "AI Classifier", "2") is None
+    assert get_cached_result("hash", "v1") == {"summary": "queued"}
+
+    gate.set()
+    app.database.writer.flush()
+    assert app.database.queued_entry(("result_cache", "hash", "v1")) is None
+    assert get_cached_result("hash", "v1") == {"summary": "queued"}
+
+def test_connection_manager_keeps_one_connection_with_a_cursor_per_thread(tmp_path):
+    import threading
+
+    from app.database import ConnectionManager
+
+    manager = ConnectionManager()
+    path = str(tmp_path / "kept.db")
+    cursor = manager.cursor(path)
+    assert manager.cursor(path) is cursor
+    cursor.execute("CREATE TABLE t (x INTEGER)")
+
+    others = []
+    thread = threading.Thread(target=lambda: others.append(manager.cursor(path)))
+    thread.start()
+    thread.join()
+    assert others[0] is not cursor
+    others[0].execute("INSERT INTO t VALUES (1)")
+    assert cursor.execute("SELECT x FROM t").fetchall() == [(1,)]
+
+    manager.close()
+    assert manager.cursor(path).execute("SELECT COUNT(*) FROM t").fetchone()[0] == 1
+    manager.close()
+
+def test_aggregates_come_from_typed_columns_filled_on_write_and_by_migration(mock_db_connection):
+    from app.database import (
+        migrate_typed_columns,
+        rebuild_stats_rollup,
+        update_image_stats,
+    )
+
+    def stats(ai, fd, medium, tags):
+        return {"width": 10, "height": 10, "mean_color": [0, 0, 0], "ai_probability": ai, "fd_default": fd,
+                "art_medium_analysis": {"medium": medium, "confidence": 0.9} if medium else None,
+                "metadata_analysis": {"tags": tags}}
+
+    save_stats("a.png", None, stats(0.9, 2.5, "Oil", {"Software": "Gen", "Camera": "None"}))
+    save_stats("b.png", None, stats(0.8, 1.7, "Oil", {"Software": "Gen"}))
+    human_id = save_stats("c.png", None, stats(0.1, 3.4, "Watercolor", {"Camera": "X100"}))
+    save_stats("d.png", None, stats(0.2, None, None, {}))
+    # A row stored before the typed columns existed
+    mock_db_connection.execute("""
+        INSERT INTO image_stats (id, width, height, ai_probability, fd_default, art_medium_analysis, metadata_analysis)
+        VALUES ('legacy', 10, 10, 0.7, 2.519, '{"medium": "Oil", "confidence": 0.5}', '{"tags": {"Software": "Gen"}}')
+    """)
+    migrate_typed_columns(mock_db_connection)
+    rebuild_stats_rollup(mock_db_connection)
+    assert mock_db_connection.execute(
+        "SELECT medium, medium_confidence, metadata_tags FROM image_stats WHERE id = 'legacy'"
+    ).fetchone() == ("Oil", 0.5, {"Software": "Gen"})
+
+    stats_now = get_aggregate_stats()
+    assert stats_now["ai_metadata"] == [{"label": "Software: Gen", "count": 3}, {"label": "Camera: None", "count": 1}]
+    assert stats_now["human_metadata"] == [{"label": "Camera: X100", "count": 1}]
+    assert stats_now["art_mediums"] == [{"label": "Oil", "count": 3}, {"label": "Watercolor", "count": 1}]
+    histogram = stats_now["fractal_dist"]
+    assert len(histogram) == 50 and histogram[0]["label"] == "2.00" and histogram[49]["label"] == "2.98"
+    # 1.7 and 3.4 are clipped into the end bins; 2.5 and 2.519 share a bin
+    assert [(bin["label"], bin["count"]) for bin in histogram if bin["count"]] == [
+        ("2.00", 1), ("2.50", 2), ("2.98", 1)]
+
+    # Rewritten JSON keeps its typed copies in step
+    update_image_stats(human_id, {"art_medium_analysis": {"medium": "Oil", "confidence": 0.4},
+                                  "metadata_analysis": {"tags": {}}})
+    stats_now = get_aggregate_stats()
+    assert stats_now["art_mediums"] == [{"label": "Oil", "count": 4}]
+    assert stats_now["human_metadata"] == []
+
+def test_stats_rollup_is_maintained_on_write_and_answers_time_windows(mock_db_connection):
+    from datetime import datetime
+
+    from app.database import rebuild_stats_rollup
+
+    def stats(ai, fd, medium):
+        return {"width": 100, "height": 50, "mean_color": [10, 20, 30], "ai_probability": ai, "fd_default": fd,
+                "art_medium_analysis": {"medium": medium, "confidence": 0.8},
+                "metadata_analysis": {"tags": {"Software": "Gen" if ai >= 0.5 else "Camera"}}}
+
+    save_stats("new.png", None, stats(0.9, 2.31, "Oil"))
+    old_id = save_stats("old.png", None, stats(0.1, 2.75, "Ink"))
+    rollup = "SELECT * FROM stats_rollup WHERE value <> 0 ORDER BY ALL"
+    incremental = mock_db_connection.execute(rollup).fetchall()
+    rebuild_stats_rollup(mock_db_connection)
+    # Kept up to date row by row, it matches a rebuild from image_stats
+    assert mock_db_connection.execute(rollup).fetchall() == incremental
+
+    mock_db_connection.execute("UPDATE image_stats SET upload_time = TIMESTAMP '2020-01-01 10:30:00' WHERE id = ?",
+                               (old_id,))
+    rebuild_stats_rollup(mock_db_connection)
+    assert get_aggregate_stats()["total_images"] == 2
+    # Hourly buckets: the window's start is rounded down to 10:00
+    window = get_aggregate_stats(datetime(2020, 1, 1, 10, 45), datetime(2020, 1, 2))
+    assert window["total_images"] == 1
+    assert window["art_mediums"] == [{"label": "Ink", "count": 1}]
+    assert window["human_metadata"] == [{"label": "Software: Camera", "count": 1}] and window["ai_metadata"] == []
+    assert window["avg_width"] == 100 and window["avg_color"] == [10, 20, 30]
+    assert [bin["label"] for bin in window["fractal_dist"] if bin["count"]] == ["2.74"]
+    assert get_aggregate_stats(end=datetime(2020, 1, 1, 10))["total_images"] == 0
+    assert get_aggregate_stats(start=datetime(2021, 1, 1))["art_mediums"] == [{"label": "Oil", "count": 1}]
+
+def test_history_pages_by_upload_time_with_filters_and_projection(mock_db_connection):
+    from app.database import get_history
+
+    def stats(ai, medium):
+        return {"width": 10, "height": 10, "mean_color": [0, 0, 0], "ai_probability": ai,
+                "art_medium_analysis": {"medium": medium, "confidence": 0.9}}
+
+    ids = [save_stats(f"{name}.png", None, stats(ai, medium))
+           for name, ai, medium in [("a1", 0.9, "Oil"), ("a2", 0.2, "Ink"), ("b1", 0.8, "Oil"), ("a3", 0.7, "Oil")]]
+    # Two uploads in the same instant are ordered by id
+    mock_db_connection.execute("UPDATE image_stats SET upload_time = TIMESTAMP '2024-05-01 12:00:00' WHERE id IN (?, ?)",
+                               (ids[1], ids[2]))
+
+    rows, after = [], None
+    while True:
+        page = get_history(3, after)
+        rows += page[:2]
+        if len(page) < 3:
+            break
+        after = (page[1]["upload_time"], page[1]["id"])
+    expected = [ids[3], ids[0], max(ids[1], ids[2]), min(ids[1], ids[2])]
+    assert [row["id"] for row in rows] == expected
+    assert "art_medium_analysis" not in rows[0] and rows[0]["medium"] == "Oil"
+
+    filtered = get_history(10, min_ai_probability=0.75, medium="Oil", filename_prefix="a",
+                           columns=("filename", "art_medium_analysis"))
+    assert [row["filename"] for row in filtered] == ["a1.png"]
+    assert filtered[0]["art_medium_analysis"] == {"medium": "Oil", "confidence": 0.9}
+    assert set(filtered[0]) == {"id", "upload_time", "filename", "art_medium_analysis"}
+    try:
+        get_history(10, columns=("phash",))
+        assert False, "unknown column accepted"
+    except ValueError:
+        pass
@@ -15,7 +15,7 @@ def test_image_stats_schema_has_all_columns(tmp_path, monkeypatch):
         expected_columns = [
             'id', 'filename', 'upload_time', 'width', 'height',
             'mean_color_r', 'mean_color_g', 'mean_color_b', 'url',
-            'metadata_analysis'
+            'metadata_analysis', 'fd_default', 'fd_small', 'fd_large'
         ]
         
         for col in expected_columns:
@@ -50,3 +50,24 @@ def test_save_and_retrieve_with_metadata(tmp_path, monkeypatch):
         metadata = json.loads(row[0])
         assert metadata['software'] == 'TestSoft'
         assert metadata['tags']['key'] == 'val'
+
+def test_init_db_migrates_existing_table(monkeypatch):
+    import contextlib
+
+    import duckdb
+
+    # A database created before the fractal scale bands existed
+    con = duckdb.connect(":memory:")
+    con.execute("CREATE TABLE image_stats (id VARCHAR, filename VARCHAR, fd_default DOUBLE)")
+
+    @contextlib.contextmanager
+    def legacy_conn():
+        yield con
+
+    monkeypatch.setattr(app.database, "get_db_connection", legacy_conn)
+    app.database.init_db()
+
+    columns = [row[1] for row in con.execute("PRAGMA table_info('image_stats')").fetchall()]
+    con.close()
+    assert 'fd_small' in columns
+    assert 'fd_large' in columns
@@ -0,0 +1,55 @@
+import time
+
+from app.jobqueue import JobQueue
+
+
+def test_claim_heartbeat_and_lease_expiry(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), max_attempts=2)
+    first = queue.enqueue("hash-1", "a.png")
+    second = queue.enqueue("hash-2", "b.png")
+
+    job = queue.claim("worker-a", lease_seconds=60)
+    assert job == {"id": first, "content_hash": "hash-1", "filename": "a.png", "attempts": 1}
+    assert queue.heartbeat(first, "worker-a", 60, {"status": "Preprocessing...", "progress": 5})
+    assert queue.get(first)["state"]["progress"] == 5
+    # Someone else's job
+    assert not queue.heartbeat(first, "worker-b", 60)
+
+    assert queue.claim("worker-b", lease_seconds=0)["id"] == second
+    time.sleep(0.01)
+    # worker-b's lease ran out: the job goes to the next worker, and worker-b is told to stop
+    assert queue.claim("worker-c", lease_seconds=60)["id"] == second
+    assert not queue.heartbeat(second, "worker-b", 60)
+    assert not queue.finish(second, "worker-b", "done", {"status": "Complete"})
+
+    assert queue.finish(first, "worker-a", "done", {"status": "Complete", "progress": 100})
+    assert queue.get(first) == {"status": "done", "attempts": 1, "state": {"status": "Complete", "progress": 100}}
+    assert queue.claim("worker-a", lease_seconds=60) is None
+    assert queue.stats()["running"] == 1 and queue.stats()["done"] == 1
+
+
+def test_cancel_and_max_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), max_attempts=2)
+    queued = queue.enqueue("hash-1", "a.png")
+    queue.cancel(queued)
+    assert queue.get(queued)["status"] == "cancelled"
+
+    running = queue.enqueue("hash-2", "b.png")
+    queue.claim("worker-a", lease_seconds=60)
+    queue.cancel(running)
+    # The worker hears about it at its next heartbeat
+    assert not queue.heartbeat(running, "worker-a", 60)
+    assert queue.finish(running, "worker-a", "cancelled", {"status": "Abandoned"})
+
+    crashing = queue.enqueue("hash-3", "c.png")
+    for attempt in (1, 2):
+        assert queue.claim(f"worker-{attempt}", lease_seconds=0)["attempts"] == attempt
+        time.sleep(0.01)
+    # Two workers died on it: it fails instead of being handed out again
+    assert queue.claim("worker-3", lease_seconds=60) is None
+    job = queue.get(crashing)
+    assert job["status"] == "failed"
+    assert job["state"]["status"] == "Error" and "2 attempts" in job["state"]["error"]
+
+    assert queue.purge(0) == 3
+    assert queue.stats()["failed"] == 0
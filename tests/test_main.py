@@ -24,7 +24,7 @@ def fast_analysis(monkeypatch):
     def mock_fractal(img):
         return {"fd_default": 1.0}
 
-    def mock_histogram(img):
+    def mock_histogram(img, pixel_count=None):
         return {"histogram_r": [0]*256, "histogram_g": [0]*256, "histogram_b": [0]*256}
 
     def mock_metadata(img):
@@ -40,10 +40,64 @@ def fast_analysis(monkeypatch):
     monkeypatch.setattr("app.main.detect_ai", mock_ai)
     monkeypatch.setattr("app.main.compute_fractal_stats", mock_fractal)
     monkeypatch.setattr("app.main.compute_histogram", mock_histogram)
-    monkeypatch.setattr("app.main.extract_metadata", mock_metadata)
+    monkeypatch.setattr("app.main.extract_metadata_from_bytes", mock_metadata)
     monkeypatch.setattr("app.main.analyze_art_medium", mock_art_medium)
     monkeypatch.setattr("app.main.generate_summary", mock_summary)
 
+def app_client():
+    # Each client is its own session (it keeps the session_id cookie it is given)
+    return AsyncClient(transport=ASGITransport(app=app), base_url="http://testserver")
+
+def png(color, size=(40, 30)) -> bytes:
+    buf = io.BytesIO()
+    Image.new('RGB', size, color=color).save(buf, format='PNG')
+    return buf.getvalue()
+
+def png_file(color, size=(40, 30), name=None) -> dict:
+    return {'file': (name or f'{color}.png', png(color, size), 'image/png')}
+
+async def upload_png(client, color, size=(40, 30), name=None) -> str:
+    """
+    Uploads a plain-colored PNG; returns its task id.
+    """
+    response = await client.post("/upload", files=png_file(color, size, name))
+    assert response.status_code == 200
+    return response.json()["task_id"]
+
+async def wait_for_status(client, task_id, statuses=("Complete",), attempts=300, interval=0.01) -> dict:
+    """
+    Polls /progress until the task reaches one of statuses; returns that progress.
+    """
+    for _ in range(attempts):
+        data = (await client.get(f"/progress/{task_id}")).json()
+        if data["status"] in statuses:
+            return data
+        await asyncio.sleep(interval)
+    pytest.fail(f"Task {task_id} never reached {' or '.join(statuses)}")
+
+def record_on_loop(monkeypatch, target, names) -> list:
+    """
+    Wraps the named functions of target (a module or object) to record the ones called on a
+    running event loop; returns that list.
+    """
+    on_loop = []
+
+    def record(name):
+        func = getattr(target, name)
+
+        def wrapper(*args):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(name)
+            except RuntimeError:
+                pass
+            return func(*args)
+        monkeypatch.setattr(target, name, wrapper)
+
+    for name in names:
+        record(name)
+    return on_loop
+
 def test_read_root():
     async def run():
         transport = ASGITransport(app=app)
@@ -63,6 +117,63 @@ def test_get_stats_empty(mock_db_connection):
             assert data['total_images'] == 0
     run_async(run())
 
+def test_stats_etag_and_not_modified(mock_db_connection):
+    from app.database import save_stats
+
+    async def run():
+        async with app_client() as client:
+            first = await client.get("/stats")
+            etag = first.headers["etag"]
+            assert first.headers["cache-control"] == "no-cache"
+
+            unchanged = await client.get("/stats", headers={"If-None-Match": f'"other", W/{etag}'})
+            assert unchanged.status_code == 304
+            assert unchanged.headers["etag"] == etag
+            assert unchanged.content == b""
+
+            # A stored analysis invalidates the cached stats right away
+            save_stats("a.png", None, {"width": 10, "height": 10, "mean_color": [1.0, 2.0, 3.0]})
+            changed = await client.get("/stats", headers={"If-None-Match": etag})
+            assert changed.status_code == 200
+            assert changed.json()["total_images"] == 1
+            assert changed.headers["etag"] != etag
+    run_async(run())
+
+def test_stats_cache_shared_by_threadpool_requests(mock_db_connection, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from datetime import datetime
+
+    import app.main as main_module
+
+    monkeypatch.setattr(main_module, "STATS_CACHE_MAX_ENTRIES", 4)
+    monkeypatch.setattr(main_module, "stats_cache_counters", {"hits": 0, "misses": 0, "not_modified": 0})
+    windows = [(datetime(2024, 1, day), None) for day in range(1, 9)]
+    # Like concurrent GET /stats requests, which FastAPI runs on its threadpool
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda window: main_module.cached_stats(*window), windows * 25))
+
+    stats = main_module.stats_cache_stats()
+    assert stats["hits"] + stats["misses"] == 200
+    assert stats["entries"] <= 4
+
+def test_history_cursor_pages(mock_db_connection):
+    from app.database import save_stats
+
+    for name in ("one", "two", "three"):
+        save_stats(f"{name}.png", None, {"width": 10, "height": 10, "mean_color": [1.0, 2.0, 3.0]})
+
+    async def run():
+        async with app_client() as client:
+            first = (await client.get("/history", params={"limit": 2, "fields": "filename"})).json()
+            assert [item["filename"] for item in first["items"]] == ["three.png", "two.png"]
+            assert set(first["items"][0]) == {"id", "upload_time", "filename"}
+            second = (await client.get("/history", params={"limit": 2, "cursor": first["next_cursor"]})).json()
+            assert [item["filename"] for item in second["items"]] == ["one.png"]
+            assert second["next_cursor"] is None
+            assert (await client.get("/history", params={"cursor": "not-a-cursor"})).status_code == 400
+            assert (await client.get("/history", params={"fields": "phash"})).status_code == 400
+    run_async(run())
+
 def test_upload_image_flow(mock_db_connection):
     async def run():
         transport = ASGITransport(app=app)
@@ -193,3 +304,543 @@ def test_task_abandonment_logic(mock_db_connection):
             stats_res = await client.get("/stats")
             assert stats_res.json()["total_images"] == 1
     run_async(run())
+
+def test_warmup_is_concurrent_and_gates_only_waiting_steps(monkeypatch):
+    import threading
+
+    import app.main as main_module
+    from app.analysis.registry import ModelRegistry
+
+    release_summarizer = threading.Event()
+    warmed = []
+    registry = ModelRegistry()
+    for name in ("ai_classifier", "summarizer", "object_detector", "clip", "dinov2"):
+        registry.register(name, object)
+
+    def warm(name, block=None):
+        def func():
+            if block is not None:
+                assert block.wait(timeout=5)
+            registry.get(name)
+            warmed.append(name)
+        return func
+
+    def fail():
+        raise RuntimeError("no weights")
+
+    monkeypatch.setattr(main_module, "model_registry", registry)
+    monkeypatch.setattr(main_module, "model_warmups", {})
+    monkeypatch.setattr(main_module, "warmup_status", {})
+    monkeypatch.setattr(main_module, "models_ready", False)
+    monkeypatch.setattr(main_module, "model_warmup_functions", lambda: {
+        "ai_classifier": warm("ai_classifier"),
+        "summarizer": warm("summarizer", release_summarizer),
+        "object_detector": warm("object_detector"),
+        "clip": warm("clip"),
+        "dinov2": fail,
+    })
+
+    async def run():
+        warmup = asyncio.create_task(main_module.warmup_models())
+        # The classifier step starts although the summarizer is still loading
+        await asyncio.wait_for(main_module.wait_for_models("AI Classifier"), timeout=2)
+        await asyncio.wait_for(main_module.wait_for_models("Object Detection"), timeout=2)
+        # A failed warmup doesn't block its step either; the step then loads lazily
+        await asyncio.wait_for(main_module.wait_for_models("Art Medium Analysis"), timeout=2)
+        summary_wait = asyncio.create_task(main_module.wait_for_models("Insight Summary"))
+        await asyncio.sleep(0.05)
+        assert not summary_wait.done()
+
+        async with app_client() as client:
+            data = (await client.get("/ready_models")).json()
+        assert data["status"] == "loading"
+        assert data["models"]["ai_classifier"]["state"] == "ready"
+        assert data["models"]["ai_classifier"]["warmup_seconds"] is not None
+        assert data["models"]["summarizer"]["state"] == "warming"
+        assert data["models"]["dinov2"]["state"] == "failed"
+        assert data["models"]["dinov2"]["error"] == "no weights"
+
+        release_summarizer.set()
+        await asyncio.wait_for(summary_wait, timeout=5)
+        await asyncio.wait_for(warmup, timeout=5)
+        # One model failed to warm up: not ready, and the probe says so
+        assert not main_module.models_ready
+        async with app_client() as client:
+            data = (await client.get("/ready_models")).json()
+        assert data["status"] == "failed"
+        assert data["models"]["summarizer"]["state"] == "ready"
+
+    run_async(run())
+    assert sorted(warmed) == ["ai_classifier", "clip", "object_detector", "summarizer"]
+
+def test_repeat_upload_served_from_result_cache(mock_db_connection, monkeypatch):
+    import app.main as main_module
+
+    calls = []
+
+    def counting_ai(img):
+        calls.append(1)
+        return 0.5
+
+    monkeypatch.setattr("app.main.detect_ai", counting_ai)
+    monkeypatch.setattr(main_module, "result_cache_counters", {"hits": 0, "misses": 0, "stores": 0, "evictions": 0})
+    on_loop = record_on_loop(monkeypatch, main_module, (
+        "hash_content", "get_cached_result", "evict_cached_results", "get_result_cache_size", "count_spilled_tasks"))
+
+    async def run():
+        async with app_client() as client:
+            first = await wait_for_status(client, await upload_png(client, 'green', name='same.png'))
+            assert not first["cached"]
+
+            # Same bytes again: complete on the first poll, no analyzer runs
+            second_id = await upload_png(client, 'green', name='same.png')
+            second = (await client.get(f"/progress/{second_id}")).json()
+            assert second["status"] == "Complete"
+            assert second["cached"] is True
+            assert second["result"] == first["result"]
+            assert second["completed_steps"] == first["steps"]
+
+            # The entry count is read from the table, which the writer fills in the background
+            main_module.db_writer.flush()
+            metrics = (await client.get("/metrics")).json()["result_cache"]
+            assert metrics["hits"] == 1
+            assert metrics["misses"] == 1
+            assert metrics["stores"] == 1
+            assert metrics["entries"] == 1
+
+    run_async(run())
+    assert len(calls) == 1
+    # Hashing and the result cache's DuckDB work run on the executor
+    assert on_loop == []
+
+def test_failed_step_is_not_cached(mock_db_connection, monkeypatch):
+    import app.main as main_module
+
+    scores = [None, 0.4]  # the classifier fails on the first upload
+
+    def flaky_ai(img):
+        return scores.pop(0)
+
+    monkeypatch.setattr("app.main.detect_ai", flaky_ai)
+    monkeypatch.setattr(main_module, "step_cache_counters", {"hits": 0, "misses": 0, "stores": 0})
+
+    async def run():
+        results = []
+        async with app_client() as client:
+            for _ in range(2):
+                data = await wait_for_status(client, await upload_png(client, 'olive', name='same.png'))
+                assert not data["cached"]
+                results.append(data["result"]["stats"]["ai_probability"])
+        return results
+
+    # The second upload reruns the classifier instead of getting the failed result back
+    assert run_async(run()) == [None, 0.4]
+    assert scores == []
+
+def test_concurrent_identical_uploads_share_one_analysis(mock_db_connection, monkeypatch):
+    import threading
+
+    import app.main as main_module
+
+    release = threading.Event()
+    calls = []
+
+    def gated_ai(img):
+        calls.append(1)
+        assert release.wait(timeout=1.5)
+        return 0.5
+
+    monkeypatch.setattr("app.main.detect_ai", gated_ai)
+    monkeypatch.setattr(main_module, "flight_counters", {"started": 0, "coalesced": 0})
+    monkeypatch.setattr(main_module, "flights", {})
+
+    async def run():
+        # Separate clients are separate sessions
+        async with app_client() as a, app_client() as b, app_client() as c:
+            a_id = await upload_png(a, 'purple', name='shared.png')
+            b_id = await upload_png(b, 'purple', name='shared.png')
+            c_id = await upload_png(c, 'purple', name='shared.png')
+            assert len({a_id, b_id, c_id}) == 3
+
+            # A moves on to another file: only its subscription ends, the shared run continues
+            await upload_png(a, 'orange')
+            abandoned = await wait_for_status(a, a_id, ("Abandoned",))
+            assert "Saving to Database" not in abandoned["completed_steps"]
+
+            release.set()
+            b_done = await wait_for_status(b, b_id)
+            c_done = await wait_for_status(c, c_id)
+            assert b_done["result"] == c_done["result"]
+            assert (await a.get(f"/progress/{a_id}")).json()["status"] == "Abandoned"
+
+            flights = (await a.get("/metrics")).json()["flights"]
+            assert flights["coalesced"] == 2
+            assert flights["started"] == 2
+            # One record for the shared file, and one for A's other upload once it finishes
+            for _ in range(300):
+                if (await a.get("/stats")).json()["total_images"] == 2:
+                    break
+                await asyncio.sleep(0.01)
+            assert (await a.get("/stats")).json()["total_images"] == 2
+
+    run_async(run())
+    # One analyzer run for the three identical uploads, one for the other file
+    assert len(calls) == 2
+
+def test_shared_analysis_cancelled_when_every_subscriber_leaves(mock_db_connection, monkeypatch):
+    import hashlib
+    import threading
+
+    import app.main as main_module
+
+    release = threading.Event()
+
+    def gated_ai(img):
+        release.wait(timeout=1.5)
+        return 0.5
+
+    monkeypatch.setattr("app.main.detect_ai", gated_ai)
+    monkeypatch.setattr(main_module, "flights", {})
+
+    async def run():
+        async with app_client() as a, app_client() as b:
+            await upload_png(a, 'navy', name='shared.png')
+            await upload_png(b, 'navy', name='shared.png')
+            content_hash = hashlib.sha256(png('navy')).hexdigest()
+            assert len(main_module.flights[content_hash].subscribers) == 2
+            job = main_module.flights[content_hash].job
+
+            await upload_png(a, 'gold')
+            await asyncio.sleep(0.05)
+            assert not job.done()
+            await upload_png(b, 'teal')
+            await asyncio.sleep(0.05)
+            # The running classifier call can't be interrupted; let it return
+            release.set()
+            for _ in range(100):
+                if job.done():
+                    break
+                await asyncio.sleep(0.01)
+            assert job.cancelled()
+            assert content_hash not in main_module.flights
+
+    run_async(run())
+
+def test_changed_step_is_the_only_one_rerun(mock_db_connection, monkeypatch):
+    import app.main as main_module
+    from app.analysis import STEP_VERSIONS
+
+    calls = []
+
+    def counting(name, result):
+        def func(*args):
+            calls.append(name)
+            return result
+        return func
+
+    monkeypatch.setattr("app.main.detect_ai", counting("ai", 0.5))
+    monkeypatch.setattr("app.main.detect_objects", counting("objects", []))
+    monkeypatch.setattr("app.main.generate_summary", counting("summary", "Mock summary"))
+    lookups_on_loop = record_on_loop(monkeypatch, main_module, ("get_step_result",))
+
+    async def run():
+        async with app_client() as client:
+            for attempt in range(2):
+                if attempt:
+                    # A new object detector: the full-result cache misses, the other steps don't
+                    monkeypatch.setitem(STEP_VERSIONS, "Object Detection", "2")
+                data = await wait_for_status(client, await upload_png(client, 'teal', name='same.png'))
+                assert not data["cached"]
+
+    monkeypatch.setattr(main_module, "step_cache_counters", {"hits": 0, "misses": 0, "stores": 0})
+    run_async(run())
+    # The summary reads the detections, so it reruns with them
+    assert calls == ["ai", "objects", "summary", "objects", "summary"]
+    assert main_module.step_cache_counters["hits"] == 5
+    # Step cache reads run on the executor, not the event loop
+    assert lookups_on_loop == []
+
+def test_near_duplicate_upload_is_flagged_and_reuses_model_steps(mock_db_connection, monkeypatch):
+    import app.main as main_module
+
+    calls = []
+
+    def counting(name, result):
+        def func(*args):
+            calls.append(name)
+            return result
+        return func
+
+    box = {"xmin": 10.0, "ymin": 20.0, "xmax": 90.0, "ymax": 60.0}
+    monkeypatch.setattr("app.main.detect_ai", counting("ai", 0.5))
+    monkeypatch.setattr("app.main.detect_objects", counting("objects", [{"label": "cat", "score": 0.9, "box": box}]))
+    monkeypatch.setattr(main_module, "NEAR_DUPLICATE_REUSE", True)
+
+    rng = np.random.default_rng(3)
+    painting = Image.fromarray((rng.random((12, 16, 3)) * 255).astype(np.uint8)).resize((200, 100), Image.BICUBIC)
+    original, copy = io.BytesIO(), io.BytesIO()
+    painting.save(original, format='PNG')
+    painting.resize((100, 50)).save(copy, format='JPEG', quality=60)
+
+    async def analyze(client, content):
+        task_id = (await client.post("/upload", files={'file': ('p.png', content, 'image/png')})).json()["task_id"]
+        return task_id, (await wait_for_status(client, task_id))["result"]
+
+    async def run():
+        async with app_client() as client:
+            first_id, first = await analyze(client, original.getvalue())
+            assert first["stats"]["near_duplicate"] is None
+            _, second = await analyze(client, copy.getvalue())
+            assert second["stats"]["near_duplicate"]["id"] == first["id"]
+            assert second["stats"]["near_duplicate"]["distance"] <= main_module.NEAR_DUPLICATE_DISTANCE
+            # Boxes come from the original, scaled to the copy's size
+            assert second["stats"]["object_detection"][0]["box"] == {"xmin": 5.0, "ymin": 10.0, "xmax": 45.0, "ymax": 30.0}
+            # ...leaving the original's own result as it was
+            first = (await client.get(f"/progress/{first_id}")).json()["result"]
+            assert first["stats"]["object_detection"][0]["box"] == box
+
+    run_async(run())
+    assert calls == ["ai", "objects"]
+
+def test_near_duplicate_boxes_are_scaled_on_a_copy(monkeypatch):
+    import app.main as main_module
+
+    # A lookup answered from a write still queued returns the object the original's result holds
+    cached = [{"label": "cat", "box": {"xmin": 10.0, "ymin": 20.0, "xmax": 90.0, "ymax": 60.0}}, {"label": "sky"}]
+    monkeypatch.setattr(main_module, "NEAR_DUPLICATE_REUSE", True)
+    monkeypatch.setattr(main_module, "lookup_step_result", lambda content_hash, step: cached)
+    match = {"content_hash": "original", "width": 200, "height": 100}
+
+    scaled = main_module.reuse_near_duplicate_step(match, (100, 50), "Object Detection")
+    assert scaled == [{"label": "cat", "box": {"xmin": 5.0, "ymin": 10.0, "xmax": 45.0, "ymax": 30.0}}, {"label": "sky"}]
+    assert cached[0]["box"] == {"xmin": 10.0, "ymin": 20.0, "xmax": 90.0, "ymax": 60.0}
+
+def _apply_progress_event(state, event):
+    # Mirrors applyProgressEvent in app/static/js/modules/api.js
+    event = dict(event)
+    event.pop("version")
+    if event.pop("snapshot", False):
+        return event
+    state = dict(state)
+    for field, value in event.items():
+        if field in ("completed_steps", "timed_out_steps"):
+            state[field] = state.get(field, []) + value
+        elif field == "partial_results":
+            state[field] = {**(state.get(field) or {}), **value}
+        else:
+            state[field] = value
+    return state
+
+def test_progress_events_long_poll_and_stream(mock_db_connection, control):
+    import json
+
+    control.reset()
+    control.delays["object_detection"] = 0.3
+
+    async def run():
+        async with app_client() as client:
+            assert (await client.get("/progress/missing/events")).status_code == 404
+
+            task_id = await upload_png(client, 'navy', size=(60, 40), name='stream.png')
+
+            state, version, batches = {}, 0, []
+            for _ in range(100):
+                data = (await client.get(f"/progress/{task_id}/events",
+                                         params={"since": version, "timeout": 5})).json()
+                batches.append(data["events"])
+                for event in data["events"]:
+                    assert event["version"] == version + 1
+                    state = _apply_progress_event(state, event)
+                    version = event["version"]
+                if data["done"]:
+                    break
+            else:
+                pytest.fail("Task timed out")
+
+            # Only the first event is a whole status; step completions arrive as deltas
+            assert all("steps" not in event for batch in batches[1:] for event in batch)
+            # The slow step's completion is pushed on its own, after the others'
+            completions = [event["completed_steps"] for batch in batches for event in batch
+                           if "completed_steps" in event]
+            slow = next(steps for steps in completions if "Object Detection" in steps)
+            assert "Metadata Analysis" not in slow
+            final = (await client.get(f"/progress/{task_id}")).json()
+            assert state["status"] == "Complete"
+            assert state["completed_steps"] == final["completed_steps"]
+            assert state["partial_results"] == final["partial_results"]
+            assert state["result"]["id"] == final["result"]["id"]
+            assert state["result"]["stats"]["summary"] == final["result"]["stats"]["summary"]
+
+            response = await client.get(f"/progress/{task_id}/stream")
+            assert response.headers["content-type"].startswith("text/event-stream")
+            messages = [dict(line.split(": ", 1) for line in block.splitlines())
+                        for block in response.text.strip().split("\n\n")]
+            assert [message["event"] for message in messages] == ["progress"] * len(messages)
+            assert _apply_progress_event({}, json.loads(messages[-1]["data"]))["status"] == "Complete"
+
+            # Resuming after the last event the client saw: nothing left to send
+            response = await client.get(f"/progress/{task_id}/stream",
+                                        headers={"Last-Event-ID": messages[-1]["id"]})
+            assert response.text == ""
+
+    run_async(run())
+
+def test_evicted_task_still_answers_progress(mock_db_connection, monkeypatch):
+    import app.main as main_module
+    from app import taskstore
+
+    # Over budget as soon as anything is held: every finished task spills
+    monkeypatch.setattr(main_module.tasks, "max_bytes", 1)
+    monkeypatch.setitem(main_module.tasks.counters, "spill_reads", 0)
+    spill_reads_on_loop = record_on_loop(monkeypatch, taskstore, ("get_spilled_task",))
+
+    async def run():
+        async with app_client() as client:
+            task_id = await upload_png(client, 'olive', size=(30, 30), name='evicted.png')
+            for _ in range(200):
+                if not main_module.tasks.holds(task_id):
+                    break
+                await asyncio.sleep(0.01)
+            else:
+                pytest.fail("Task was not evicted")
+
+            data = (await client.get(f"/progress/{task_id}")).json()
+            assert data["status"] == "Complete"
+            assert data["result"]["stats"]["summary"] == "Mock summary"
+            # One read for the upload and one for the analysis state it follows, off the loop
+            assert main_module.tasks.counters["spill_reads"] == 2 and spill_reads_on_loop == []
+            events = (await client.get(f"/progress/{task_id}/events")).json()
+            assert events["done"] and events["events"][0]["status"] == "Complete"
+            assert task_id not in main_module.progress_streams
+
+            metrics = (await client.get("/metrics")).json()["tasks"]
+            assert metrics["entries"] == metrics["running"] == 0
+            assert metrics["evicted"] >= 2 and metrics["spilled"] >= 2
+
+    run_async(run())
+
+def test_job_queue_mode_runs_uploads_in_a_worker(mock_db_connection, monkeypatch, tmp_path):
+    import app.main as main_module
+    from app import worker
+    from app.jobqueue import JobQueue
+
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(main_module, "job_queue", queue)
+    monkeypatch.setattr(main_module, "JOB_POLL_SECONDS", 0.02)
+    monkeypatch.setattr(worker, "JOB_IDLE_SECONDS", 0.02)
+
+    async def run():
+        # The worker loop shares this process here; normally it is `python -m app.worker`
+        serving = asyncio.create_task(worker.serve(queue, "test-worker", 2))
+        try:
+            async with app_client() as client:
+                task_id = await upload_png(client, 'maroon', size=(50, 50), name='queued.png')
+                seen = set()
+                for _ in range(300):
+                    data = (await client.get(f"/progress/{task_id}")).json()
+                    seen.add(data["status"])
+                    if data["status"] in ("Complete", "Error"):
+                        break
+                    await asyncio.sleep(0.02)
+                else:
+                    pytest.fail("Task timed out")
+
+                assert data["status"] == "Complete", data.get("error")
+                assert data["result"]["stats"]["summary"] == "Mock summary"
+                assert "Queued..." in seen
+                assert mock_db_connection.execute("SELECT COUNT(*) FROM image_stats").fetchone()[0] == 1
+                stats = (await client.get("/metrics")).json()["job_queue"]
+                assert stats["done"] == 1 and stats["queued"] == stats["running"] == 0
+        finally:
+            serving.cancel()
+            await asyncio.gather(serving, return_exceptions=True)
+
+    run_async(run())
+
+def test_shared_task_state_across_processes(mock_db_connection, control, monkeypatch, tmp_path):
+    import json
+
+    import app.main as main_module
+    from app.taskstate import SQLiteTaskState
+
+    path = str(tmp_path / "task_state.sqlite")
+    backend = SQLiteTaskState(path)
+    monkeypatch.setattr(main_module.tasks, "backend", backend)
+    on_loop = record_on_loop(monkeypatch, backend, (
+        "publish", "lookup", "swap_session", "end_session", "request_cancel", "take_cancellations"))
+    monkeypatch.setattr(main_module, "SHARED_STATE_POLL_SECONDS", 0.02)
+    # Another `uvicorn --workers` process on the same file
+    other = SQLiteTaskState(path)
+    control.reset()
+    control.delays["object_detection"] = 2.0
+
+    async def run():
+        watcher = asyncio.create_task(main_module.watch_session_cancellations())
+        try:
+            async with app_client() as client:
+                # An upload the other process runs
+                other.publish("remote-state", {**main_module.new_task_state(), "status": "Preprocessing..."}, 2)
+                other.publish("remote-upload", {"shared_state": "remote-state"})
+                assert (await client.get("/progress/remote-upload")).json()["status"] == "Preprocessing..."
+                data = (await client.get("/progress/remote-upload/events", params={"timeout": 0})).json()
+                assert data["version"] == 2 and not data["done"]
+                assert data["events"][0]["snapshot"] and data["events"][0]["status"] == "Preprocessing..."
+                other.publish("remote-state", {**main_module.new_task_state(), "status": "Complete"}, 3)
+                response = await client.get("/progress/remote-upload/stream", params={"since": 2})
+                [message] = [dict(line.split(": ", 1) for line in block.splitlines())
+                             for block in response.text.strip().split("\n\n")]
+                assert message["id"] == "3" and json.loads(message["data"])["status"] == "Complete"
+
+                # This process's uploads are published for the others
+                task_id = await upload_png(client, 'teal', size=(40, 40), name='shared.png')
+                main_module.tasks.flush_backend()
+                state_key = other.lookup(task_id)[0]["shared_state"]
+                assert other.lookup(state_key) is not None
+
+                # The session's next upload lands on the other process, which asks this one to
+                # abandon the previous upload
+                assert other.swap_session(client.cookies["session_id"], "elsewhere") == task_id
+                other.request_cancel(task_id)
+                await wait_for_status(client, task_id, ("Abandoned",), attempts=100, interval=0.02)
+                main_module.tasks.flush_backend()
+                assert other.lookup(task_id)[0]["status"] == "Abandoned"
+        finally:
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+
+    run_async(run())
+    # The backend's SQLite calls block (up to its busy timeout): never on the event loop
+    assert on_loop == []
+
+def test_admission_control_queues_and_turns_away_uploads(mock_db_connection, control, monkeypatch):
+    import app.main as main_module
+    from app.admission import AdmissionControl
+
+    monkeypatch.setattr(main_module, "admission", AdmissionControl(max_running=1, max_waiting=1))
+    control.reset()
+    control.delays["object_detection"] = 0.3
+
+    async def run():
+        # One client per user: a second upload from the same session would abandon the first
+        async with app_client() as first, app_client() as second, app_client() as third:
+            running = await upload_png(first, "red", size=(30, 30))
+            queued = await upload_png(second, "green", size=(30, 30))
+            data = (await second.get(f"/progress/{queued}")).json()
+            assert data["status"] == "Queued..."
+            assert data["queue_position"] == 1 and data["estimated_wait_seconds"] > 0
+
+            response = await third.post("/upload", files=png_file("blue", size=(30, 30)))
+            assert response.status_code == 429
+            assert int(response.headers["Retry-After"]) >= 1
+            # Uploading bytes that are already being analyzed still works
+            await upload_png(third, "red", size=(30, 30))
+
+            data = await wait_for_status(second, queued, ("Complete", "Error"), interval=0.02)
+            assert data["status"] == "Complete" and data["queue_position"] is None
+            assert (await first.get(f"/progress/{running}")).json()["status"] == "Complete"
+
+            stats = (await first.get("/metrics")).json()["admission"]
+            assert stats["rejected"] == 1 and stats["queued"] == 1
+            assert stats["running"] == stats["waiting"] == 0
+
+    run_async(run())
@@ -0,0 +1,183 @@
+import asyncio
+import io
+import time
+
+import numpy as np
+import pytest
+from PIL import Image, PngImagePlugin
+
+import app.offload
+from app.analysis.analysis import (
+    compute_fractal_stats,
+    extract_metadata,
+    extract_metadata_from_bytes,
+    prepare_image,
+)
+from app.offload import (
+    attach_array,
+    create_cpu_pool,
+    job_stats,
+    run_in_cpu_pool,
+    share_array,
+)
+from tests.conftest import run_async
+
+
+def test_share_and_attach_roundtrip():
+    data = np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3)
+    shm, handle = share_array(data)
+    try:
+        peer, view = attach_array(handle)
+        assert view.dtype == np.uint8
+        assert np.array_equal(view, data)
+        del view
+        peer.close()
+    finally:
+        shm.close()
+        shm.unlink()
+
+def test_create_cpu_pool_disabled():
+    assert create_cpu_pool(0) is None
+
+def test_fractal_stats_in_process_pool():
+    # compute_histogram is replaced by a closure in conftest, so use an unpatched kernel
+    np.random.seed(0)
+    np_image = np.random.randint(0, 256, (64, 48, 3), dtype=np.uint8)
+    pool = create_cpu_pool(1)
+    try:
+        result = run_async(run_in_cpu_pool(pool, compute_fractal_stats, np_image))
+    finally:
+        pool.shutdown()
+    assert result == compute_fractal_stats(np_image)
+
+def test_cancelled_call_releases_shared_memory(monkeypatch):
+    from multiprocessing import shared_memory
+
+    created = []
+    original_share = app.offload.share_array
+
+    def tracking_share(array):
+        shm, handle = original_share(array)
+        created.append(handle[0])
+        return shm, handle
+
+    monkeypatch.setattr(app.offload, "share_array", tracking_share)
+    np_image = np.zeros((32, 32, 3), dtype=np.uint8)
+    pool = create_cpu_pool(1)
+
+    async def run():
+        task = asyncio.ensure_future(run_in_cpu_pool(pool, compute_fractal_stats, np_image))
+        await asyncio.sleep(0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    try:
+        run_async(run())
+    finally:
+        pool.shutdown()
+
+    assert len(created) == 1
+    try:
+        shared_memory.SharedMemory(name=created[0]).close()
+        leaked = True
+    except FileNotFoundError:
+        leaked = False
+    assert not leaked
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG"])
+def test_extract_metadata_from_bytes_matches_decoded_image(fmt):
+    img = Image.new('RGB', (20, 20))
+    exif = img.getexif()
+    exif[305] = "Stable Diffusion v1.5"
+    info = PngImagePlugin.PngInfo()
+    info.add_text("parameters", "masterpiece, Steps: 20, Midjourney")
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        img.save(buf, format='JPEG', exif=exif)
+    else:
+        img.save(buf, format='PNG', pnginfo=info)
+    content = buf.getvalue()
+
+    # As prepare_image decodes it, and as the worker processes receive it
+    decoded, *_ = prepare_image(content)
+    raw = np.frombuffer(content, dtype=np.uint8)
+    expected = extract_metadata(decoded)
+    assert expected["is_suspicious"]
+    assert extract_metadata_from_bytes(raw) == extract_metadata_from_bytes(content) == expected
+
+def _wait_for_outcome(timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = job_stats.snapshot()
+        if stats["running_abandoned"] == 0:
+            return stats
+        time.sleep(0.01)
+    return job_stats.snapshot()
+
+def test_timed_out_thread_job_is_reclaimed():
+    import app.main
+
+    def slow_kernel(x, cancel_token=None):
+        for _ in range(500):
+            cancel_token.raise_if_cancelled()
+            time.sleep(0.01)
+        return x
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(app.main.run_step("AI Classifier", slow_kernel, 1), timeout=0.1)
+
+    job_stats.reset()
+    start = time.monotonic()
+    run_async(run())
+    stats = _wait_for_outcome()
+    assert stats["abandoned"] == 1
+    assert stats["reclaimed"] == 1
+    assert stats["orphaned"] == 0
+    # Freed at the next checkpoint, not after the full 5s runtime
+    assert time.monotonic() - start < 1.0
+
+def test_job_without_checkpoints_counts_as_orphaned():
+    import app.main
+
+    def stubborn_kernel(x):
+        time.sleep(0.3)
+        return x
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(app.main.run_step("AI Classifier", stubborn_kernel, 1), timeout=0.05)
+
+    job_stats.reset()
+    run_async(run())
+    stats = _wait_for_outcome()
+    assert stats["abandoned"] == 1
+    assert stats["orphaned"] == 1
+    assert stats["reclaimed"] == 0
+
+def test_cancelled_process_job_is_reclaimed():
+    from app.analysis.fractaldim import fractal_dimension
+
+    np.random.seed(1)
+    img = np.random.randint(0, 256, (128, 128), dtype=np.uint8)
+    pool = create_cpu_pool(1)
+
+    async def run():
+        # Warm up the worker so the cancelled job is actually running when we give up
+        await run_in_cpu_pool(pool, fractal_dimension, img[:8, :8])
+        job_stats.reset()
+        # The reference engine takes seconds on this input
+        call = run_in_cpu_pool(pool, fractal_dimension, img, 2, None, "reference", cancellable=True)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(call, timeout=0.2)
+
+    try:
+        run_async(run())
+        stats = _wait_for_outcome()
+    finally:
+        pool.shutdown()
+    assert stats["abandoned"] == 1
+    assert stats["reclaimed"] == 1
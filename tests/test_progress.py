@@ -0,0 +1,37 @@
+from app.progress import ProgressStream, diff_status
+
+
+def test_diff_status_sends_only_new_entries_and_changed_results():
+    old = {"status": "Running", "progress": 10, "completed_steps": ["Preprocessing"],
+           "partial_results": {"width": 10}}
+    new = {"status": "Running", "progress": 40, "completed_steps": ["Preprocessing", "AI Classifier"],
+           "partial_results": {"width": 10, "ai_probability": 0.3}}
+
+    assert diff_status(old, new) == {"progress": 40, "completed_steps": ["AI Classifier"],
+                                     "partial_results": {"ai_probability": 0.3}}
+    assert diff_status(new, new) == {}
+    # A list that shrank can't be expressed as a delta
+    assert diff_status(new, old)["snapshot"] is True
+
+
+def test_progress_stream_versions():
+    status = {"status": "Starting...", "progress": 0, "completed_steps": [], "timed_out_steps": [],
+              "partial_results": {}}
+    stream = ProgressStream()
+    stream.sync(status)
+    status["completed_steps"].append("Preprocessing")
+    status["progress"] = 20
+    stream.sync(status)
+    stream.sync(status)
+
+    assert stream.version == 2
+    assert [event["version"] for event in stream.since(0)] == [1, 2]
+    assert stream.since(1) == [{"version": 2, "progress": 20, "completed_steps": ["Preprocessing"]}]
+    assert stream.since(2) == []
+    assert not stream.done
+    # A version from before a restart gets the whole current status
+    assert stream.since(7) == [{**status, "version": 2, "snapshot": True}]
+
+    status["status"] = "Complete"
+    stream.sync(status)
+    assert stream.done
@@ -0,0 +1,39 @@
+from app.taskstate import SQLiteTaskState
+from app.taskstore import TaskStore
+
+
+def test_two_processes_share_states_sessions_and_cancellations(mock_db_connection, tmp_path):
+    path = str(tmp_path / "task_state.sqlite")
+    # One store per process, on the same file
+    first = TaskStore(max_bytes=1, backend=SQLiteTaskState(path))
+    second = TaskStore(backend=SQLiteTaskState(path))
+
+    first["state"] = {"status": "Preprocessing...", "progress": 5, "completed_steps": []}
+    first["upload"] = {"shared_state": "state"}
+    first.publish("upload")
+    first.publish("state", 3)
+    # Published from a copy, by the backend thread
+    first["state"]["progress"] = 6
+    first.flush_backend()
+    assert "missing" not in second
+    assert second["upload"] == {"shared_state": "state"}
+    assert second.published("state") == ({"status": "Preprocessing...", "progress": 5, "completed_steps": []}, 3)
+    assert not second.holds("state")
+
+    first["state"].update(status="Complete", progress=100)
+    assert sorted(first.evict()) == ["state", "upload"]
+    # Spilled: the shared copy goes, the spill answers for every process
+    assert second.published("state") is None
+    assert second["state"]["status"] == "Complete"
+
+    assert first.backend.swap_session("session", "upload") is None
+    assert second.backend.swap_session("session", "next") == "upload"
+    second.backend.request_cancel("upload")
+    assert first.backend.take_cancellations(["other"]) == []
+    assert first.backend.take_cancellations(["upload", "other"]) == ["upload"]
+    assert first.backend.take_cancellations(["upload"]) == []
+
+    # A finished upload that is no longer current leaves the session alone
+    first.backend.end_session("session", "upload")
+    assert first.backend.swap_session("session", "third") == "next"
+    assert first.backend.purge(0) == 1
@@ -0,0 +1,71 @@
+import asyncio
+
+from app.taskstore import TaskStore, estimate_size
+
+
+def _finished(status="Complete", size=0):
+    return {"status": status, "progress": 100, "completed_steps": [], "timed_out_steps": [],
+            "partial_results": {"histogram_r": [0.5] * size}}
+
+
+def test_finished_tasks_spill_after_ttl_and_over_budget(mock_db_connection):
+    now = [0.0]
+    store = TaskStore(max_entries=3, ttl_seconds=60, clock=lambda: now[0])
+    store["running"] = {"status": "Preprocessing...", "progress": 5, "completed_steps": []}
+    store["state"] = _finished()
+    store["follower"] = {"shared_state": "state"}
+    store["error"] = _finished("Error")
+
+    # Four entries, three allowed: the oldest finished one goes (never the running one)
+    assert store.evict() == ["state"]
+    assert not store.holds("state")
+    # Still answers, from the spill table, and its follower still resolves to it
+    assert store["state"]["status"] == "Complete"
+    assert "follower" in store and store[store["follower"]["shared_state"]]["progress"] == 100
+    assert store.evict() == []
+
+    now[0] = 61.0
+    assert sorted(store.evict()) == ["error", "follower"]
+    assert list(store) == ["running"]
+    assert store["error"]["status"] == "Error"
+    assert "missing" not in store
+
+    footprint = store.footprint()
+    assert footprint["entries"] == footprint["running"] == 1
+    assert footprint["bytes"] == estimate_size(store["running"])
+    assert footprint["evicted"] == 3
+
+
+def test_byte_budget_evicts_oldest_finished_first(mock_db_connection):
+    now = [0.0]
+    store = TaskStore(max_bytes=1, clock=lambda: now[0])
+    store["first"] = _finished(size=500)
+    store.evict()
+    assert not store.holds("first")
+
+    store.max_bytes = estimate_size(_finished(size=500)) + 1
+    store["second"] = _finished(size=500)
+    now[0] = 1.0
+    store["third"] = _finished(size=10)
+    store["running"] = {"status": "Preprocessing...", "partial_results": {"histogram_r": [0.5] * 500}}
+    # Over budget: finished tasks go oldest first, until the rest fits (or only running ones are left)
+    assert store.evict() == ["second", "third"]
+    assert store.holds("running")
+
+
+def test_async_eviction_keeps_a_state_replaced_while_spilling(mock_db_connection):
+    store = TaskStore(max_entries=1)
+    store["first"] = _finished()
+    store["second"] = _finished("Error")
+    store["third"] = _finished()
+
+    async def run():
+        eviction = asyncio.ensure_future(store.evict_async())
+        await asyncio.sleep(0)
+        # Replaced before the spill finished: the new state stays in memory
+        store["first"] = {"status": "Preprocessing...", "completed_steps": []}
+        return await eviction
+
+    assert asyncio.run(run()) == ["second"]
+    assert store.holds("first") and store["first"]["status"] == "Preprocessing..."
+    assert store["second"]["status"] == "Error"